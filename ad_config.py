@@ -1,29 +1,33 @@
 import os
+import json
 from typing import Dict, List, Optional
 import re
 import asyncio
 import socket
 import subprocess
 import platform
+from functools import cached_property
 from pyrogram.types import Message
+from send_scheduler import sender
+from tenancy import current_tenant
 
 class AdConfig:
-    def __init__(self):
-        self.bot_url = os.environ.get('AD_BOT_URL', 'https://t.me/Master32v_bot')
-        self.web_app_url = os.environ.get('AD_WEB_APP_URL', '')
-        self.ad_enabled = os.environ.get('AD_ENABLED', 'true').lower() == 'true'
-        self.ad_frequency = int(os.environ.get('AD_FREQUENCY', '5'))  # Show ad every N interactions
+    def __init__(self, settings: Optional[dict] = None):
+        # Per-bot settings (multibot.py) take precedence over the environment
+        settings = settings or {}
+        self.bot_url = settings.get('bot_url', os.environ.get('AD_BOT_URL', 'https://t.me/Master32v_bot'))
+        self.web_app_url = settings.get('web_app_url', os.environ.get('AD_WEB_APP_URL', ''))
+        self.ad_enabled = settings.get('enabled', os.environ.get('AD_ENABLED', 'true').lower() == 'true')
+        self.ad_frequency = int(settings.get('frequency', os.environ.get('AD_FREQUENCY', '5')))  # Show ad every N interactions
         
         # User session storage for configuration
         self.user_sessions = {}
+        # Counter for ad frequency
+        self.interaction_counter = 0
         
         # Deployment environment detection
         self.is_cloud_deployment = self._detect_cloud_deployment()
         
-        # Network configuration
-        self.host_ip = self._get_host_ip()
-        self.wifi_network = self._get_wifi_network_info()
-        
         # Validate Web App URL format
         self._validate_web_app_url()
     
@@ -95,6 +99,16 @@ class AdConfig:
         """Check if user is in a configuration session"""
         return user_id in self.user_sessions
         
+    @cached_property
+    def host_ip(self) -> str:
+        """Host IP, detected on first use since it's only needed by config commands"""
+        return self._get_host_ip()
+
+    @cached_property
+    def wifi_network(self) -> dict:
+        """WiFi info, detected on first use since it spawns a subprocess"""
+        return self._get_wifi_network_info()
+
     def _get_host_ip(self) -> str:
         """Get the host IP address on WiFi network"""
         if self.is_cloud_deployment:
@@ -331,15 +345,44 @@ Your ads are now configured and will be displayed every {self.ad_frequency} inte
 # Global ad config instance
 ad_config = AdConfig()
 
-# Counter for ad frequency
-interaction_counter = 0
+def get_ad_config() -> AdConfig:
+    """The ad config of the bot handling the current update, the global one outside multibot.py"""
+    tenant = current_tenant.get()
+    return tenant.ad_config if tenant is not None and tenant.ad_config is not None else ad_config
+
+# Config sessions in progress and the ad counter survive restarts through this file
+AD_STATE_PATH = os.environ.get('AD_STATE_PATH', 'ad_state.json')
+
+def save_state(path: str = AD_STATE_PATH):
+    """Save config sessions in progress and the ad counter"""
+    if not path:
+        return
+    state = {'user_sessions': ad_config.user_sessions, 'interaction_counter': ad_config.interaction_counter}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def load_state(path: str = AD_STATE_PATH):
+    """Restore state written by save_state(), if any"""
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except Exception as e:
+        print(f"Error loading ad state from {path}: {e}")
+        return
+    # JSON object keys are strings, user ids are ints
+    ad_config.user_sessions.update({int(user_id): session for user_id, session in state.get('user_sessions', {}).items()})
+    ad_config.interaction_counter = state.get('interaction_counter', ad_config.interaction_counter)
 
 def should_show_ad() -> bool:
     """Check if ad should be shown based on frequency"""
-    global interaction_counter
-    interaction_counter += 1
+    config = get_ad_config()
+    config.interaction_counter += 1
     
-    if ad_config.ad_enabled and interaction_counter % ad_config.ad_frequency == 0:
+    if config.ad_enabled and config.interaction_counter % config.ad_frequency == 0:
         return True
     return False
 
@@ -376,14 +419,15 @@ export AD_FREQUENCY="5"
 async def handle_config_command(client, message: Message):
     """Handle the /config command to start ad configuration"""
     user_id = message.from_user.id
+    config = get_ad_config()
     
-    if ad_config.is_in_config_session(user_id):
-        await message.reply_text("You already have an active configuration session. Type /cancelconfig to cancel it first.")
+    if config.is_in_config_session(user_id):
+        await sender.reply(message, "You already have an active configuration session. Type /cancelconfig to cancel it first.")
         return
         
-    ad_config.start_configuration_session(user_id)
+    config.start_configuration_session(user_id)
     
-    network_info = ad_config.get_network_status()
+    network_info = config.get_network_status()
     
     config_msg = f"""
 🔧 **Ad Configuration Setup**
@@ -394,37 +438,38 @@ async def handle_config_command(client, message: Message):
 Please provide your Web App URL in this format:
 - https://www.example.com/
 - https://example.com/path
-- Type 'auto' to use local network IP: {ad_config.suggest_web_app_url()}
+- Type 'auto' to use local network IP: {config.suggest_web_app_url()}
 
 Type your Web App URL now or 'auto':
 """
     
-    await message.reply_text(config_msg)
+    await sender.reply(message, config_msg)
 
 async def handle_config_input(client, message: Message):
     """Handle user input during configuration"""
     user_id = message.from_user.id
+    config = get_ad_config()
     
-    if not ad_config.is_in_config_session(user_id):
+    if not config.is_in_config_session(user_id):
         return False  # Not in config session
         
-    response, is_complete = ad_config.process_config_input(user_id, message.text)
-    await message.reply_text(response)
+    response, is_complete = config.process_config_input(user_id, message.text)
+    await sender.reply(message, response)
     
     return True  # Handled as config input
 
 async def handle_cancel_config(client, message: Message):
     """Handle the /cancelconfig command"""
     user_id = message.from_user.id
-    response = ad_config.cancel_configuration(user_id)
-    await message.reply_text(response)
+    response = get_ad_config().cancel_configuration(user_id)
+    await sender.reply(message, response)
 
 async def handle_network_info(client, message: Message):
     """Handle the /network command to show network information"""
-    network_status = ad_config.get_network_status()
-    await message.reply_text(network_status)
+    network_status = get_ad_config().get_network_status()
+    await sender.reply(message, network_status)
 
 async def handle_auto_config(client, message: Message):
     """Handle the /autoconfig command to auto-configure using host IP"""
-    result = ad_config.auto_configure_local_webapp()
-    await message.reply_text(result)
+    result = get_ad_config().auto_configure_local_webapp()
+    await sender.reply(message, result)
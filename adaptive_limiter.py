@@ -0,0 +1,240 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+from tracing import annotate, record_usage
+from hedging import admitted
+
+T = TypeVar('T')
+
+
+def is_rate_limited(e: BaseException) -> bool:
+    """Gemini's 429 (google.api_core.exceptions.ResourceExhausted)"""
+    return getattr(e, "code", None) == 429 or type(e).__name__ == "ResourceExhausted"
+
+
+def _model_name(fn) -> Optional[str]:
+    """Model behind a bound generate_content/send_message method, for the request log"""
+    owner = getattr(fn, "__self__", None)
+    # A ChatSession keeps its GenerativeModel in .model
+    owner = getattr(owner, "model", owner)
+    name = getattr(owner, "model_name", None)
+    return name.rsplit("/", 1)[-1] if isinstance(name, str) else None
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for upstream model calls
+
+    The limit grows by about one per round of calls while latency stays within
+    `tolerance` times its baseline and the limit is actually what holds calls
+    back. It's cut by `backoff` when latency climbs past that (the upstream is
+    queueing) and by `rate_limit_backoff` on a 429, at most once per round
+    trip. Calls over the limit wait in a FIFO queue. Works for both coroutines
+    (`call`) and blocking calls made from threads (`call_sync`).
+    """
+
+    # How fast the latency baseline creeps up (per second) when latency stays above it
+    BASELINE_DRIFT = 0.005
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 64, tolerance: float = 1.5,
+                 backoff: float = 0.9, rate_limit_backoff: float = 0.5, window: int = 500, enabled: bool = True):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.rate_limit_backoff = rate_limit_backoff
+        self.enabled = enabled
+        # Called before every call and may raise to refuse it, e.g. for per-bot quotas
+        self.admission: Optional[Callable[[], None]] = None
+        self.limit = float(initial)
+        self.in_flight = 0
+        # Smoothed latency, and the lowest it has been lately (drifting up slowly, so a
+        # permanently slower upstream becomes the new normal)
+        self.latency: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self._observed_at = 0.0
+        self._lock = threading.Lock()
+        # (loop, future) for coroutines, (None, threading.Event) for threads
+        self._waiters: deque = deque()
+        self._no_decrease_until = 0.0
+        self.queue_waits: Deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.rate_limited = 0
+        self.decreases = 0
+
+    def _dispatch_locked(self) -> list:
+        """Hand free slots to waiters, returns the ones to wake outside the lock"""
+        woken = []
+        while self._waiters and self.in_flight < int(self.limit):
+            woken.append(self._waiters.popleft())
+            self.in_flight += 1
+        return woken
+
+    def _wake(self, woken: list):
+        for loop, waiter in woken:
+            if loop is None:
+                waiter.set()
+            else:
+                loop.call_soon_threadsafe(self._grant, waiter)
+
+    def _grant(self, future: asyncio.Future):
+        if future.cancelled():
+            # The caller gave up just as its turn came
+            self._release(None, False)
+        else:
+            future.set_result(None)
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, future))
+                    granted = False
+                except ValueError:
+                    granted = future.done() and not future.cancelled()
+            if granted:
+                self._release(None, False)
+            raise
+
+    def acquire_sync(self):
+        with self._lock:
+            if not self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            event = threading.Event()
+            self._waiters.append((None, event))
+        event.wait()
+
+    def _release(self, latency: Optional[float], rate_limited: bool):
+        now = time.monotonic()
+        with self._lock:
+            # Only grow when the limit is what's holding calls back
+            saturated = bool(self._waiters) or self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if rate_limited:
+                self.rate_limited += 1
+                self._decrease_locked(self.rate_limit_backoff, now)
+            elif latency is not None:
+                self._observe_locked(latency, saturated, now)
+            woken = self._dispatch_locked()
+        self._wake(woken)
+
+    def _observe_locked(self, latency: float, saturated: bool, now: float):
+        if self.latency is None:
+            self.latency = self.baseline = latency
+            self._observed_at = now
+        self.latency += 0.2 * (latency - self.latency)
+        self.baseline = min(self.latency, self.baseline * (1 + self.BASELINE_DRIFT * (now - self._observed_at)))
+        self._observed_at = now
+        if self.latency > self.baseline * self.tolerance:
+            self._decrease_locked(self.backoff, now)
+        elif saturated:
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+    def _decrease_locked(self, factor: float, now: float):
+        # Calls already in flight were sent at the old limit, give the cut one round trip to show
+        if now < self._no_decrease_until:
+            return
+        self.limit = max(self.limit * factor, self.min_limit)
+        self.decreases += 1
+        self._no_decrease_until = now + (self.latency or 1.0)
+
+    def _started(self, waited: float):
+        with self._lock:
+            self.calls += 1
+            self.queue_waits.append(waited)
+        if waited > 0.001:
+            annotate(queue_ms=round(waited * 1000))
+
+    async def call(self, fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        """Await fn(*args, **kwargs) once there's a free slot"""
+        if self.admission is not None:
+            self.admission()
+        if not self.enabled:
+            admitted()
+            result = await fn(*args, **kwargs)
+        else:
+            queued = time.monotonic()
+            await self.acquire()
+            start = time.monotonic()
+            self._started(start - queued)
+            admitted()
+            try:
+                result = await fn(*args, **kwargs)
+            except BaseException as e:
+                self._release(None, is_rate_limited(e))
+                raise
+            self._release(time.monotonic() - start, False)
+        record_usage(_model_name(fn), getattr(result, "usage_metadata", None))
+        return result
+
+    def call_sync(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Blocking version of call(), for threads"""
+        if self.admission is not None:
+            self.admission()
+        if not self.enabled:
+            result = fn(*args, **kwargs)
+        else:
+            queued = time.monotonic()
+            self.acquire_sync()
+            start = time.monotonic()
+            self._started(start - queued)
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                self._release(None, is_rate_limited(e))
+                raise
+            self._release(time.monotonic() - start, False)
+        record_usage(_model_name(fn), getattr(result, "usage_metadata", None))
+        return result
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            waits = list(self.queue_waits)
+            return {
+                "limit": round(self.limit, 1),
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "queue_wait_p50_ms": round(_percentile(waits, 0.5) * 1000, 1),
+                "queue_wait_p95_ms": round(_percentile(waits, 0.95) * 1000, 1),
+                "latency_ms": round((self.latency or 0) * 1000),
+                "baseline_ms": round((self.baseline or 0) * 1000),
+                "calls": self.calls,
+                "rate_limited": self.rate_limited,
+                "decreases": self.decreases,
+            }
+
+    def stats(self) -> str:
+        m = self.metrics()
+        return (f"limit {m['limit']}, in flight {m['in_flight']}, queued {m['queued']}, "
+                f"queue wait p50/p95 {m['queue_wait_p50_ms']}/{m['queue_wait_p95_ms']} ms, "
+                f"latency {m['latency_ms']} ms (baseline {m['baseline_ms']}), "
+                f"429s {m['rate_limited']}, cuts {m['decreases']}")
+
+
+# Global limiter in front of every Gemini call made by this process
+upstream_limiter = AdaptiveLimiter(
+    initial=int(os.environ.get('UPSTREAM_LIMIT_INITIAL', '8')),
+    min_limit=int(os.environ.get('UPSTREAM_LIMIT_MIN', '1')),
+    max_limit=int(os.environ.get('UPSTREAM_LIMIT_MAX', '64')),
+    tolerance=float(os.environ.get('UPSTREAM_LATENCY_TOLERANCE', '1.5')),
+    enabled=os.environ.get('UPSTREAM_LIMITER_ENABLED', 'true').lower() == 'true',
+)
@@ -1,39 +1,131 @@
-from flask import Flask, render_template, request, jsonify
-import google.generativeai as genai
+from flask import Flask, render_template, request, jsonify, abort
 import os
+import hmac
+from semantic_cache import semantic_cache
+from chat_history import create_compactor
+from prompt_registry import prompt_registry
+import gemini
+from telegram_auth import init_data_verifier
+from assets import Asset, AssetPipeline, make_response, IMMUTABLE_CACHE_CONTROL, PAGE_CACHE_CONTROL
+from tracing import tracer, span, annotate, record_error
+from profiler import profiler, ProfilerBusy
+from adaptive_limiter import upstream_limiter
+from request_log import request_log
 
 app = Flask(__name__)
 
+# Minified, fingerprinted and precompressed once at startup
+asset_pipeline = AssetPipeline(app.static_folder).build()
+# The index page only depends on asset URLs, so it's rendered once
+index_page = None
+
 # Configure Gemini AI
 API_KEY = os.environ.get('API_KEY', 'your-api-key-here')
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
+# Allow chatting without Telegram initData (e.g. opening the page in a browser), without history
+ALLOW_ANONYMOUS = os.environ.get('WEBAPP_ALLOW_ANONYMOUS', 'false').lower() == 'true'
+# google.generativeai is imported when the first model is used
+gemini.configure(api_key=API_KEY)
+model = gemini.LazyModel("gemini-1.5-flash")
+# Import it in the background, so the first request doesn't pay for it all
+gemini.prewarm()
+# Per-user conversation history
+chat_history = create_compactor(model)
+
+@app.context_processor
+def inject_asset_url():
+    return {'asset_url': asset_pipeline.url}
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    global index_page
+    if index_page is None:
+        index_page = Asset('index.html', render_template('index.html').encode('utf-8'), 'text/html')
+    return make_response(index_page, request, PAGE_CACHE_CONTROL)
+
+@app.route('/assets/<path:name>')
+def assets(name):
+    asset = asset_pipeline.get(name)
+    if asset is None:
+        abort(404)
+    return make_response(asset, request, IMMUTABLE_CACHE_CONTROL)
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
+    with tracer.request("api_chat"):
+        try:
+            data = request.get_json()
+            message = data.get('message', '')
+
+            if not message:
+                return jsonify({'error': 'No message provided'}), 400
+
+            # Only trust the user id signed by Telegram, shared with the bot's private chat
+            with span("auth"):
+                user = init_data_verifier.verify(data.get('init_data', ''))
+            if user is None and not ALLOW_ANONYMOUS:
+                return jsonify({'error': 'Invalid or missing Telegram initData'}), 401
+            user_id = user['id'] if user else None
+            annotate(user_id=user_id)
+
+            # Reuse a cached answer for near-duplicate questions, unless it's a follow-up
+            with span("history"):
+                fresh = user_id is None or not chat_history.has_history(user_id)
+            with span("cache"):
+                answer = semantic_cache.get(message, "chat") if fresh else None
+            annotate(cached=answer is not None)
+            if answer is None:
+                # Generate response using Gemini
+                with span("history"):
+                    history = chat_history.build_history(user_id, message) if user_id is not None else []
+                chat = prompt_registry.model("chat").start_chat(history=history)
+                with span("gemini"):
+                    response = upstream_limiter.call_sync(chat.send_message, message)
+                answer = response.text
+                if fresh:
+                    semantic_cache.put(message, answer, "chat")
+            if user_id is not None:
+                chat_history.add_turn(user_id, message, answer)
+
+            return jsonify({
+                'response': answer,
+                'user_id': user_id
+            })
+
+        except Exception as e:
+            record_error(e)
+            return jsonify({'error': str(e)}), 500
+
+# Admin diagnostics, enabled by setting ADMIN_TOKEN and sent as the X-Admin-Token header
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+def require_admin():
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        abort(404)
+
+@app.route('/admin/slow')
+def admin_slow():
+    """Latest slow or failed requests with their phase timings"""
+    require_admin()
+    return jsonify({
+        'threshold_ms': tracer.slow_threshold * 1000,
+        'requests': tracer.requests,
+        'slow': [trace.to_dict() for trace in tracer.recent(request.args.get('limit', 20, type=int))],
+        'gemini': upstream_limiter.metrics(),
+        'request_log': request_log.stats(),
+    })
+
+@app.route('/admin/profile')
+def admin_profile():
+    """Sample this worker for a few seconds, ?format=collapsed returns flamegraph input"""
+    require_admin()
     try:
-        data = request.get_json()
-        message = data.get('message', '')
-        user_id = data.get('user_id', 'web_user')
-        
-        if not message:
-            return jsonify({'error': 'No message provided'}), 400
-        
-        # Generate response using Gemini
-        chat = model.start_chat()
-        response = chat.send_message(message)
-        
-        return jsonify({
-            'response': response.text,
-            'user_id': user_id
-        })
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        profile = profiler.run(request.args.get('seconds', 10, type=float))
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    if request.args.get('format') == 'collapsed':
+        return profile.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return profile.top(30), 200, {'Content-Type': 'text/plain; charset=utf-8'}
 
 @app.route('/health')
 def health():
@@ -0,0 +1,158 @@
+import os
+import re
+import sys
+import gzip
+import json
+import hashlib
+import mimetypes
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip is used alone without it
+    brotli = None
+
+# Assets referenced by templates, relative to the static folder
+ASSETS = ['css/style.css', 'js/app.js']
+
+# Fingerprinted assets never change, caches may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Pages must be revalidated, they point at the current fingerprints
+PAGE_CACHE_CONTROL = 'no-cache'
+
+
+def minify_css(source: str) -> str:
+    """Strip comments and whitespace from CSS"""
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{}:;,>])\s*', r'\1', source)
+    return source.replace(';}', '}').strip()
+
+
+def minify_js(source: str) -> str:
+    """Conservatively minify JS: drop comment-only lines, indentation and blank lines"""
+    lines = []
+    in_block_comment = False
+    for line in source.splitlines():
+        stripped = line.strip()
+        if in_block_comment:
+            in_block_comment = '*/' not in stripped
+            continue
+        if stripped.startswith('/*'):
+            in_block_comment = '*/' not in stripped
+            continue
+        if not stripped or stripped.startswith('//'):
+            continue
+        lines.append(stripped)
+    return '\n'.join(lines)
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+class Asset:
+    """One static file with its precompressed variants"""
+
+    def __init__(self, name: str, body: bytes, mimetype: str):
+        self.name = name
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.variants: Dict[str, bytes] = {'identity': body}
+        self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """Pick the smallest variant the client accepts"""
+        accepted = set()
+        for token in (accept_encoding or '').lower().split(','):
+            coding, _, params = token.strip().partition(';')
+            if params.strip().replace(' ', '') in ('q=0', 'q=0.0'):
+                continue
+            accepted.add(coding.strip())
+        candidates = [e for e in ('br', 'gzip') if e in self.variants and (e in accepted or '*' in accepted)]
+        candidates.append('identity')
+        return min(candidates, key=lambda e: len(self.variants[e]))
+
+    def etag_for(self, encoding: str) -> str:
+        """Strong ETag of one variant, each content coding has its own"""
+        suffix = {'identity': '', 'gzip': '-gz', 'br': '-br'}[encoding]
+        return f'"{self.etag}{suffix}"'
+
+
+class AssetPipeline:
+    """Minifies, fingerprints and precompresses static assets once at startup"""
+
+    def __init__(self, static_folder: str, url_prefix: str = '/assets', minify: bool = True):
+        self.static_folder = static_folder
+        self.url_prefix = url_prefix
+        self.minify = minify
+        self.urls: Dict[str, str] = {}
+        self.assets: Dict[str, Asset] = {}
+
+    def build(self, names=ASSETS):
+        for name in names:
+            path = os.path.join(self.static_folder, name)
+            with open(path, encoding='utf-8') as f:
+                source = f.read()
+            base, ext = os.path.splitext(name)
+            if self.minify and ext in MINIFIERS:
+                source = MINIFIERS[ext](source)
+            body = source.encode('utf-8')
+            fingerprint = hashlib.sha256(body).hexdigest()[:10]
+            fingerprinted = f"{base}.{fingerprint}{ext}"
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            self.assets[fingerprinted] = Asset(fingerprinted, body, mimetype)
+            self.urls[name] = f"{self.url_prefix}/{fingerprinted}"
+        return self
+
+    def url(self, name: str) -> str:
+        """URL of the current fingerprinted version of an asset"""
+        return self.urls[name]
+
+    def get(self, fingerprinted: str) -> Optional[Asset]:
+        return self.assets.get(fingerprinted)
+
+    def write(self, out_dir: str):
+        """Write every variant and a manifest, for serving from a CDN or reverse proxy"""
+        suffixes = {'identity': '', 'gzip': '.gz', 'br': '.br'}
+        for asset in self.assets.values():
+            path = os.path.join(out_dir, asset.name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            for encoding, body in asset.variants.items():
+                with open(path + suffixes[encoding], 'wb') as f:
+                    f.write(body)
+        with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+            json.dump(self.urls, f, indent=2)
+
+
+def make_response(asset: Asset, request, cache_control: str):
+    """Build a Flask response for an asset, honouring ETag and Accept-Encoding"""
+    from flask import Response
+
+    encoding = asset.negotiate(request.headers.get('Accept-Encoding', ''))
+    etag = asset.etag_for(encoding)
+    headers = {
+        'Cache-Control': cache_control,
+        'ETag': etag,
+        'Vary': 'Accept-Encoding',
+    }
+    # Weak comparison, as for any If-None-Match
+    tags = [tag.strip() for tag in (request.headers.get('If-None-Match') or '').split(',')]
+    if '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags):
+        return Response(status=304, headers=headers)
+
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(asset.variants[encoding], mimetype=asset.mimetype, headers=headers)
+
+
+if __name__ == "__main__":
+    # Usage: python assets.py [output dir]
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join('static', 'dist')
+    pipeline = AssetPipeline(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')).build()
+    pipeline.write(out_dir)
+    for name, url in pipeline.urls.items():
+        asset = pipeline.get(url[len(pipeline.url_prefix) + 1:])
+        sizes = ', '.join(f"{encoding}: {len(body)} B" for encoding, body in asset.variants.items())
+        print(f"{name} -> {asset.name} ({sizes})")
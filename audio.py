@@ -0,0 +1,123 @@
+import os
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+from ttl_cache import TTLCache
+from tracing import span, annotate
+
+# Telegram mime types of clips Gemini accepts as inline audio, and the type to send them as
+GEMINI_AUDIO_TYPES = {
+    "audio/ogg": "audio/ogg",
+    "audio/opus": "audio/ogg",
+    "audio/mpeg": "audio/mp3",
+    "audio/mp3": "audio/mp3",
+    "audio/wav": "audio/wav",
+    "audio/x-wav": "audio/wav",
+    "audio/aac": "audio/aac",
+    "audio/flac": "audio/flac",
+    "audio/x-flac": "audio/flac",
+    "audio/aiff": "audio/aiff",
+    "audio/x-aiff": "audio/aiff",
+}
+
+TRANSCRIBE_PROMPT = "Transcribe this audio."
+
+QUESTION_PROMPT = """Transcript of an audio message:
+{transcript}
+
+{question}"""
+
+
+class AudioError(Exception):
+    """An audio message that can't be used, the message is shown to the user"""
+
+
+def audio_media(message) -> Optional[object]:
+    """The voice note or audio file of a message, if any"""
+    if message is None:
+        return None
+    return message.voice or message.audio
+
+
+def audio_prompt(transcript: str, question: str = "") -> str:
+    """The prompt for a clip: its transcript, with the question about it if there is one"""
+    if not question:
+        return transcript
+    return QUESTION_PROMPT.format(transcript=transcript, question=question)
+
+
+class AudioTranscriber:
+    """Transcribes voice notes and audio files with Gemini, once per file
+
+    Clips are downloaded in memory and sent to Gemini as inline audio parts,
+    no temp files or ffmpeg. Transcripts are cached per file_unique_id, so
+    more questions about the same clip (or forwards of it) don't download or
+    upload the audio again.
+    """
+
+    def __init__(self, transcribe: Callable[[list], Awaitable[str]], max_bytes: int = 15 * 2 ** 20,
+                 max_seconds: int = 600, cache_size: int = 1000, cache_ttl: float = 86400):
+        self.transcribe = transcribe
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.transcripts: TTLCache[str] = TTLCache(ttl=cache_ttl, max_entries=cache_size)
+        # Clips being transcribed, so simultaneous questions about one clip share the upload
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    def check(self, media) -> str:
+        """Gemini mime type of a supported clip, checked before anything is downloaded"""
+        # Voice notes are always OGG/Opus, mime_type may be missing on them
+        mime_type = (getattr(media, "mime_type", None) or "audio/ogg").split(";")[0].lower()
+        if mime_type not in GEMINI_AUDIO_TYPES:
+            raise AudioError("This audio format isn't supported, send a voice note or an MP3, OGG, WAV, AAC or FLAC file.")
+        if (getattr(media, "file_size", 0) or 0) > self.max_bytes:
+            raise AudioError(f"This audio is too large, the limit is {self.max_bytes // 2 ** 20} MB.")
+        if (getattr(media, "duration", 0) or 0) > self.max_seconds:
+            raise AudioError(f"This audio is too long, the limit is {self.max_seconds // 60} minutes.")
+        return GEMINI_AUDIO_TYPES[mime_type]
+
+    async def transcript(self, media, download: Callable[[], Awaitable]) -> str:
+        """Transcript of a clip, `download` fetches it in memory if it isn't cached"""
+        key = media.file_unique_id
+        text = self.transcripts.get(key)
+        annotate(cached=text is not None)
+        if text is not None:
+            return text
+        mime_type = self.check(media)
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = asyncio.ensure_future(self._transcribe(key, mime_type, download))
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _transcribe(self, key: str, mime_type: str, download: Callable[[], Awaitable]) -> str:
+        with span("download"):
+            data = await download()
+        data = data.getvalue() if hasattr(data, "getvalue") else bytes(data)
+        # file_size isn't always known up front
+        if len(data) > self.max_bytes:
+            raise AudioError(f"This audio is too large, the limit is {self.max_bytes // 2 ** 20} MB.")
+        self.uploads += 1
+        self.uploaded_bytes += len(data)
+        with span("gemini"):
+            text = (await self.transcribe([{"mime_type": mime_type, "data": data}, TRANSCRIBE_PROMPT])).strip()
+        if not text:
+            raise AudioError("I couldn't make out any speech in this audio.")
+        # Cached here rather than by the caller, a superseded request still leaves the transcript behind
+        self.transcripts.put(key, text)
+        return text
+
+    def stats(self) -> str:
+        return (f"transcripts cached: {len(self.transcripts)}, uploads: {self.uploads} "
+                f"({self.uploaded_bytes / 2 ** 20:.1f} MB), cache hits: {self.transcripts.hits}")
+
+
+def create_transcriber(transcribe: Callable[[list], Awaitable[str]]) -> AudioTranscriber:
+    return AudioTranscriber(
+        transcribe,
+        max_bytes=int(os.environ.get('AUDIO_MAX_MB', '15')) * 2 ** 20,
+        max_seconds=int(os.environ.get('AUDIO_MAX_SECONDS', '600')),
+        cache_size=int(os.environ.get('AUDIO_CACHE_SIZE', '1000')),
+        cache_ttl=float(os.environ.get('AUDIO_CACHE_TTL', '86400')),
+    )
@@ -0,0 +1,78 @@
+# Benchmark: web app first-load and repeat-visit bytes/time, before and after the asset pipeline
+# Also checks that each content coding has its own ETag.
+# Usage: python benchmarks/bench_assets.py [iterations]
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+warnings.filterwarnings("ignore")
+
+from flask import render_template
+import app as webapp
+
+BROWSER_HEADERS = {'Accept-Encoding': 'gzip, deflate, br'}
+
+
+def baseline_load(client):
+    """Old behaviour: template rendered per request, plain files from /static"""
+    with webapp.app.test_request_context('/'):
+        page = render_template('index.html').encode('utf-8')
+    total = len(page)
+    for name in ('css/style.css', 'js/app.js'):
+        response = client.get(f'/static/{name}', headers=BROWSER_HEADERS)
+        total += len(response.data)
+        response.close()
+    return total
+
+
+def pipeline_load(client, etags=None):
+    """New behaviour: cached page plus fingerprinted, precompressed assets"""
+    headers = dict(BROWSER_HEADERS)
+    if etags:
+        # Repeat visit: assets are immutable in the browser cache, only the page is revalidated
+        headers['If-None-Match'] = etags['/']
+        return len(client.get('/', headers=headers).data), etags
+
+    response = client.get('/', headers=headers)
+    total = len(response.data)
+    etags = {'/': response.headers['ETag']}
+    for name in ('css/style.css', 'js/app.js'):
+        total += len(client.get(webapp.asset_pipeline.url(name), headers=headers).data)
+    return total, etags
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return result, (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    client = webapp.app.test_client()
+
+    before, before_ms = timed(lambda: baseline_load(client), iterations)
+    (after, etags), after_ms = timed(lambda: pipeline_load(client), iterations)
+    (repeat, _), repeat_ms = timed(lambda: pipeline_load(client, etags), iterations)
+
+    print(f"{'':<28}{'bytes':>8}{'ms/load':>10}")
+    print(f"{'before (first load)':<28}{before:>8}{before_ms:>10.3f}")
+    print(f"{'after (first load)':<28}{after:>8}{after_ms:>10.3f}")
+    print(f"{'after (repeat visit)':<28}{repeat:>8}{repeat_ms:>10.3f}")
+    print(f"\nfirst-load bytes saved: {before - after} ({(1 - after / before) * 100:.1f}%)")
+
+    # A gzip ETag must not revalidate the identity variant, or a cache could serve one for the other
+    url = webapp.asset_pipeline.url('js/app.js')
+    gzip_etag = client.get(url, headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    plain = client.get(url, headers={'If-None-Match': gzip_etag})
+    ok = plain.status_code == 200 and plain.headers['ETag'] != gzip_etag \
+        and client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzip_etag}).status_code == 304
+    print(f"{'ok  ' if ok else 'FAIL'} each content coding has its own ETag ({gzip_etag} for gzip, {plain.headers['ETag']} for identity)")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
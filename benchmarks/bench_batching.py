@@ -0,0 +1,89 @@
+# Benchmark: latency/throughput trade-off of /askai micro-batching at different windows
+# Usage: python benchmarks/bench_batching.py [questions rate/s]
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from micro_batcher import MicroBatcher
+
+GROUPS = 5
+# Upstream model: a fixed round-trip cost plus a per-question generation cost,
+# with a concurrency cap standing in for the API quota
+BASE_LATENCY = 0.6
+PER_QUESTION = 0.08
+UPSTREAM_CONCURRENCY = 8
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(pct / 100 * len(ordered)), len(ordered) - 1)]
+
+
+async def run(window: float, questions: int, rate: float, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    upstream = asyncio.Semaphore(UPSTREAM_CONCURRENCY)
+    calls = 0
+
+    async def call(n_questions: int):
+        nonlocal calls
+        async with upstream:
+            calls += 1
+            await asyncio.sleep(BASE_LATENCY + PER_QUESTION * n_questions)
+
+    async def answer_one(question):
+        await call(1)
+        return f"answer to {question}"
+
+    async def answer_batch(prompt):
+        ids = json.loads(prompt[prompt.index("["):])
+        await call(len(ids))
+        return json.dumps([{"id": q["id"], "answer": f"answer to {q['question']}"} for q in ids])
+
+    batcher = MicroBatcher(answer_one, answer_batch, window=window, max_batch=8)
+    latencies = []
+
+    async def ask(group, index):
+        start = time.perf_counter()
+        answer = await batcher.ask(group, f"question {index}")
+        assert answer == f"answer to question {index}"
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tasks = []
+    for index in range(questions):
+        await asyncio.sleep(rng.expovariate(rate))
+        tasks.append(asyncio.create_task(ask(rng.randrange(GROUPS), index)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    return {
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "calls": calls,
+        "throughput": questions / elapsed,
+        "batch": batcher.batched_questions / batcher.batches if batcher.batches else 1.0,
+    }
+
+
+async def main():
+    if len(sys.argv) > 2:
+        scenarios = [("custom", int(sys.argv[1]), float(sys.argv[2]))]
+    else:
+        scenarios = [("quiet", 60, 5.0), ("peak", 200, 30.0)]
+    print(f"{GROUPS} groups, upstream {BASE_LATENCY}s + {PER_QUESTION}s/question, "
+          f"{UPSTREAM_CONCURRENCY} concurrent")
+    for name, questions, rate in scenarios:
+        print(f"\n{name}: {questions} questions at {rate}/s")
+        print(f"{'window ms':>10}{'p50 ms':>9}{'p99 ms':>9}{'calls':>7}{'avg batch':>11}{'q/s':>7}")
+        for window_ms in (0, 10, 25, 50, 100, 200):
+            r = await run(window_ms / 1000, questions, rate)
+            print(f"{window_ms:>10}{r['p50']:>9.0f}{r['p99']:>9.0f}{r['calls']:>7}"
+                  f"{r['batch']:>11.2f}{r['throughput']:>7.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
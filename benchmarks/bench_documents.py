@@ -0,0 +1,65 @@
+# Benchmark: document Q&A latency for different map concurrency caps, and follow-up questions
+# Usage: python benchmarks/bench_documents.py [tokens]
+import os
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini
+from documents import DocumentQA
+
+WORDS = ["revenue", "growth", "market", "customer", "product", "quarter", "risk", "strategy", "cost", "team"]
+
+
+def make_document(tokens: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    paragraphs = []
+    size = 0
+    while size < tokens * 4:
+        paragraph = " ".join(rng.choices(WORDS, k=rng.randint(40, 120))) + "."
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs).encode()
+
+
+async def download(data: bytes, speed: float, chunk_size: int = 64 * 1024):
+    """Like Client.stream_media: chunks arriving at `speed` bytes/second"""
+    for start in range(0, len(data), chunk_size):
+        await asyncio.sleep(chunk_size / speed)
+        yield data[start:start + chunk_size]
+
+
+async def scenario(data: bytes, concurrency: int, speed: float):
+    backend = fake_gemini.FakeGemini(latency="lognormal:median=1.0,sigma=0.3", answer_words=80)
+
+    async def generate(prompt: str) -> str:
+        return (await backend.generate_async(prompt)).text
+
+    qa = DocumentQA(generate, concurrency=concurrency)
+    start = time.perf_counter()
+    await qa.ask("doc", "report.txt", lambda: download(data, speed), "text", "What are the main risks?")
+    first = time.perf_counter() - start
+    calls = backend.calls
+    start = time.perf_counter()
+    await qa.ask("doc", "report.txt", lambda: download(data, speed), "text", "Who is the customer?")
+    follow_up = time.perf_counter() - start
+    return first, follow_up, calls, backend.calls - calls, backend.max_in_flight
+
+
+async def main(tokens: int):
+    data = make_document(tokens)
+    speed = 2 * 2 ** 20
+    print(f"{len(data) / 2 ** 20:.1f} MB text document (~{tokens} tokens), downloaded at 2 MB/s, "
+          f"fake Gemini median 1 s, 6000-token chunks")
+    print(f"{'concurrency':<13}{'first answer':>14}{'calls':>7}{'follow-up':>11}{'calls':>7}{'peak':>6}")
+    for concurrency in (1, 4, 8):
+        first, follow_up, calls, follow_calls, peak = await scenario(data, concurrency, speed)
+        print(f"{concurrency:<13}{first:>13.2f}s{calls:>7}{follow_up:>10.2f}s{follow_calls:>7}{peak:>6}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 120000))
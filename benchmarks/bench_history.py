@@ -0,0 +1,62 @@
+# Benchmark: prompt size per turn with and without history compaction
+# Usage: python benchmarks/bench_history.py [turns]
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_history import HistoryCompactor, estimate_tokens
+
+WORDS = "gemini telegram python answer question model token latency cache history summary".split()
+
+
+def fake_text(n_words: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(n_words))
+
+
+def fake_summarize(prompt: str) -> str:
+    # Behaves like a model that respects the word limit, with some latency
+    time.sleep(0.01)
+    return " ".join(prompt.split()[-200:])
+
+
+def history_tokens(history) -> int:
+    return sum(estimate_tokens(part) for item in history for part in item["parts"])
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    random.seed(0)
+    compactor = HistoryCompactor(summarize_fn=fake_summarize, keep_turns=6, max_prompt_tokens=4000)
+    naive_tokens = 0
+    sizes = []
+
+    print(f"{'turn':>5} {'naive':>8} {'compacted':>10} {'build ms':>9}")
+    for turn in range(1, turns + 1):
+        prompt = fake_text(30)
+        answer = fake_text(250)
+
+        start = time.perf_counter()
+        history = compactor.build_history("bench", prompt)
+        build_ms = (time.perf_counter() - start) * 1000
+        compacted = history_tokens(history) + estimate_tokens(prompt)
+        naive_tokens += estimate_tokens(prompt)
+        sizes.append(compacted)
+
+        if turn == 1 or turn % 10 == 0:
+            print(f"{turn:>5} {naive_tokens:>8} {compacted:>10} {build_ms:>9.3f}")
+
+        naive_tokens += estimate_tokens(answer)
+        compactor.add_turn("bench", prompt, answer)
+        # Give the background summarizer a chance, like the gap between user messages
+        time.sleep(0.002)
+
+    tail = sizes[len(sizes) // 2:]
+    print(f"\nmax prompt tokens, second half: {max(tail)} (cap {compactor.max_prompt_tokens})")
+    print(f"naive prompt tokens at turn {turns}: {naive_tokens}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Scenario: chat history (chat_history.py) with a slow conversation store, e.g. a remote MongoDB
+# Measures how long the event loop is blocked per private message, checks the bot/web app handoff,
+# that turns written by both at once are all kept, and that store writes don't wait behind a slow summary.
+# Usage: python benchmarks/bench_history_store.py [store_latency_ms]
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_history import HistoryCompactor
+from conversation_store import SQLiteConversationStore
+
+
+class SlowStore(SQLiteConversationStore):
+    """SQLite with a network round-trip added to every call"""
+
+    def __init__(self, path: str, latency: float):
+        super().__init__(path)
+        self.latency = latency
+        self.calls = 0
+        self.saved = threading.Event()
+
+    def version(self, key):
+        self.calls += 1
+        time.sleep(self.latency)
+        return super().version(key)
+
+    def load(self, key):
+        self.calls += 1
+        time.sleep(self.latency)
+        return super().load(key)
+
+    def save(self, key, state):
+        self.calls += 1
+        time.sleep(self.latency)
+        saved = super().save(key, state)
+        self.saved.set()
+        return saved
+
+
+async def private_message(history: HistoryCompactor, chat_id, text: str) -> float:
+    """What the bot's private chat handler does with the history, returns the time the loop was blocked"""
+    blocked = 0.0
+    await history.refresh(chat_id)
+    start = time.perf_counter()
+    history.has_history(chat_id)
+    history.build_history(chat_id, text)
+    blocked += time.perf_counter() - start
+    await asyncio.sleep(0.05)  # Gemini
+    await history.refresh(chat_id)
+    start = time.perf_counter()
+    history.add_turn(chat_id, text, "answer")
+    return blocked + time.perf_counter() - start
+
+
+def check(name: str, ok: bool) -> bool:
+    print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    return ok
+
+
+async def main(latency: float) -> bool:
+    path = tempfile.mktemp(suffix=".db")
+    try:
+        store = SlowStore(path, latency)
+        bot = HistoryCompactor(store=store, freshness=5.0)
+        web = HistoryCompactor(store=SQLiteConversationStore(path), freshness=0.5)
+
+        print(f"Store round-trip {latency * 1000:.0f} ms")
+        blocked = [await private_message(bot, 1, f"question {n}") for n in range(20)]
+        print(f"  event loop blocked per private message: {max(blocked) * 1000:.2f} ms max "
+              f"(3 round-trips, {3 * latency * 1000:.0f} ms, when called directly)")
+        results = [check("the loop never waits for the store", max(blocked) < latency / 2)]
+
+        # The user switches to the web app, which sees the bot's turns, then back to the bot
+        await asyncio.sleep(0.2)
+        results.append(check("the web app sees the bot's turns", len(web.build_history(1)) > 0))
+        web.add_turn(1, "from the web app", "answer")
+        await asyncio.sleep(bot.freshness)
+        await bot.refresh(1)
+        results.append(check("the bot sees the web app's turn after HISTORY_FRESH_SECONDS",
+                             any("from the web app" in part for turn in bot.build_history(1) for part in turn["parts"])))
+
+        # Both change the conversation within HISTORY_FRESH_SECONDS: neither turn is lost
+        await bot.refresh(3)
+        web.build_history(3)
+        web.add_turn(3, "from the web app", "answer")
+        await asyncio.sleep(0.1)
+        bot.add_turn(3, "my name is Bob", "hi Bob")
+        await asyncio.sleep(0.2)
+        stored = [turn[0] for turn in store.load("3")["turns"]]
+        await bot.refresh(3)
+        seen = [turn["parts"][0] for turn in bot.build_history(3)[::2]]
+        print(f"  concurrent turns: store {stored}, bot {seen}, {bot.conflicts} write conflict")
+        results.append(check("concurrent turns from both processes are kept", stored == ["from the web app", "my name is Bob"]))
+        results.append(check("the bot's view matches the store after a conflict", seen == stored))
+
+        # A summary stuck behind a saturated Gemini limit doesn't hold up store writes
+        release = threading.Event()
+        slow = HistoryCompactor(summarize_fn=lambda prompt: release.wait(5) and "summary", keep_turns=1,
+                                store=store)
+        for n in range(3):
+            slow.add_turn(2, f"question {n}", "answer")
+        store.saved.clear()
+        start = time.perf_counter()
+        slow.add_turn(2, "one more", "answer")
+        written = store.saved.wait(2)
+        print(f"  store write during a slow summary: {(time.perf_counter() - start) * 1000:.0f} ms")
+        release.set()
+        results.append(check("writes don't wait for summaries", written))
+        return all(results)
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main(float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.05)) else 1)
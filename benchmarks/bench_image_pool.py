@@ -0,0 +1,109 @@
+# Benchmark: event-loop lag during a burst of large photos, inline PIL vs the image pool
+# Also checks that the pool recovers when a worker dies (e.g. OOM-killed on a huge image)
+# Usage: python benchmarks/bench_image_pool.py [images] [width]
+import io
+import os
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL.Image
+from image_pool import ImagePool, ImageWorkerCrashed, preprocess_image
+
+TICK = 0.005
+
+
+def make_photo(width: int, seed: int) -> bytes:
+    """A camera-sized JPEG: a gradient with noise, so it doesn't compress to nothing"""
+    height = width * 3 // 4
+    rng = random.Random(seed)
+    small = PIL.Image.frombytes("RGB", (width // 8, height // 8), rng.randbytes(width // 8 * height // 8 * 3))
+    image = small.resize((width, height), PIL.Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def inline_process(data: bytes) -> bytes:
+    """The old path: full decode and re-encode on the event loop thread"""
+    with PIL.Image.open(io.BytesIO(data)) as img:
+        img.load()
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def crash(_: bytes):
+    """What the OOM killer does to a worker"""
+    os._exit(1)
+
+
+async def measure(burst) -> dict:
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    await burst()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick_task
+    lags.sort()
+    return {
+        "burst_s": elapsed,
+        "lag_p50_ms": lags[len(lags) // 2] * 1000,
+        "lag_p99_ms": lags[int(len(lags) * 0.99)] * 1000,
+        "lag_max_ms": lags[-1] * 1000,
+    }
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    photos = [make_photo(width, seed) for seed in range(count)]
+    print(f"{count} photos, {width}px wide, {sum(map(len, photos)) / 2 ** 20:.1f} MB total\n")
+
+    async def inline_burst():
+        async def one(data):
+            await asyncio.sleep(0)
+            inline_process(data)
+        await asyncio.gather(*(one(data) for data in photos))
+
+    pool = ImagePool(workers=min(os.cpu_count() or 1, 4), max_pending=count).start()
+
+    async def pool_burst():
+        await asyncio.gather(*(pool.preprocess(data) for data in photos))
+
+    # Warm up the workers (imports PIL in each) before measuring
+    await asyncio.gather(*(pool.run(preprocess_image, photos[0], 64, 50) for _ in range(pool.workers)))
+
+    print(f"{'':<10}{'burst s':>9}{'lag p50 ms':>12}{'lag p99 ms':>12}{'lag max ms':>12}")
+    for name, burst in (("before", inline_burst), ("after", pool_burst)):
+        r = await measure(burst)
+        print(f"{name:<10}{r['burst_s']:>9.2f}{r['lag_p50_ms']:>12.1f}{r['lag_p99_ms']:>12.1f}{r['lag_max_ms']:>12.1f}")
+
+    try:
+        await pool.run(crash, photos[0])
+        failed = False
+    except ImageWorkerCrashed:
+        failed = True
+    results = await asyncio.gather(*(pool.preprocess(data) for data in photos), return_exceptions=True)
+    ok = failed and not any(isinstance(r, Exception) for r in results)
+    print(f"\n{'ok  ' if ok else 'FAIL'} a worker killed mid-image fails that request only, "
+          f"the next {len(photos)} succeed ({pool.restarts} pool restart)")
+    pool.shutdown()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,112 @@
+# Benchmark: upstream calls and answer latency for inline queries sent on every keystroke
+# Usage: python benchmarks/bench_inline.py [users]
+import os
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini
+import fake_telegram
+import loadtest
+
+QUESTIONS = ["what is the capital of australia", "how do vaccines work", "best way to learn python",
+             "why is the sky blue", "explain quantum computing simply", "recipe for banana bread"]
+
+
+def typing_schedule(rng: random.Random, question: str, start: float):
+    """(time, prefix) for every keystroke, ~6 chars/s with the odd pause to think"""
+    t = start
+    for i in range(1, len(question) + 1):
+        t += rng.expovariate(6) + (rng.uniform(0.5, 1.5) if rng.random() < 0.05 else 0)
+        yield t, question[:i]
+
+
+async def run(bot, telegram, backend, users: int, debounce, seed: int = 0):
+    """Replay every user's keystrokes, debounce=None answers each query directly (no debounce, no cancel)"""
+    rng = random.Random(seed)
+    bot.inline_cache._entries.clear()
+    calls_before = backend.calls
+    finals = {}
+    events = []
+    for user_id in range(1, users + 1):
+        question = f"{rng.choice(QUESTIONS)} {user_id}"
+        schedule = list(typing_schedule(rng, question, rng.uniform(0, 2)))
+        events += [(t, user_id, prefix) for t, prefix in schedule]
+        finals[user_id] = schedule[-1]
+    events.sort()
+    if debounce is not None:
+        bot.INLINE_DEBOUNCE = debounce
+
+    async def naive(query):
+        if len(query.query) >= bot.INLINE_MIN_CHARS:
+            answer = await bot.ask_model(query.query)
+            await query.answer([answer])
+
+    answered = {}
+
+    async def send(user_id, prefix):
+        query = fake_telegram.FakeInlineQuery(telegram, fake_telegram.FakeUser(user_id), prefix)
+        if debounce is None:
+            await naive(query)
+        else:
+            await bot.inline_query_handler(bot.app, query)
+        if query.answers and prefix == finals[user_id][1]:
+            answered[user_id] = time.perf_counter()
+
+    start = time.perf_counter()
+    tasks = []
+    for t, user_id, prefix in events:
+        delay = t - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(user_id, prefix)))
+    await asyncio.gather(*tasks)
+    latencies = sorted(answered[u] - start - finals[u][0] for u in answered)
+    return {
+        "queries": len(events),
+        "upstream_calls": backend.calls - calls_before,
+        "final_answered": f"{len(answered)}/{users}",
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000) if latencies else None,
+    }
+
+
+async def cached_after_typing(bot, telegram, backend) -> bool:
+    """A cached answer for the final query drops the user's earlier prefix that's still generating"""
+    bot.INLINE_DEBOUNCE = 0.0
+    bot.inline_cache._entries.clear()
+    bot.inline_cache.put("what is python", "cached answer")
+    user = fake_telegram.FakeUser(10**6)
+    earlier = fake_telegram.FakeInlineQuery(telegram, user, "what is pyth")
+    pending = asyncio.create_task(bot.inline_query_handler(bot.app, earlier))
+    await asyncio.sleep(0.05)
+    final = fake_telegram.FakeInlineQuery(telegram, user, "what is python")
+    await bot.inline_query_handler(bot.app, final)
+    await pending
+    return bool(final.answers) and not earlier.answers and not bot.inline_tasks.running(bot.scoped(user.id))
+
+
+async def main(users: int):
+    backend = fake_gemini.FakeGemini(latency="lognormal:median=0.8,sigma=0.4")
+    loadtest.prepare_environment(backend)
+    import botmrg_grp
+
+    telegram = fake_telegram.FakeTelegram()
+    print(f"{users} users typing a question each, fake Gemini median 0.8 s")
+    print(f"{'mode':<32}{'queries':>8}{'upstream':>10}{'answered':>10}{'p50 ms':>8}{'p95 ms':>8}")
+    for name, debounce in [("every keystroke (naive)", None), ("cancel superseded, no debounce", 0.0),
+                           ("cancel + 300 ms debounce", 0.3), ("cancel + 500 ms debounce", 0.5),
+                           ("cancel + 700 ms debounce", 0.7)]:
+        result = await run(botmrg_grp, telegram, backend, users, debounce)
+        print(f"{name:<32}{result['queries']:>8}{result['upstream_calls']:>10}{result['final_answered']:>10}"
+              f"{result['p50_ms']:>8}{result['p95_ms']:>8}")
+    ok = await cached_after_typing(botmrg_grp, telegram, backend)
+    print(f"{'ok  ' if ok else 'FAIL'} a cache hit cancels the user's earlier prefix still generating")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)) else 1)
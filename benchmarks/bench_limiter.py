@@ -0,0 +1,86 @@
+# Simulation: fixed vs adaptive (AIMD) concurrency limits against a fake Gemini whose capacity drops midway
+# Usage: python benchmarks/bench_limiter.py [users] [phase_seconds]
+import os
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini
+from adaptive_limiter import AdaptiveLimiter
+
+CAPACITIES = [16, 6]
+
+
+async def simulate(limiter: AdaptiveLimiter, users: int, phase_seconds: float, trace: bool = False):
+    backend = fake_gemini.FakeGemini(latency="lognormal:median=0.4,sigma=0.3", capacity=CAPACITIES[0])
+    rng = random.Random(1)
+    results = [[] for _ in CAPACITIES]
+    errors = [0 for _ in CAPACITIES]
+    start = time.monotonic()
+    end = start + phase_seconds * len(CAPACITIES)
+
+    def phase() -> int:
+        return min(int((time.monotonic() - start) / phase_seconds), len(CAPACITIES) - 1)
+
+    async def user():
+        while time.monotonic() < end:
+            await asyncio.sleep(rng.expovariate(2))
+            sent = time.monotonic()
+            try:
+                await limiter.call(backend.generate_async, "question")
+                results[phase()].append(time.monotonic() - sent)
+            except fake_gemini.FakeResourceExhausted:
+                errors[phase()] += 1
+
+    async def control():
+        for capacity in CAPACITIES:
+            backend.capacity = capacity
+            for second in range(int(phase_seconds)):
+                if trace and second % 2 == 0:
+                    m = limiter.metrics()
+                    print(f"  t={time.monotonic() - start:4.0f}s capacity {capacity:>2}  limit {m['limit']:>5}  "
+                          f"in flight {m['in_flight']:>2}  queued {m['queued']:>3}  latency {m['latency_ms']:>5} ms")
+                await asyncio.sleep(1)
+
+    await asyncio.gather(control(), *(user() for _ in range(users)))
+    rows = []
+    for i, capacity in enumerate(CAPACITIES):
+        latencies = sorted(results[i])
+        rows.append({
+            "capacity": capacity,
+            "ok_per_s": len(latencies) / phase_seconds,
+            "429s": errors[i],
+            "p50": latencies[len(latencies) // 2] if latencies else 0,
+            "p95": latencies[int(len(latencies) * 0.95)] if latencies else 0,
+        })
+    return rows
+
+
+async def main(users: int, phase_seconds: float):
+    print(f"{users} users asking in a loop, fake Gemini median 0.4 s, capacity {CAPACITIES[0]} then "
+          f"{CAPACITIES[1]} concurrent calls ({phase_seconds:.0f} s each), 429s above 2x capacity")
+    policies = [
+        ("fixed 4", AdaptiveLimiter(initial=4, min_limit=4, max_limit=4)),
+        ("fixed 32", AdaptiveLimiter(initial=32, min_limit=32, max_limit=32)),
+        ("AIMD", AdaptiveLimiter(initial=8)),
+    ]
+    table = []
+    for name, limiter in policies:
+        if name == "AIMD":
+            print("AIMD limit over time:")
+        table.append((name, await simulate(limiter, users, phase_seconds, trace=name == "AIMD")))
+    print()
+    print(f"{'policy':<10}{'capacity':>9}{'ok/s':>7}{'429s':>7}{'p50 s':>8}{'p95 s':>8}")
+    for name, rows in table:
+        for row in rows:
+            print(f"{name:<10}{row['capacity']:>9}{row['ok_per_s']:>7.1f}{row['429s']:>7}"
+                  f"{row['p50']:>8.2f}{row['p95']:>8.2f}")
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    asyncio.run(main(users, float(sys.argv[2]) if len(sys.argv) > 2 else 20))
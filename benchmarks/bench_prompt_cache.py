@@ -0,0 +1,91 @@
+# Scenario: Gemini context caching of long prompts (prompt_registry.py) with a slow CachedContent.create
+# Creating and refreshing a cache must not hold up requests, and a hot reload must not delete a cache
+# that requests in flight may still use.
+# Usage: python benchmarks/bench_prompt_cache.py [create_latency_ms]
+import os
+import sys
+import json
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini
+
+
+class SlowCachedContent:
+    """A context cache that takes a network round-trip to create"""
+
+    latency = 0.5
+    created = 0
+    deleted = 0
+
+    @classmethod
+    def create(cls, *args, **kwargs):
+        time.sleep(cls.latency)
+        cls.created += 1
+        return cls()
+
+    def delete(self):
+        SlowCachedContent.deleted += 1
+
+
+def check(name: str, ok: bool) -> bool:
+    print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    return ok
+
+
+def write_prompts(path: str, instruction: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"long": {"system_instruction": instruction, "cache_ttl": 600}}, f)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main(latency: float) -> bool:
+    genai = fake_gemini.install(fake_gemini.FakeGemini())
+    genai.caching.CachedContent = SlowCachedContent
+    SlowCachedContent.latency = latency
+    from prompt_registry import PromptRegistry, MIN_CACHED_TOKENS
+
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    results = []
+    try:
+        write_prompts(path, "You are a helpful assistant. " * (MIN_CACHED_TOKENS * 4 // 28 + 1))
+        registry = PromptRegistry(path, reload_interval=0)
+        print(f"CachedContent.create takes {latency * 1000:.0f} ms")
+
+        inline, elapsed = timed(lambda: registry.model("long"))
+        results.append(check(f"first request doesn't wait for the cache ({elapsed * 1000:.1f} ms)", elapsed < latency / 10))
+        time.sleep(latency + 0.2)
+        compiled = registry.get("long")
+        results.append(check("the cache is used once created", compiled.cached_content is not None
+                             and registry.model("long") is not inline))
+
+        # Shortly before the TTL runs out
+        compiled.cache_expires_at = time.monotonic() + 30
+        _, elapsed = timed(lambda: registry.model("long"))
+        results.append(check(f"a refresh doesn't hold up requests ({elapsed * 1000:.1f} ms)", elapsed < latency / 10))
+        time.sleep(latency + 0.2)
+        results.append(check("the cache is recreated in the background", SlowCachedContent.created == 2
+                             and compiled.cache_expires_at > time.monotonic() + 60))
+
+        # Hot reload with a changed prompt
+        time.sleep(0.01)
+        write_prompts(path, "You are a concise assistant. " * (MIN_CACHED_TOKENS * 4 // 28 + 1))
+        _, elapsed = timed(lambda: registry.model("long"))
+        results.append(check(f"a reload doesn't delete the cache in use ({SlowCachedContent.deleted} deleted, "
+                             f"{elapsed * 1000:.1f} ms)", SlowCachedContent.deleted == 0 and elapsed < latency / 10))
+        return all(results)
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.5) else 1)
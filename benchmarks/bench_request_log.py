@@ -0,0 +1,133 @@
+# Benchmark: cost of the request log (request_log.py) on the handler path, and what it writes
+# Replays bot traffic with the log on and off, then summarizes the segments with the query tool,
+# and measures record() cost, writer throughput, compression and rotation on synthetic records.
+# Usage: python benchmarks/bench_request_log.py [updates] [records]
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini
+import fake_telegram
+import loadtest
+
+MIX = {"askai": 0.5, "private": 0.5}
+
+
+async def replay(log, telegram, updates: int):
+    """Alternate runs with the log off and on, in one event loop (the send scheduler is bound to it)"""
+    for label, enabled, seed in (("log off", False, 1), ("log on", True, 2), ("log off", False, 3), ("log on", True, 4)):
+        log.enabled = enabled
+        trace = fake_telegram.synthetic_trace(updates, 200, MIX, users=200, seed=seed)
+        results = await loadtest.replay_bot(list(fake_telegram.iter_events(trace)), telegram)
+        latencies = [r["latency"] for r in results]
+        print(f"  {label:<8} handler p50 {loadtest.percentile(latencies, 50) * 1000:6.1f} ms, "
+              f"p99 {loadtest.percentile(latencies, 99) * 1000:6.1f} ms")
+
+
+def bot_traffic(directory: str, updates: int):
+    backend = fake_gemini.FakeGemini(latency="lognormal:median=0.05,sigma=0.5", error_rate=0.01, seed=1)
+    os.environ["REQUEST_LOG_DIR"] = directory
+    os.environ["REQUEST_LOG_ENABLED"] = "true"
+    # The fake has no capacity limit, the limiter's queueing would swamp the difference being measured
+    os.environ["UPSTREAM_LIMITER_ENABLED"] = "false"
+    loadtest.prepare_environment(backend)
+    import botmrg_grp
+    import request_log
+
+    log = request_log.request_log
+    telegram = fake_telegram.FakeTelegram(send_latency=0.005)
+    print(f"Bot traffic, {updates} updates at 200/s per run:")
+    asyncio.run(replay(log, telegram, updates))
+    log.close()
+    print(f"  {log.stats()}")
+    print()
+    print("python request_log.py --top 5:")
+    summary = request_log.summarize(request_log.read_records(directory), top=5)
+    request_log.print_summary(summary)
+    return summary["requests"] == 2 * updates and log.dropped == 0
+
+
+def synthetic_records(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    commands = ["askai_command", "handle_private_message", "getai_command", "tldr_command"]
+    now = time.time()
+    for n in range(count):
+        user = rng.randint(1, 5000)
+        yield {
+            "ts": round(now + n * 0.01, 3), "bot": None, "chat": -1000 - rng.randint(1, 50), "user": user,
+            "command": rng.choice(commands), "model": "gemini-1.5-flash", "calls": 1,
+            "prompt_tokens": rng.randint(50, 3000), "output_tokens": rng.randint(20, 800),
+            "latency_ms": round(rng.lognormvariate(0, 0.6) * 800, 1), "cached": rng.random() < 0.2,
+            "error": "ResourceExhausted" if rng.random() < 0.01 else None,
+        }
+
+
+def writer(directory: str, count: int):
+    import json
+    import request_log
+
+    records = list(synthetic_records(count))
+    raw = sum(len(json.dumps(entry, separators=(",", ":"))) + 1 for entry in records)
+
+    log = request_log.RequestLog(os.path.join(directory, "writer"), queue_size=count + 1)
+    start = time.perf_counter()
+    for entry in records:
+        log.record(entry)
+    queued = time.perf_counter() - start
+    log.close(timeout=60)
+    drained = time.perf_counter() - start
+    size = sum(os.path.getsize(path) for path in request_log.segment_paths(log.directory))
+    start = time.perf_counter()
+    read = sum(1 for _ in request_log.read_records(log.directory))
+    query = time.perf_counter() - start
+    print(f"Writer, {count} records:")
+    print(f"  record(): {queued / count * 1e6:.2f} us per call, written at {count / drained:,.0f} records/s "
+          f"in {log.batches} batches")
+    print(f"  {size / count:.1f} bytes per record compressed, {raw / size:.1f}x smaller than raw JSON lines")
+    print(f"  query tool reads {read / query:,.0f} records/s")
+
+    # A writer that can't keep up: a burst into a small queue is dropped, not waited for
+    log = request_log.RequestLog(os.path.join(directory, "burst"), queue_size=1000)
+    start = time.perf_counter()
+    burst = records[:50000]
+    for entry in burst:
+        log.record(entry)
+    elapsed = time.perf_counter() - start
+    log.close(timeout=60)
+    print(f"  burst of {len(burst)} into a 1000-record queue: {elapsed * 1000:.0f} ms, {log.dropped} dropped")
+
+    # Rotation and retention: 64 KB segments, keep 5
+    log = request_log.RequestLog(os.path.join(directory, "rotate"), max_segment_bytes=64 * 1024,
+                                 max_segments=5, batch_size=256)
+    for entry in records[:100000]:
+        log.record(entry)
+        if log._queue.qsize() > 5000:
+            time.sleep(0.01)
+    log.close(timeout=60)
+    kept = request_log.segment_paths(log.directory)
+    print(f"  rotation at 64 KB: {log.segments} segments written, {len(kept)} kept, "
+          f"{sum(1 for _ in request_log.read_records(log.directory))} records readable")
+    return read == count and len(kept) == 5
+
+
+def main(updates: int, count: int):
+    directory = tempfile.mkdtemp(prefix="request_log_")
+    try:
+        ok = bot_traffic(os.path.join(directory, "bot"), updates)
+        print()
+        ok = writer(directory, count) and ok
+    finally:
+        shutil.rmtree(directory)
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+                       int(sys.argv[2]) if len(sys.argv) > 2 else 200000) else 1)
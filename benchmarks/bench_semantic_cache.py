@@ -0,0 +1,84 @@
+# Scenario: which questions the semantic cache (semantic_cache.py) answers from an earlier one
+# Paraphrases should hit, questions that differ in a key word, number or word order must miss, and answers
+# aren't shared between prompts (e.g. /askai and private chat). Also times a lookup in a full cache.
+# Usage: python benchmarks/bench_semantic_cache.py
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semantic_cache import SemanticCache, HashedNgramVectorizer
+
+SHOULD_HIT = [
+    ("What's Python?", "what is python"),
+    ("How do I reverse a list in Python?", "how do i reverse a list in python please"),
+    ("explain recursion", "Explain recursion!!"),
+    ("What is the capital of France?", "what's the capital of france"),
+    ("How does photosynthesis work?", "how does photosynthesis works"),
+]
+
+MUST_MISS = [
+    ("Write a Python function that returns the sum of a list of integers and explain how it works",
+     "Write a Python function that returns the max of a list of integers and explain how it works"),
+    ("how many calories are in 100 grams of rice", "how many calories are in 200 grams of rice"),
+    ("translate hello to french", "translate hello to german"),
+    ("what is the population of canada in 2020", "what is the population of canada in 2021"),
+    ("Summarize the plot of the first Harry Potter book in five sentences for a child",
+     "Summarize the plot of the second Harry Potter book in five sentences for a child"),
+    ("convert 5 km to miles", "convert 5 miles to km"),
+    ("convert a json string to a yaml string in python and keep the comments",
+     "convert a yaml string to a json string in python and keep the comments"),
+    ("how do I copy files from my windows laptop to my linux server over ssh",
+     "how do I copy files from my linux server to my windows laptop over ssh"),
+    ("translate this sentence into french and explain the grammar",
+     "translate this sentence from french and explain the grammar"),
+    ("what are the differences between postgres and mysql for a small web app",
+     "what are the differences between mysql and postgres for a small web app"),
+]
+
+
+def check(name: str, ok: bool) -> bool:
+    print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    return ok
+
+
+def main() -> bool:
+    vectorizer = HashedNgramVectorizer()
+    results = []
+    print("Paraphrases answered from the cache:")
+    for cached, asked in SHOULD_HIT:
+        cache = SemanticCache(vectorizer, max_entries=16)
+        cache.put(cached, "answer", "askai")
+        score = float(vectorizer.embed(cached) @ vectorizer.embed(asked))
+        results.append(check(f"{asked!r} after {cached!r} ({score:.3f})", cache.get(asked, "askai") == "answer"))
+
+    print("Different questions that must not be:")
+    for cached, asked in MUST_MISS:
+        cache = SemanticCache(vectorizer, max_entries=16)
+        cache.put(cached, "answer", "askai")
+        score = float(vectorizer.embed(cached) @ vectorizer.embed(asked))
+        results.append(check(f"{asked[:60]!r} ({score:.3f})", cache.get(asked, "askai") is None))
+
+    print("Scopes:")
+    cache = SemanticCache(vectorizer, max_entries=16)
+    cache.put("what is python", "askai answer", "askai")
+    results.append(check("a private chat question doesn't get the /askai answer", cache.get("what is python", "chat") is None))
+    results.append(check("/askai gets its own answer", cache.get("what is python", "askai") == "askai answer"))
+
+    # Lookup cost in a full cache of unrelated questions
+    rng = random.Random(0)
+    words = "python list rice planes france recursion music guitar bread tax loan river moon cat dog".split()
+    cache = SemanticCache(vectorizer, max_entries=2048)
+    for n in range(2048):
+        cache.put(" ".join(rng.choice(words) for _ in range(8)) + f" {n}", "answer", "askai")
+    start = time.perf_counter()
+    for _ in range(200):
+        cache.get("how do I reverse a list in python", "askai")
+    print(f"\nlookup in a full cache of 2048 entries: {(time.perf_counter() - start) / 200 * 1000:.2f} ms")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,88 @@
+# Scenario: status messages through the outbound scheduler (send_scheduler.py)
+# Progress edits are coalesced, deleting a status message cancels its queued send and edits (also
+# after a FloodWait), and the per-chat state of idle chats doesn't accumulate.
+# Usage: python benchmarks/bench_send_scheduler.py [chats]
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_telegram
+from send_scheduler import OutboundScheduler
+
+
+def check(name: str, ok: bool) -> bool:
+    print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    return ok
+
+
+def message(telegram, chat_id: int):
+    return fake_telegram.FakeMessage(telegram, fake_telegram.FakeChat(chat_id, "supergroup"),
+                                     fake_telegram.FakeUser(1), "/askai question")
+
+
+async def main(chats: int) -> bool:
+    results = []
+    senders = []
+
+    def keep(sender: OutboundScheduler) -> OutboundScheduler:
+        # Referenced until the end, so their idle workers aren't garbage collected mid-run
+        senders.append(sender)
+        return sender
+
+    telegram = fake_telegram.FakeTelegram(send_latency=0.01)
+
+    print("Progress edits of one status message:")
+    sender = keep(OutboundScheduler(group_rate=2, burst=1))
+    status = sender.status(message(telegram, -1), "Reading...")
+    for done in range(1, 11):
+        status.update(f"Reading... {done}/10")
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(1.5)
+    results.append(check(f"10 updates, {telegram.edited} edits sent, {sender.coalesced} coalesced",
+                         telegram.edited < 10 and telegram.edited + sender.coalesced == 10))
+    await status.delete()
+
+    print("Deleting a status message that has a queued edit:")
+    telegram = fake_telegram.FakeTelegram(send_latency=0.01)
+    sender = keep(OutboundScheduler(group_rate=0.5, burst=1))
+    blocker = sender.submit(-2, lambda: telegram.call())
+    status = sender.status(message(telegram, -2), "Please Wait...")
+    status.update("Still working...")
+    edit = status.edit
+    await status.delete()
+    await asyncio.sleep(0.1)
+    results.append(check("the queued send and edit are cancelled", status.job.future.cancelled() and edit.future.done()))
+    await blocker.future
+
+    print("Deleting a status message waiting out a FloodWait:")
+    telegram = fake_telegram.FakeTelegram(send_latency=0.01, flood_rate=1.0, flood_wait=1)
+    sender = keep(OutboundScheduler())
+    status = sender.status(message(telegram, -3), "Please Wait...")
+    await asyncio.sleep(0.1)
+    telegram.flood_rate = 0
+    await status.delete()
+    await asyncio.sleep(1.2)
+    results.append(check(f"nothing is sent after the wait ({len(telegram.sent)} sent)",
+                         not telegram.sent and status.job.future.cancelled()))
+
+    print(f"One reply in each of {chats} chats:")
+    telegram = fake_telegram.FakeTelegram(send_latency=0)
+    sender = keep(OutboundScheduler(global_rate=1e6, private_rate=100, burst=3))
+    await asyncio.gather(*(sender.reply(message(telegram, chat_id), "answer") for chat_id in range(1, chats + 1)))
+    tracked = len(sender._buckets)
+    await asyncio.sleep(0.1)
+    # Normally done every minute by the scheduler's worker
+    sender._prune(time.monotonic())
+    results.append(check(f"{tracked} chats tracked while busy, {len(sender._buckets)} once their limits refill",
+                         tracked == chats and len(sender._buckets) == 0))
+    for task in asyncio.all_tasks() - {asyncio.current_task()}:
+        task.cancel()
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)) else 1)
@@ -0,0 +1,97 @@
+# Scenario: quick corrections and /stop in private chat against a fake slow model
+# Checks that only the latest message of a burst is answered, together with the earlier ones, and
+# superseded calls are cancelled.
+# Usage: python benchmarks/bench_supersede.py [users] [burst]
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini
+import fake_telegram
+import loadtest
+
+
+class NoCancel:
+    """The previous behaviour: every message gets its own full generation"""
+
+    async def run(self, key, coro):
+        return await coro
+
+    def cancel(self, key, reason=None) -> bool:
+        return False
+
+
+async def scenario(bot, backend, users: int, burst: int, gap: float = 0.3):
+    telegram = fake_telegram.FakeTelegram()
+    calls, cancelled, peak = backend.calls, backend.cancelled, backend.max_in_flight
+    backend.max_in_flight = 0
+    last_sent = {}
+
+    async def user(user_id: int):
+        chat = fake_telegram.FakeChat(user_id, "private")
+        tasks = []
+        for n in range(burst):
+            text = f"question {user_id}, take {n + 1}"
+            message = fake_telegram.FakeMessage(telegram, chat, fake_telegram.FakeUser(user_id), text)
+            tasks.append(asyncio.create_task(bot.handle_private_message(bot.app, message)))
+            last_sent[user_id] = time.perf_counter()
+            await asyncio.sleep(gap)
+        # Every fourth user changes their mind and stops the last one too
+        if user_id % 4 == 0:
+            stop = fake_telegram.FakeMessage(telegram, chat, fake_telegram.FakeUser(user_id), "/stop")
+            tasks.append(asyncio.create_task(bot.stop_command(bot.app, stop)))
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(*(user(u) for u in range(1, users + 1)))
+    answers = [s for s in telegram.sent if s["text"].startswith("Answer to")]
+    # One answer per burst, anything more answered a message that had been superseded
+    stale = len(answers) - len({s["chat_id"] for s in answers})
+    # The last recorded turn of every user who didn't /stop has all of their burst
+    lost = 0
+    for user_id in range(1, users + 1):
+        if user_id % 4:
+            asked = bot.chat_history.build_history(user_id)[-2]["parts"][0]
+            lost += sum(f"question {user_id}, take {n + 1}" not in asked for n in range(burst))
+    return {
+        "messages": users * burst,
+        "answers_sent": len(answers),
+        "stale_answers": stale,
+        "messages_lost": lost,
+        "upstream_started": backend.calls - calls,
+        "upstream_cancelled": backend.cancelled - cancelled,
+        "upstream_peak_in_flight": backend.max_in_flight,
+    }
+
+
+async def main(users: int, burst: int):
+    backend = fake_gemini.FakeGemini(latency="constant:value=2.0")
+    os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+    loadtest.prepare_environment(backend)
+    import botmrg_grp
+
+    print(f"{users} users each sending {burst} messages 0.3 s apart, fake model takes 2 s, every 4th user sends /stop")
+    tracker = botmrg_grp.chat_tasks
+    botmrg_grp.chat_tasks = NoCancel()
+    before = await scenario(botmrg_grp, backend, users, burst)
+    botmrg_grp.chat_tasks = tracker
+    after = await scenario(botmrg_grp, backend, users, burst)
+
+    print(f"{'':<26}{'every message':>14}{'latest only':>14}")
+    for key in before:
+        print(f"{key:<26}{before[key]:>14}{after[key]:>14}")
+
+    stopped = users // 4
+    expected = users - stopped
+    # Superseded calls still waiting for the upstream limiter are cancelled before they start
+    ok = after["stale_answers"] == 0 and after["answers_sent"] == expected and after["messages_lost"] == 0 \
+        and after["upstream_started"] - after["upstream_cancelled"] == expected
+    print("OK" if ok else f"FAILED: expected {expected} answers, each for a whole burst")
+    return ok
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    sys.exit(0 if asyncio.run(main(*(args + [20, 3][len(args):]))) else 1)
@@ -0,0 +1,176 @@
+# Scenario and benchmark: several bots in one process (multibot.py)
+# Checks that chat state, ads and quotas are kept per bot (also with /askai batching), and measures the memory of an extra bot
+# against a separate process per bot (clients aren't connected, so connection buffers aren't included).
+# Usage: python benchmarks/bench_tenancy.py [extra_bots]
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import resource
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_gemini
+import fake_telegram
+import loadtest
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_config(bots) -> str:
+    fd, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(bots, f)
+    return path
+
+
+async def isolation(bot, multibot, tenancy):
+    """The same user talks to three bots: separate histories, each bot's own ad, beta's quota"""
+    path = write_config([
+        {"name": "alpha", "bot_token": "1:offline"},
+        {"name": "beta", "bot_token": "2:offline", "quota": {"calls_per_minute": 1, "burst": 2}},
+        {"name": "gamma", "bot_token": "3:offline", "ad": {"enabled": True, "frequency": 1,
+                                                           "bot_url": "https://t.me/gamma_bot"}},
+    ])
+    tenants = multibot.load_tenants(path, bot.handlers)
+    os.remove(path)
+    multibot.upstream_limiter.admission = tenancy.charge_current
+    telegram = fake_telegram.FakeTelegram()
+    user = fake_telegram.FakeUser(7)
+    replies = {}
+    for tenant in tenants:
+        handler = bot.handlers.bind(bot.handle_private_message, tenant)
+        chat = fake_telegram.FakeChat(7, "private")
+        sent = len(telegram.sent)
+        for n in range(3):
+            await handler(tenant.client, fake_telegram.FakeMessage(telegram, chat, user, f"hello {tenant.name} {n}"))
+        await asyncio.sleep(0.2)
+        replies[tenant.name] = [s["text"] for s in telegram.sent[sent:]]
+    multibot.upstream_limiter.admission = None
+
+    checks = {
+        "alpha keeps the unprefixed history": bot.chat_history.has_history(7),
+        "beta's history is separate": bot.chat_history.has_history("beta:7"),
+        "beta's third message is over quota": "usage limit" in replies["beta"][-1],
+        "only gamma shows its ad": all("gamma_bot" in r for r in replies["gamma"])
+        and not any("gamma_bot" in r for r in replies["alpha"] + replies["beta"]),
+    }
+    for name, ok in checks.items():
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    for tenant in tenants:
+        print(f"  {tenant.stats()}")
+    return all(checks.values())
+
+
+def primary_bot(bot, multibot):
+    """Exactly one bot keeps the unprefixed chats shared with the web app"""
+
+    def primaries(bots):
+        path = write_config(bots)
+        try:
+            return [tenant.name for tenant in multibot.load_tenants(path, bot.handlers) if tenant.primary]
+        except ValueError:
+            return None
+        finally:
+            os.remove(path)
+
+    checks = {
+        "the first bot is primary by default": primaries([{"name": "a", "bot_token": "1:offline"},
+                                                          {"name": "b", "bot_token": "2:offline"}]) == ["a"],
+        "a bot marked primary is": primaries([{"name": "a", "bot_token": "1:offline"},
+                                              {"name": "b", "bot_token": "2:offline", "primary": True}]) == ["b"],
+        "two primary bots are refused": primaries([{"name": "a", "bot_token": "1:offline", "primary": True},
+                                                   {"name": "b", "bot_token": "2:offline", "primary": True}]) is None,
+        "no primary bot is refused": primaries([{"name": "a", "bot_token": "1:offline", "primary": False}]) is None,
+    }
+    for name, ok in checks.items():
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+async def batched_quota(bot, multibot, tenancy):
+    """Two bots in the same group with /askai batching on: beta's questions are charged to beta"""
+    path = write_config([
+        {"name": "alpha", "bot_token": "1:offline"},
+        {"name": "beta", "bot_token": "2:offline", "quota": {"calls_per_minute": 1, "burst": 1}},
+    ])
+    alpha, beta = multibot.load_tenants(path, bot.handlers)
+    os.remove(path)
+    multibot.upstream_limiter.admission = tenancy.charge_current
+    window = bot.askai_batcher.window
+    bot.askai_batcher.window = 0.1
+    telegram = fake_telegram.FakeTelegram()
+    chat = fake_telegram.FakeChat(-100, "supergroup")
+    asks = [(alpha, "what is the tallest mountain in europe")] + [
+        (beta, question) for question in ("how far away is the moon", "who painted the mona lisa",
+                                          "why do cats purr", "what is the speed of sound")
+    ]
+    await asyncio.gather(*(
+        bot.handlers.bind(bot.askai_command, tenant)(tenant.client, fake_telegram.FakeMessage(
+            telegram, chat, fake_telegram.FakeUser(n), f"/askai {question}"))
+        for n, (tenant, question) in enumerate(asks, start=1)
+    ))
+    await asyncio.sleep(0.2)
+    bot.askai_batcher.window = window
+    multibot.upstream_limiter.admission = None
+
+    refused = sum("usage limit" in s["text"] for s in telegram.sent)
+    checks = {
+        "one of beta's 4 batched questions is answered, 3 are over quota": beta.calls == 1 and refused == 3,
+        "alpha is charged for its own question only": alpha.calls == 1,
+    }
+    for name, ok in checks.items():
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    for tenant in (alpha, beta):
+        print(f"  {tenant.stats()}")
+    return all(checks.values())
+
+
+def extra_bot_memory(bot, multibot, count: int):
+    configs = [{"name": f"brand{n}", "bot_token": f"{n}:offline"} for n in range(count)]
+    path = write_config(configs)
+    tracemalloc.start()
+    before_rss = rss_mb()
+    before = tracemalloc.get_traced_memory()[0]
+    tenants = multibot.load_tenants(path, bot.handlers)
+    heap = (tracemalloc.get_traced_memory()[0] - before) / count / 1024
+    rss = (rss_mb() - before_rss) / count * 1024
+    tracemalloc.stop()
+    os.remove(path)
+    return tenants, heap, rss
+
+
+async def main(extra: int):
+    start_rss = rss_mb()
+    backend = fake_gemini.FakeGemini(latency="constant:value=0.05")
+    loadtest.prepare_environment(backend)
+    import botmrg_grp
+    import multibot
+    import tenancy
+
+    process_rss = rss_mb()
+    print("Isolation between bots:")
+    ok = await isolation(botmrg_grp, multibot, tenancy)
+    print("Primary bot:")
+    ok = primary_bot(botmrg_grp, multibot) and ok
+    print("Quotas with /askai batching (ASKAI_BATCH_WINDOW_MS=100):")
+    ok = await batched_quota(botmrg_grp, multibot, tenancy) and ok
+    tenants, heap_kb, rss_kb = extra_bot_memory(botmrg_grp, multibot, extra)
+    print()
+    print(f"one bot process: {process_rss:.1f} MB RSS after imports ({process_rss - start_rss:.1f} MB for the bot's modules)")
+    print(f"each extra bot in the same process: {heap_kb:.0f} KB Python heap, {max(rss_kb, 0):.0f} KB RSS "
+          f"(average over {extra} bots)")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)) else 1)
@@ -0,0 +1,84 @@
+# Benchmark: /tldr prompt size over a busy group's lifetime, and buffer memory per group
+# Usage: python benchmarks/bench_tldr.py [messages] [tldr_every]
+import os
+import sys
+import time
+import random
+import asyncio
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_history import estimate_tokens
+from group_digest import GroupDigest, TLDR_PROMPT, format_messages
+
+NAMES = ["Alice", "Bob", "Carol", "Dave", "Erin", "Frank"]
+WORDS = ["deploy", "meeting", "friday", "bug", "release", "lunch", "docs", "review", "server", "budget"]
+
+
+def make_message(rng: random.Random):
+    return rng.choice(NAMES), " ".join(rng.choices(WORDS, k=rng.randint(4, 40)))
+
+
+async def prompt_sizes(messages: int, every: int, history_limit: int = 1000):
+    """Prompt tokens per /tldr: resending the recent history vs folding new messages into a summary"""
+    rng = random.Random(0)
+    prompts = []
+
+    async def summarize(prompt: str) -> str:
+        prompts.append(estimate_tokens(prompt))
+        return " ".join(["summary"] * 150)
+
+    digest = GroupDigest(summarize)
+    history = []
+    resend = []
+    for n in range(1, messages + 1):
+        name, text = make_message(rng)
+        digest.record(1, name, text)
+        history.append((0.0, name, text))
+        if n % every == 0:
+            await digest.tldr(1)
+            recent = history[-history_limit:]
+            resend.append(estimate_tokens(TLDR_PROMPT.format(max_words=200, summary="(empty)",
+                                                             messages=format_messages(recent))))
+    return resend, prompts
+
+
+def buffer_memory(groups: int, per_group: int):
+    rng = random.Random(1)
+    digest = GroupDigest(None)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for n in range(groups * per_group):
+        name, text = make_message(rng)
+        digest.record(n % groups, name, text)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / groups
+
+
+def idle_eviction(groups: int):
+    digest = GroupDigest(None, idle_ttl=0.05)
+    for chat_id in range(groups):
+        digest.record(chat_id, "Alice", "hello")
+    time.sleep(0.1)
+    digest.record(groups, "Bob", "still here")
+    return len(digest._chats)
+
+
+async def main(messages: int, every: int):
+    resend, incremental = await prompt_sizes(messages, every)
+    print(f"{messages} group messages, /tldr every {every}: prompt tokens per /tldr")
+    print(f"{'/tldr #':<8}{'resend last 1000':>18}{'incremental':>13}")
+    step = max(len(resend) // 8, 1)
+    for i in range(0, len(resend), step):
+        print(f"{i + 1:<8}{resend[i]:>18}{incremental[i]:>13}")
+    print(f"{'total':<8}{sum(resend):>18}{sum(incremental):>13}")
+    print()
+    print(f"buffer memory: {buffer_memory(1000, 200) / 1024:.1f} KB per group with a full 200-message buffer")
+    print(f"idle eviction: 1000 idle groups -> {idle_eviction(1000)} left after the idle timeout")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*(args + [5000, 100][len(args):])))
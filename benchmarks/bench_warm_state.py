@@ -0,0 +1,103 @@
+# Benchmark: warm-state snapshot size and restore cost, and draining in-flight updates on shutdown
+# Usage: python benchmarks/bench_warm_state.py [entries]
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from semantic_cache import SemanticCache, HashedNgramVectorizer
+from image_cache import ImageHashCache
+from lifecycle import Lifecycle
+import fake_telegram
+
+WORDS = ["python", "recipe", "planet", "history", "music", "travel", "code", "health", "money", "space"]
+
+
+def filled_caches(entries: int, rng: random.Random):
+    semantic = SemanticCache(HashedNgramVectorizer(), max_entries=entries)
+    images = ImageHashCache(max_entries=entries)
+    for i in range(entries):
+        question = " ".join(rng.choices(WORDS, k=8)) + f" #{i}"
+        answer = " ".join(rng.choices(WORDS, k=120))
+        semantic.put(question, answer)
+        images.put(rng.getrandbits(64), "getai\n", answer)
+        images.remember_file(f"file{i}", rng.getrandbits(64))
+    return semantic, images
+
+
+def legacy_npz(path: str, semantic: SemanticCache) -> float:
+    """The previous format: compressed npz with fixed-width strings, read eagerly at import"""
+    count = len(semantic)
+    np.savez_compressed(path, vectors=semantic._vectors[:count],
+                        prompts=np.array(semantic._prompts[:count], dtype=np.str_),
+                        answers=np.array(semantic._answers[:count], dtype=np.str_))
+    start = time.perf_counter()
+    with np.load(path) as data:
+        data["vectors"], data["prompts"].tolist(), data["answers"].tolist()
+    return time.perf_counter() - start
+
+
+def snapshot_costs(entries: int):
+    rng = random.Random(0)
+    semantic, images = filled_caches(entries, rng)
+    workdir = tempfile.mkdtemp(prefix="warm-state-")
+    path = os.path.join(workdir, "semantic_cache.warm")
+
+    start = time.perf_counter()
+    semantic.save(path)
+    images.save(os.path.join(workdir, "image_cache.warm"))
+    save_time = time.perf_counter() - start
+
+    restored = SemanticCache(HashedNgramVectorizer(), max_entries=entries)
+    start = time.perf_counter()
+    restored.load(path)
+    boot_time = time.perf_counter() - start
+    start = time.perf_counter()
+    restored.restore()
+    restore_time = time.perf_counter() - start
+    assert len(restored) == entries and restored.get(semantic._prompts[0]) == semantic._answers[0]
+
+    legacy_path = os.path.join(workdir, "semantic_cache.npz")
+    legacy_time = legacy_npz(legacy_path, semantic)
+    print(f"snapshot of {entries} semantic + {entries} image entries saved in {save_time * 1000:.0f} ms")
+    print(f"semantic cache file:  {os.path.getsize(path) / 2 ** 20:.1f} MB "
+          f"(npz before: {os.path.getsize(legacy_path) / 2 ** 20:.1f} MB)")
+    print(f"time added to startup: {boot_time * 1000:.2f} ms (npz before: {legacy_time * 1000:.0f} ms, eager)")
+    print(f"background restore:    {restore_time * 1000:.0f} ms")
+
+
+async def drain_costs(updates: int = 50, latency: float = 1.0):
+    lifecycle = Lifecycle(drain_timeout=5)
+    telegram = fake_telegram.FakeTelegram()
+
+    @lifecycle.tracked
+    async def handler(_, message):
+        await asyncio.sleep(latency * random.random())
+        await message.reply_text("answer")
+
+    chat = fake_telegram.FakeChat(-1001, "supergroup")
+    messages = [fake_telegram.FakeMessage(telegram, chat, fake_telegram.FakeUser(i), "/askai hi") for i in range(updates)]
+    tasks = [asyncio.create_task(handler(None, message)) for message in messages]
+    await asyncio.sleep(0.1)
+
+    lifecycle.draining = True
+    late = fake_telegram.FakeMessage(telegram, chat, fake_telegram.FakeUser(0), "/askai late")
+    await handler(None, late)
+    start = time.perf_counter()
+    drained = await lifecycle.drain()
+    await asyncio.gather(*tasks)
+    answered = sum(s["text"] == "answer" for s in telegram.sent)
+    print(f"drain: {answered}/{updates} in-flight updates answered in {time.perf_counter() - start:.2f} s "
+          f"(deadline met: {drained}), {lifecycle.rejected} new update turned away")
+
+
+if __name__ == "__main__":
+    snapshot_costs(int(sys.argv[1]) if len(sys.argv) > 1 else 2048)
+    asyncio.run(drain_costs())
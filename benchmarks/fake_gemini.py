@@ -0,0 +1,246 @@
+# Local stand-in for google.generativeai, with configurable latency, streaming and errors
+import re
+import sys
+import json
+import time
+import types
+import random
+import asyncio
+import threading
+from typing import List, Optional
+
+
+class FakeGeminiError(Exception):
+    """Injected upstream failure"""
+
+
+class FakeResourceExhausted(FakeGeminiError):
+    """Injected 429, like google.api_core.exceptions.ResourceExhausted"""
+
+    code = 429
+
+
+class LatencyModel:
+    """Latency distribution, parsed from specs like 'lognormal:median=0.8,sigma=0.5'"""
+
+    def __init__(self, spec: str = "constant:value=0.5", seed: Optional[int] = None):
+        self.spec = spec
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = {k: float(v) for k, v in (p.split('=') for p in params.split(',') if p)}
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        p = self.params
+        with self._lock:
+            if self.kind == 'constant':
+                value = p.get('value', 0.5)
+            elif self.kind == 'uniform':
+                value = self.random.uniform(p.get('low', 0.2), p.get('high', 1.0))
+            elif self.kind == 'exponential':
+                value = self.random.expovariate(1 / p.get('mean', 0.5))
+            elif self.kind == 'lognormal':
+                value = self.random.lognormvariate(0, p.get('sigma', 0.5)) * p.get('median', 0.5)
+            else:
+                raise ValueError(f"Unknown latency distribution: {self.kind}")
+            # Occasional hung calls, like the long tail seen in production
+            if self.random.random() < p.get('tail_rate', 0):
+                value += p.get('tail', 20.0)
+        return max(value, 0.0)
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakePart:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_tokens: int = 0):
+        self.text = text
+        self.parts = [FakePart(text)]
+        self.usage_metadata = FakeUsage(prompt_tokens, len(text) // 4 + 1)
+
+
+class FakeStream:
+    """Iterable of response chunks, sync or async, delivered over the sampled latency"""
+
+    def __init__(self, chunks: List[str], delay: float):
+        self.chunks = chunks
+        self.delay = delay / max(len(chunks), 1)
+        self.text = "".join(chunks)
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            yield FakeResponse(chunk)
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield FakeResponse(chunk)
+
+    def resolve(self):
+        pass
+
+
+class FakeGemini:
+    """Shared behaviour of every fake model: latency, errors and call accounting"""
+
+    def __init__(self, latency: str = "constant:value=0.5", error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, answer_words: int = 60, seed: Optional[int] = 0,
+                 capacity: int = 0, overload_limit: float = 2.0):
+        self.latency = LatencyModel(latency, seed)
+        # Concurrent calls served at full speed, 0 for unlimited. Above it calls slow down in
+        # proportion (the upstream queues them), and above capacity * overload_limit they get 429s
+        self.capacity = capacity
+        self.overload_limit = overload_limit
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.answer_words = answer_words
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cancelled = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _begin(self) -> float:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            load = self.in_flight / self.capacity if self.capacity else 0
+        if load > self.overload_limit:
+            with self._lock:
+                self.failures += 1
+            self._end()
+            raise FakeResourceExhausted("429 Resource has been exhausted (fake, overloaded)")
+        return self.latency.sample() * max(load, 1)
+
+    def _end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _outcome(self, contents, json_mode: bool = False) -> str:
+        with self._lock:
+            roll = self.random.random()
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.failures += 1
+        if roll < self.rate_limit_rate:
+            raise FakeResourceExhausted("429 Resource has been exhausted (fake)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise FakeGeminiError("500 Internal error (fake)")
+        prompt = contents if isinstance(contents, str) else " ".join(
+            c for c in (contents if isinstance(contents, list) else [contents]) if isinstance(c, str)
+        )
+        if json_mode:
+            # Structured multi-question prompt: answer every question id found in it
+            ids = [int(i) for i in re.findall(r'"id": (\d+)', prompt)]
+            return json.dumps([{"id": i, "answer": " ".join(["lorem"] * self.answer_words)} for i in ids])
+        return f"Answer to '{prompt[:40]}': " + " ".join(["lorem"] * self.answer_words)
+
+    def generate(self, contents, stream: bool = False, json_mode: bool = False):
+        delay = self._begin()
+        try:
+            text = self._outcome(contents, json_mode)
+            if stream:
+                return FakeStream(text.split(" "), delay)
+            time.sleep(delay)
+            return FakeResponse(text, _count_tokens(contents))
+        finally:
+            self._end()
+
+    async def generate_async(self, contents, stream: bool = False, json_mode: bool = False):
+        delay = self._begin()
+        try:
+            text = self._outcome(contents, json_mode)
+            if stream:
+                return FakeStream(text.split(" "), delay)
+            await asyncio.sleep(delay)
+            return FakeResponse(text, _count_tokens(contents))
+        except asyncio.CancelledError:
+            with self._lock:
+                self.cancelled += 1
+            raise
+        finally:
+            self._end()
+
+
+def _count_tokens(contents) -> int:
+    if isinstance(contents, str):
+        return len(contents) // 4 + 1
+    if isinstance(contents, list):
+        return sum(_count_tokens(c) for c in contents)
+    if isinstance(contents, dict) and "parts" in contents:
+        return sum(_count_tokens(p) for p in contents["parts"])
+    return 258  # Gemini's flat cost for an image
+
+
+def _json_mode(generation_config) -> bool:
+    return (generation_config or {}).get("response_mime_type") == "application/json"
+
+
+class FakeChatSession:
+    def __init__(self, backend: FakeGemini, history=None, model=None):
+        self.backend = backend
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream: bool = False, **kwargs):
+        return self.backend.generate(self.history + [content], stream=stream)
+
+    async def send_message_async(self, content, stream: bool = False, **kwargs):
+        return await self.backend.generate_async(self.history + [content], stream=stream)
+
+
+def install(backend: FakeGemini) -> types.ModuleType:
+    """Replace google.generativeai with a fake module backed by `backend`"""
+
+    class GenerativeModel:
+        def __init__(self, model_name: str = "gemini-1.5-flash", generation_config=None,
+                     system_instruction=None, **kwargs):
+            self.model_name = model_name
+            self.generation_config = generation_config
+            self.system_instruction = system_instruction
+
+        @classmethod
+        def from_cached_content(cls, cached_content, **kwargs):
+            return cls(**kwargs)
+
+        def generate_content(self, contents, stream: bool = False, generation_config=None, **kwargs):
+            return backend.generate(contents, stream=stream, json_mode=_json_mode(generation_config))
+
+        async def generate_content_async(self, contents, stream: bool = False, generation_config=None, **kwargs):
+            return await backend.generate_async(contents, stream=stream, json_mode=_json_mode(generation_config))
+
+        def start_chat(self, history=None, **kwargs):
+            return FakeChatSession(backend, history, self)
+
+    class CachedContent:
+        @classmethod
+        def create(cls, *args, **kwargs):
+            raise FakeGeminiError("Context caching is not available offline")
+
+    module = types.ModuleType("google.generativeai")
+    module.configure = lambda **kwargs: None
+    module.GenerativeModel = GenerativeModel
+    module.caching = types.SimpleNamespace(CachedContent=CachedContent)
+    module.backend = backend
+
+    google = sys.modules.get("google")
+    if google is None:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    sys.modules["google.generativeai"] = module
+    google.generativeai = module
+    return module
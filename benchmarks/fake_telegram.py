@@ -0,0 +1,243 @@
+# Fake Telegram objects and update sources for replaying traffic through the real handlers
+import io
+import os
+import json
+import random
+import asyncio
+import tempfile
+import itertools
+from typing import Dict, Iterator, List, Optional
+
+_message_ids = itertools.count(1)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, first_name: str = "User"):
+        self.id = user_id
+        self.first_name = first_name
+        self.username = f"user{user_id}"
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, chat_type: str):
+        self.id = chat_id
+        self.type = chat_type
+
+
+class FakeMedia:
+    def __init__(self, file_unique_id: str, file_size: int, mime_type: str = "image/jpeg",
+                 file_name: Optional[str] = None):
+        self.file_id = file_unique_id
+        self.file_unique_id = file_unique_id
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.file_name = file_name
+
+
+class FakeTelegram:
+    """Records every outgoing call and simulates Telegram's send latency"""
+
+    def __init__(self, send_latency: float = 0.02, image_size: int = 1024, seed: int = 0,
+                 flood_rate: float = 0.0, flood_wait: int = 1, document_tokens: int = 12000):
+        self.send_latency = send_latency
+        self.image_size = image_size
+        self.document_tokens = document_tokens
+        self.random = random.Random(seed)
+        # Fraction of API calls rejected with FloodWait, like Telegram does when a bot sends too fast
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.floods = 0
+        self.sent: List[Dict] = []
+        self.deleted = 0
+        self.edited = 0
+        self._images: Dict[str, bytes] = {}
+        self._documents: Dict[str, bytes] = {}
+        self._tmpdir = tempfile.mkdtemp(prefix="fake-telegram-")
+
+    async def call(self):
+        """One API round trip, occasionally rejected with FloodWait"""
+        await asyncio.sleep(self.send_latency)
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            from pyrogram.errors import FloodWait
+
+            self.floods += 1
+            raise FloodWait(value=self.flood_wait)
+
+    async def send(self, message, text: str, **kwargs):
+        await self.call()
+        reply = FakeMessage(self, message.chat, FakeUser(0, "Bot"), text)
+        self.sent.append({"chat_id": message.chat.id, "reply_to": message.id, "text": text})
+        return reply
+
+    def image_bytes(self, key: str) -> bytes:
+        """A synthetic JPEG photo, generated once per key"""
+        if key not in self._images:
+            import PIL.Image
+
+            seed = sum(map(ord, key))
+            noise = random.Random(seed).randbytes(self.image_size * self.image_size * 3)
+            image = PIL.Image.frombytes("RGB", (self.image_size, self.image_size), noise)
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=90)
+            self._images[key] = buffer.getvalue()
+        return self._images[key]
+
+    def document_bytes(self, key: str) -> bytes:
+        """A synthetic text document of about `document_tokens` tokens, generated once per key"""
+        if key not in self._documents:
+            rng = random.Random(sum(map(ord, key)))
+            words = ["revenue", "growth", "market", "customer", "product", "quarter", "risk", "strategy", "cost"]
+            paragraphs = []
+            size = 0
+            while size < self.document_tokens * 4:
+                paragraphs.append(" ".join(rng.choices(words, k=rng.randint(40, 120))) + ".")
+                size += len(paragraphs[-1]) + 2
+            self._documents[key] = "\n\n".join(paragraphs).encode()
+        return self._documents[key]
+
+
+class FakeClient:
+    """Duck-typed pyrogram Client, streams documents at Telegram's usual chunk size"""
+
+    def __init__(self, telegram: FakeTelegram):
+        self.telegram = telegram
+
+    async def stream_media(self, message, chunk_size: int = 1024 * 1024):
+        data = self.telegram.document_bytes(message.document.file_unique_id)
+        for start in range(0, len(data), chunk_size):
+            await asyncio.sleep(self.telegram.send_latency)
+            yield data[start:start + chunk_size]
+
+
+class FakeMessage:
+    """Duck-typed pyrogram Message, enough for the bot's handlers"""
+
+    def __init__(self, telegram: FakeTelegram, chat: FakeChat, from_user: FakeUser, text: Optional[str] = None,
+                 reply_to_message: "Optional[FakeMessage]" = None, photo: Optional[FakeMedia] = None,
+                 document: Optional[FakeMedia] = None):
+        self.telegram = telegram
+        self.id = next(_message_ids)
+        self.chat = chat
+        self.from_user = from_user
+        self.text = text
+        self.caption = None
+        self.reply_to_message = reply_to_message
+        self.photo = photo
+        self.document = document
+        self.voice = None
+        self.audio = None
+        self.command = text[1:].split() if text and text.startswith("/") else None
+
+    async def reply_text(self, text: str, **kwargs):
+        return await self.telegram.send(self, text, **kwargs)
+
+    async def reply(self, text: str, **kwargs):
+        return await self.telegram.send(self, text, **kwargs)
+
+    async def edit_text(self, text: str, **kwargs):
+        await self.telegram.call()
+        self.telegram.edited += 1
+        self.text = text
+        return self
+
+    async def reply_chat_action(self, action, **kwargs):
+        await self.telegram.call()
+        return True
+
+    async def delete(self, **kwargs):
+        await self.telegram.call()
+        self.telegram.deleted += 1
+        return True
+
+    async def download(self, file_name: str = "", in_memory: bool = False, **kwargs):
+        await asyncio.sleep(self.telegram.send_latency)
+        data = self.telegram.image_bytes(self.photo.file_unique_id if self.photo else str(self.id))
+        if in_memory:
+            buffer = io.BytesIO(data)
+            buffer.name = "photo.jpg"
+            return buffer
+        path = os.path.join(self.telegram._tmpdir, f"{self.id}.jpg")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+
+class FakeInlineQuery:
+    """Duck-typed pyrogram InlineQuery, records the answers it gets"""
+
+    def __init__(self, telegram: FakeTelegram, from_user: FakeUser, query: str):
+        self.telegram = telegram
+        self.id = str(next(_message_ids))
+        self.from_user = from_user
+        self.query = query
+        self.answers: List = []
+
+    async def answer(self, results, **kwargs):
+        await self.telegram.call()
+        self.answers.append(results)
+        return True
+
+
+# One trace event per incoming update: {"t": seconds from start, "kind": ..., "chat_id": ...,
+# "user_id": ..., "text": ..., "image": key for /getai /aicook /aiseller}
+KINDS = ("askai", "askdoc", "private", "getai", "aicook", "aiseller")
+
+
+def synthetic_trace(count: int, rate: float, mix: Dict[str, float], users: int = 50,
+                    groups: int = 5, seed: int = 0) -> List[Dict]:
+    """Poisson arrivals at `rate` updates/second with the given command mix"""
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    questions = ["what is python", "explain recursion", "best pizza recipe", "how do planes fly",
+                 "summarize the news", "translate hello to french", "what is a black hole"]
+    t = 0.0
+    events = []
+    for _ in range(count):
+        t += rng.expovariate(rate)
+        kind = rng.choices(kinds, weights)[0]
+        user_id = rng.randint(1, users)
+        event = {"t": round(t, 4), "kind": kind, "user_id": user_id,
+                 "chat_id": user_id if kind == "private" else -1000 - rng.randint(1, groups),
+                 "text": f"{rng.choice(questions)} #{rng.randint(1, 1000)}"}
+        if kind in ("getai", "aicook", "aiseller"):
+            event["image"] = f"img{rng.randint(1, 20)}"
+        elif kind == "askdoc":
+            event["document"] = f"doc{rng.randint(1, 10)}"
+        events.append(event)
+    return events
+
+
+def load_trace(path: str) -> List[Dict]:
+    """Load a recorded trace, one JSON event per line"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def build_update(telegram: FakeTelegram, event: Dict) -> FakeMessage:
+    """Turn a trace event into the message a handler would receive"""
+    kind = event["kind"]
+    user = FakeUser(event["user_id"])
+    text = event.get("text", "")
+    if kind == "private":
+        return FakeMessage(telegram, FakeChat(event["chat_id"], "private"), user, text)
+
+    chat = FakeChat(event["chat_id"], "supergroup")
+    if kind == "askai":
+        return FakeMessage(telegram, chat, user, f"/askai {text}")
+    if kind == "askdoc":
+        # /askai in reply to a text document
+        key = event.get("document", "doc")
+        document = FakeMedia(key, len(telegram.document_bytes(key)), "text/plain", f"{key}.txt")
+        document_message = FakeMessage(telegram, chat, FakeUser(event["user_id"] + 1), document=document)
+        return FakeMessage(telegram, chat, user, f"/askai {text}", reply_to_message=document_message)
+
+    photo_message = FakeMessage(telegram, chat, FakeUser(event["user_id"] + 1), photo=FakeMedia(
+        event.get("image", "img"), len(telegram.image_bytes(event.get("image", "img")))))
+    command = f"/{kind} {text}" if kind == "aiseller" else f"/{kind}"
+    return FakeMessage(telegram, chat, user, command, reply_to_message=photo_message)
+
+
+def iter_events(trace: List[Dict], speed: float = 1.0) -> Iterator[Dict]:
+    for event in sorted(trace, key=lambda e: e["t"]):
+        yield dict(event, t=event["t"] / speed)
@@ -0,0 +1,231 @@
+# Offline load test: replays traffic through the real handlers of botmrg_grp.py and app.py
+# against a fake Gemini and a fake Telegram. No network access is needed.
+#
+# Usage:
+#   python benchmarks/loadtest.py --target bot --count 500 --rate 50
+#   python benchmarks/loadtest.py --target web --count 300 --rate 30 --latency lognormal:median=0.4,sigma=0.6
+#   python benchmarks/loadtest.py --target bot --trace recorded.jsonl --speed 4
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import warnings
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+warnings.filterwarnings("ignore")
+
+import fake_gemini
+import fake_telegram
+
+DEFAULT_MIX = {"askai": 0.37, "askdoc": 0.03, "private": 0.4, "getai": 0.1, "aicook": 0.05, "aiseller": 0.05}
+
+
+def prepare_environment(backend: fake_gemini.FakeGemini, telegram_limits: bool = False):
+    """Dummy credentials, no persistence, fake google.generativeai"""
+    for key, value in {"API_KEY": "offline", "API_ID": "1", "API_HASH": "offline",
+                       "BOT_TOKEN": "1:offline", "CONVERSATIONS_PERSIST": "false",
+                       "WEBAPP_ALLOW_ANONYMOUS": "true", "AD_ENABLED": "false",
+                       "REQUEST_LOG_ENABLED": "false"}.items():
+        os.environ.setdefault(key, value)
+    if not telegram_limits:
+        # Synthetic traffic packs many users into few chats, real send limits would dominate the numbers
+        for key in ("SEND_GLOBAL_RATE", "SEND_PRIVATE_RATE", "SEND_GROUP_RATE_PER_MIN"):
+            os.environ.setdefault(key, "100000")
+        os.environ.setdefault("SEND_BURST", "1000")
+    fake_gemini.install(backend)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def bot_handlers(bot) -> Dict:
+    return {
+        "askai": bot.askai_command,
+        "askdoc": bot.askai_command,
+        "private": bot.handle_private_message,
+        "getai": bot.getai_command,
+        "aicook": bot.aicook_command,
+        "aiseller": bot.aiseller_command,
+    }
+
+
+async def replay_bot(trace: List[Dict], telegram: fake_telegram.FakeTelegram) -> List[Dict]:
+    import botmrg_grp
+
+    handlers = bot_handlers(botmrg_grp)
+    client = fake_telegram.FakeClient(telegram)
+    results = []
+
+    async def run(event):
+        message = fake_telegram.build_update(telegram, event)
+        sent_before = len(telegram.sent)
+        start = time.perf_counter()
+        await handlers[event["kind"]](client, message)
+        latency = time.perf_counter() - start
+        replies = [s["text"] for s in telegram.sent[sent_before:] if s["reply_to"] == message.id]
+        # Handlers turn failures into replies, injected ones are tagged "(fake)"
+        error = any(r.startswith("An error occurred") or "(fake)" in r for r in replies)
+        results.append({"kind": event["kind"], "latency": latency, "error": error})
+
+    loop_start = time.perf_counter()
+    tasks = []
+    for event in fake_telegram.iter_events(trace):
+        # Open loop: updates arrive on schedule whether or not earlier ones finished
+        delay = event["t"] - (time.perf_counter() - loop_start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(run(event)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def replay_web(trace: List[Dict], workers: int) -> List[Dict]:
+    import app as webapp
+
+    client = webapp.app.test_client()
+    results = []
+
+    def run(event):
+        start = time.perf_counter()
+        response = client.post("/api/chat", json={"message": event.get("text", "")})
+        latency = time.perf_counter() - start
+        results.append({"kind": "web", "latency": latency, "error": response.status_code != 200})
+
+    # Same shape as a gunicorn deployment with `workers` threads
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        loop_start = time.perf_counter()
+        for event in fake_telegram.iter_events(trace):
+            delay = event["t"] - (time.perf_counter() - loop_start)
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, event)
+    return results
+
+
+def report(results: List[Dict], elapsed: float, backend: fake_gemini.FakeGemini, as_json: bool = False,
+           telegram: fake_telegram.FakeTelegram = None) -> Dict:
+    latencies = [r["latency"] for r in results]
+    summary = {
+        "requests": len(results),
+        "errors": sum(r["error"] for r in results),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies, default=0) * 1000, 1),
+        "upstream_calls": backend.calls,
+        "upstream_errors": backend.failures,
+        "upstream_max_in_flight": backend.max_in_flight,
+        "telegram_calls": len(telegram.sent) + telegram.deleted + telegram.edited if telegram else None,
+        "telegram_edits": telegram.edited if telegram else None,
+        "coalesced_edits": sys.modules["send_scheduler"].sender.coalesced if "send_scheduler" in sys.modules else None,
+        "telegram_flood_waits": telegram.floods if telegram else None,
+        "py_heap_peak_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2) if tracemalloc.is_tracing() else None,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    by_kind = {}
+    for r in results:
+        by_kind.setdefault(r["kind"], []).append(r["latency"])
+    summary["by_kind"] = {
+        kind: {"n": len(values), "p50_ms": round(percentile(values, 50) * 1000, 1),
+               "p99_ms": round(percentile(values, 99) * 1000, 1)}
+        for kind, values in sorted(by_kind.items())
+    }
+    # Tail-sampled traces from the handlers, to see which phase the slow requests spent their time in
+    from tracing import tracer
+    phases = {}
+    for trace in tracer.slow:
+        for name, _, duration in trace.spans:
+            phases[name] = phases.get(name, 0.0) + duration
+    summary["slow_traces"] = len(tracer.slow)
+    summary["slow_phase_ms"] = {name: round(total * 1000 / len(tracer.slow), 1) for name, total in sorted(phases.items())}
+
+    if as_json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for key, value in summary.items():
+            if key not in ("by_kind", "slow_phase_ms"):
+                print(f"{key:<24}{value}")
+        for kind, stats in summary["by_kind"].items():
+            print(f"  {kind:<10} n={stats['n']:<5} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+        if summary["slow_traces"]:
+            print("mean phase time of slow requests: " +
+                  ", ".join(f"{name} {ms}ms" for name, ms in summary["slow_phase_ms"].items()))
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the bot and web app handlers")
+    parser.add_argument("--target", choices=("bot", "web"), default="bot")
+    parser.add_argument("--trace", help="recorded trace, one JSON event per line")
+    parser.add_argument("--count", type=int, default=300, help="synthetic updates")
+    parser.add_argument("--rate", type=float, default=30.0, help="synthetic updates per second")
+    parser.add_argument("--mix", default=json.dumps(DEFAULT_MIX), help="JSON command mix")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--latency", default="lognormal:median=0.5,sigma=0.5",
+                        help="fake Gemini latency, e.g. constant:value=0.5, uniform:low=0.2,high=1, "
+                             "exponential:mean=0.5, lognormal:median=0.5,sigma=0.5,tail_rate=0.01,tail=20")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls failing with 429")
+    parser.add_argument("--send-latency", type=float, default=0.02, help="fake Telegram API latency (s)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="fraction of Telegram calls failing with FloodWait")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="keep the outbound scheduler's real Telegram send limits (SEND_* settings)")
+    parser.add_argument("--slow-ms", type=float, default=1000, help="requests slower than this are traced in detail")
+    parser.add_argument("--image-size", type=int, default=1024, help="synthetic photo side (px)")
+    parser.add_argument("--workers", type=int, default=8, help="web app worker threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--trace-memory", action="store_true", help="track Python heap peak (slower)")
+    parser.add_argument("--save-trace", help="write the replayed trace to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> Dict:
+    args = parse_args(argv)
+    backend = fake_gemini.FakeGemini(latency=args.latency, error_rate=args.error_rate,
+                                     rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    os.environ.setdefault("SLOW_REQUEST_MS", str(args.slow_ms))
+    prepare_environment(backend, args.telegram_limits)
+
+    if args.trace:
+        trace = fake_telegram.load_trace(args.trace)
+    else:
+        mix = json.loads(args.mix)
+        if args.target == "web":
+            mix = {"private": 1.0}
+        trace = fake_telegram.synthetic_trace(args.count, args.rate, mix, seed=args.seed)
+    trace = list(fake_telegram.iter_events(trace, args.speed))
+    if args.save_trace:
+        with open(args.save_trace, "w") as f:
+            f.writelines(json.dumps(event) + "\n" for event in trace)
+
+    telegram = fake_telegram.FakeTelegram(send_latency=args.send_latency, image_size=args.image_size,
+                                          seed=args.seed, flood_rate=args.flood_rate)
+    if args.trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if args.target == "bot":
+        results = asyncio.run(replay_bot(trace, telegram))
+    else:
+        results = replay_web(trace, args.workers)
+    elapsed = time.perf_counter() - start
+    return report(results, elapsed, backend, args.json, telegram)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,12 @@
 # This scripts contains use cases for simple bots
 # import requirements 
 import os
-import asyncio
-import PIL.Image
-import google.generativeai as genai
-from pathlib import Path
 from pyrogram import Client, filters, enums
 from pyrogram.types import Message
 from ad_config import ad_config, should_show_ad
+import gemini
+from send_scheduler import sender
+from adaptive_limiter import upstream_limiter
 
 generation_config_cook = {
   "temperature": 0.35,
@@ -26,13 +25,13 @@ API_HASH = os.environ['API_HASH']
 # Telegram Bot API TOKEN generated from @botfather
 BOT_TOKEN = os.environ['BOT_TOKEN']
 
-# configure API KEY for gemini 
-genai.configure(api_key=API_KEY)
+# configure API KEY for gemini, applied when the first model is used
+gemini.configure(api_key=API_KEY)
 
-# Setup models
-model = genai.GenerativeModel("gemini-pro-vision")
-model_text = genai.GenerativeModel("gemini-pro")
-model_cook = genai.GenerativeModel(model_name="gemini-pro-vision",
+# Setup models, constructed lazily for a fast cold start
+model = gemini.LazyModel("gemini-pro-vision")
+model_text = gemini.LazyModel("gemini-pro")
+model_cook = gemini.LazyModel(model_name="gemini-pro-vision",
                               generation_config=generation_config_cook)
 # configure pyrogram client 
 app = Client("gemini_ai", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
@@ -41,14 +40,14 @@ app = Client("gemini_ai", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 async def start(_, message):
         chat = model_text.start_chat()
         prompt = "Hi"
-        response = chat.send_message(prompt)
+        response = await upstream_limiter.call(chat.send_message_async, prompt)
 
-        await message.reply_text(f"{response.text}", parse_mode=enums.ParseMode.MARKDOWN)
+        await sender.reply(message, f"{response.text}", parse_mode=enums.ParseMode.MARKDOWN)
 
 @app.on_message(filters.command("askai") & filters.private)
 async def say(_, message: Message):
     try:
-        i = await message.reply_text("<code>Please Wait...</code>")
+        i = sender.status(message, "<code>Please Wait...</code>")
 
 
         if len(message.command) > 1:
@@ -57,13 +56,13 @@ async def say(_, message: Message):
          prompt = message.reply_to_message.text
         else:
          await i.delete()
-         await message.reply_text(
+         await sender.reply(message,
             f"<b>Usage: </b><code>/askai [prompt/reply to message]</code>"
         )
          return
 
         chat = model_text.start_chat()
-        response = chat.send_message(prompt)
+        response = await upstream_limiter.call(chat.send_message_async, prompt)
         await i.delete()
 
         response_text = f"**Question:**`{prompt}`\n**Answer:** {response.text}"
@@ -74,19 +73,19 @@ async def say(_, message: Message):
             if ad_message:
                 response_text += f"\n\n{ad_message}"
 
-        await message.reply_text(response_text, parse_mode=enums.ParseMode.MARKDOWN)
+        await sender.reply(message, response_text, parse_mode=enums.ParseMode.MARKDOWN)
     except Exception as e:
         await i.delete()
-        await message.reply_text(f"An error occurred: {str(e)}")
+        await sender.reply(message, f"An error occurred: {str(e)}")
 
 @app.on_message(filters.text & filters.private)
 async def say(_, message: Message):
     try:
-        i = await message.reply_text("<code>Please Wait...</code>")
+        i = sender.status(message, "<code>Please Wait...</code>")
 
         prompt = message.text
         chat = model_text.start_chat()
-        response = chat.send_message(prompt)
+        response = await upstream_limiter.call(chat.send_message_async, prompt)
         await i.delete()
 
         response_text = f"**Question:**`{prompt}`\n**Answer:** {response.text}"
@@ -97,70 +96,73 @@ async def say(_, message: Message):
             if ad_message:
                 response_text += f"\n\n{ad_message}"
 
-        await message.reply_text(response_text, parse_mode=enums.ParseMode.MARKDOWN)
+        await sender.reply(message, response_text, parse_mode=enums.ParseMode.MARKDOWN)
     except Exception as e:
         await i.delete()
-        await message.reply_text(f"An error occurred: {str(e)}")
+        await sender.reply(message, f"An error occurred: {str(e)}")
 
 @app.on_message(filters.command("getai") & filters.private)
 async def say(_, message: Message):
     try:
-        i = await message.reply_text("<code>Please Wait...</code>")
+        i = sender.status(message, "<code>Please Wait...</code>")
 
         base_img = await message.reply_to_message.download()
 
+        import PIL.Image
         img = PIL.Image.open(base_img)
 
-        response = model.generate_content(img)
+        response = await upstream_limiter.call(model.generate_content_async, img)
         await i.delete()
 
-        await message.reply_text(
+        await sender.reply(message,
             f"**Detail Of Image:** {response.parts[0].text}", parse_mode=enums.ParseMode.MARKDOWN
         )
         os.remove(base_img)
     except Exception as e:
         await i.delete()
-        await message.reply_text(str(e))
+        await sender.reply(message, str(e))
 
 @app.on_message(filters.command("aicook") & filters.private)
 async def say(_, message: Message):
     try:
-        i = await message.reply_text("<code>Cooking...</code>")
+        i = sender.status(message, "<code>Cooking...</code>")
 
         base_img = await message.reply_to_message.download()
 
+        import PIL.Image
         img = PIL.Image.open(base_img)
         cook_img = [
         "Accurately identify the baked good in the image and provide an appropriate and recipe consistent with your analysis. ",
         img,
         ]
 
-        response = model_cook.generate_content(cook_img)
+        response = await upstream_limiter.call(model_cook.generate_content_async, cook_img)
         await i.delete()
 
-        await message.reply_text(
+        await sender.reply(message,
             f"{response.text}", parse_mode=enums.ParseMode.MARKDOWN
         )
         os.remove(base_img)
     except Exception as e:
         await i.delete()
-        await message.reply_text(f"Kindly reply to an image 🫥")
+        await sender.reply(message, f"Kindly reply to an image 🫥")
 
 @app.on_message(filters.command("aiseller") & filters.private)
 async def say(_, message: Message):
     try:
-        i = await message.reply_text("<code>Generating...</code>")
+        i = sender.status(message, "<code>Generating...</code>")
         if len(message.command) > 1:
          taud = message.text.split(maxsplit=1)[1]
         else:
          await i.delete()
-         await message.reply_text(
+         await sender.reply(message,
             f"<b>Usage: </b><code>/aiseller [target audience] [reply to product image]</code>"
         )
          return
 
         base_img = await message.reply_to_message.download()
 
+        import PIL.Image
         img = PIL.Image.open(base_img)
         sell_img = [
         "Given an image of a product and its target audience, write an engaging marketing description",
@@ -170,17 +172,19 @@ async def say(_, message: Message):
         taud
         ]
 
-        response = model.generate_content(sell_img)
+        response = await upstream_limiter.call(model.generate_content_async, sell_img)
         await i.delete()
 
-        await message.reply_text(
+        await sender.reply(message,
             f"{response.text}", parse_mode=enums.ParseMode.MARKDOWN
         )
         os.remove(base_img)
     except Exception as e:
         await i.delete()
-        await message.reply_text(f"<b>Usage: </b><code>/aiseller [target audience] [reply to product image]</code>")
+        await sender.reply(message, f"<b>Usage: </b><code>/aiseller [target audience] [reply to product image]</code>")
 
 # Run the bot
 if __name__ == "__main__":
+    # Finish the slow genai import while pyrogram connects to Telegram
+    gemini.prewarm()
     app.run()
\ No newline at end of file
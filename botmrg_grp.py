@@ -1,20 +1,33 @@
 # This scripts contains use cases for simple bots
 # import requirements 
 import os
+import html
 import asyncio
-import PIL.Image
-import google.generativeai as genai
-from pathlib import Path
+from typing import Dict, List, Tuple
 from pyrogram import Client, filters, enums
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
-from ad_config import ad_config, should_show_ad
-
-generation_config_cook = {
-  "temperature": 0.35,
-  "top_p": 0.95,
-  "top_k": 40,
-  "max_output_tokens": 1024,
-}
+from pyrogram.types import (Message, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo, InlineQuery,
+                            InlineQueryResultArticle, InputTextMessageContent)
+from ad_config import get_ad_config, should_show_ad, load_state as load_ad_state, save_state as save_ad_state
+from semantic_cache import semantic_cache
+from chat_history import create_compactor
+from prompt_registry import prompt_registry
+import gemini
+from image_pool import image_pool
+from image_cache import image_cache
+from micro_batcher import create_batcher
+from send_scheduler import sender
+from lifecycle import lifecycle
+from tracing import tracer, loop_monitor, span, annotate, record_error
+from profiler import profiler, ProfilerBusy
+from task_tracker import LatestTaskTracker, Superseded, Stopped
+from ttl_cache import TTLCache
+from documents import create_document_qa, document_kind, DocumentError
+from audio import create_transcriber, audio_media, audio_prompt, AudioError
+from group_digest import create_digest
+from adaptive_limiter import upstream_limiter
+from hedging import create_hedger
+from request_log import request_log
+from tenancy import HandlerTable, charge_current, current_tenant, scoped
 
 # API KEYS
 # Gemini Ai API KEY
@@ -23,157 +36,304 @@ API_KEY= os.environ['API_KEY']
 API_ID = os.environ['API_ID']
 # Telegram Auth API HASH
 API_HASH = os.environ['API_HASH']
-# Telegram Bot API TOKEN generated from @botfather
-BOT_TOKEN = os.environ['BOT_TOKEN']
-
-genai.configure(api_key=API_KEY)
-
-# Setup models
-model = genai.GenerativeModel("gemini-1.5-flash")
-model_text = genai.GenerativeModel("gemini-1.5-flash")
-model_cook = genai.GenerativeModel(model_name="gemini-1.5-flash",
-                              generation_config=generation_config_cook)
+# Telegram Bot API TOKEN generated from @botfather, not needed when multibot.py runs the bots
+BOT_TOKEN = os.environ.get('BOT_TOKEN', '')
+
+# google.generativeai is imported and models are built on first use, for a fast cold start
+gemini.configure(api_key=API_KEY)
+
+# Setup models, per-command models are compiled from prompts.json by the prompt registry
+model_text = gemini.LazyModel("gemini-1.5-flash")
+# Per-chat conversation history for private chats
+chat_history = create_compactor(model_text)
+
+# Optional hedging of /askai and inline calls that run past the usual latency, the backup call
+# can go to another model (HEDGE_MODEL), e.g. a smaller one that's rarely as slow
+askai_hedger = create_hedger()
+HEDGE_MODEL = os.environ.get('HEDGE_MODEL', '')
+
+async def ask_model_once(prompt: str, model_name: str = "") -> str:
+    model = prompt_registry.variant("askai", model_name) if model_name else prompt_registry.model("askai")
+    response = await upstream_limiter.call(model.generate_content_async, prompt)
+    return response.text
+
+async def ask_model(prompt: str) -> str:
+    return await askai_hedger.call(lambda: ask_model_once(prompt), lambda: ask_model_once(prompt, HEDGE_MODEL))
+
+async def ask_model_batch(prompt: str) -> str:
+    response = await upstream_limiter.call(
+        prompt_registry.model("askai").generate_content_async,
+        prompt, generation_config={"response_mime_type": "application/json"}
+    )
+    return response.text
+
+async def summarize_text(prompt: str) -> str:
+    response = await upstream_limiter.call(model_text.generate_content_async, prompt)
+    return response.text
+
+async def transcribe_audio(contents: list) -> str:
+    response = await upstream_limiter.call(prompt_registry.model("transcribe").generate_content_async, contents)
+    return response.text
+
+# Optional micro-batching of /askai bursts in the same group (ASKAI_BATCH_WINDOW_MS), batched
+# questions are charged to their own bot's quota when asked
+askai_batcher = create_batcher(ask_model, ask_model_batch, charge_current)
+# /askai in reply to a PDF or text file: chunked map-reduce, notes cached per document
+# (not hedged: long map/reduce calls would skew the latency /askai is hedged at)
+document_qa = create_document_qa(ask_model_once)
+# Voice notes and audio files: transcribed in memory once per file, then answered as text
+audio_transcriber = create_transcriber(transcribe_audio)
+# Recent group messages for /tldr, with a running summary
+group_digest = create_digest(summarize_text)
 # configure pyrogram client 
 app = Client("gemini_ai", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
+# Handlers are declared once and registered on this client, or on every bot's client by multibot.py
+handlers = HandlerTable()
 
-@app.on_message(filters.command("askai") & filters.group)
-async def say(_, message: Message):
-    try:
-        i = await message.reply_text("<code>Please Wait...</code>")
+# Warm state survives restarts: restored in the background after startup, saved after draining
+lifecycle.warm_state("semantic cache", semantic_cache.restore, semantic_cache.save)
+lifecycle.warm_state("image cache", image_cache.restore, image_cache.save)
+lifecycle.warm_state("config sessions", load_ad_state, save_ad_state)
 
+@handlers.on_message(filters.command("askai") & filters.group)
+@lifecycle.tracked
+async def askai_command(client, message: Message):
+    try:
+        i = sender.status(message, "<code>Please Wait...</code>")
 
+        document = message.reply_to_message.document if message.reply_to_message else None
+        if document and document_kind(document) is None and len(message.command) > 1:
+            # A question in reply to an unsupported file (a photo sent as a file, a .docx) is answered on its own
+            document = None
+        audio = audio_media(message.reply_to_message)
         if len(message.command) > 1:
          prompt = message.text.split(maxsplit=1)[1]
+        elif document or audio:
+         prompt = ""
         elif message.reply_to_message:
          prompt = message.reply_to_message.text
         else:
          await i.delete()
-         await message.reply_text(
-            f"<b>Usage: </b><code>/askai [prompt/reply to message]</code>"
+         await sender.reply(message,
+            f"<b>Usage: </b><code>/askai [prompt/reply to message, document or voice note]</code>"
         )
          return
 
-        chat = model_text.start_chat()
-        response = chat.send_message(prompt)
+        if document:
+            kind = document_qa.check(document)
+            answer = await document_qa.ask(
+                document.file_unique_id, document.file_name or "document",
+                lambda: client.stream_media(message.reply_to_message), kind, prompt,
+                # Edits are coalesced by the scheduler, only the latest count is sent
+                progress=lambda done, total: i.update(f"<code>Reading the document... {done}/{total} parts</code>"),
+            )
+        else:
+            if audio:
+                transcript = await audio_transcriber.transcript(
+                    audio, lambda: message.reply_to_message.download(in_memory=True)
+                )
+                prompt = audio_prompt(transcript, prompt)
+            with span("cache"):
+                answer = semantic_cache.get(prompt, "askai")
+            annotate(cached=answer is not None)
+            if answer is None:
+                with span("gemini"):
+                    answer = await askai_batcher.ask(scoped(message.chat.id), prompt)
+                semantic_cache.put(prompt, answer, "askai")
         await i.delete()
 
-        response_text = f"**Answer:** {response.text}"
+        response_text = f"**Answer:** {answer}"
         
         # Add ad if needed
         if should_show_ad():
-            ad_message = ad_config.get_ad_message()
+            ad_message = get_ad_config().get_ad_message()
             if ad_message:
                 response_text += f"\n\n{ad_message}"
 
-        await message.reply_text(response_text, parse_mode=enums.ParseMode.MARKDOWN)
+        with span("send"):
+            await sender.reply(message, response_text, parse_mode=enums.ParseMode.MARKDOWN)
+    except (DocumentError, AudioError) as e:
+        await i.delete()
+        await sender.reply(message, str(e))
     except Exception as e:
+        record_error(e)
         await i.delete()
-        await message.reply_text(f"An error occurred: {str(e)}")
-
-@app.on_message(filters.text & filters.private)
-async def say(_, message: Message):
+        await sender.reply(message, f"An error occurred: {str(e)}")
+
+# Runs before the command handlers (group -1) and lets every message through to them
+@handlers.on_message(filters.group & (filters.text | filters.caption), group=-1)
+async def record_group_message(_, message: Message):
+    text = message.text or message.caption
+    if text.startswith("/"):
+        return
+    author = message.from_user or message.sender_chat
+    name = getattr(author, "first_name", None) or getattr(author, "title", None) or "Someone"
+    group_digest.record(scoped(message.chat.id), name, text)
+
+@handlers.on_message(filters.command("tldr") & filters.group)
+@lifecycle.tracked
+async def tldr_command(_, message: Message):
+    """Summarize what was said in the group recently"""
     try:
-        await message.reply_chat_action(enums.ChatAction.TYPING)
-        prompt = message.text
-        chat = model_text.start_chat()
-        response = chat.send_message(prompt)
-
-        response_text = f"{response.text}"
-        
-        # Add ad if needed
-        if should_show_ad():
-            ad_message = ad_config.get_ad_message()
-            if ad_message:
-                response_text += f"\n\n{ad_message}"
-
-        await message.reply_text(response_text, parse_mode=enums.ParseMode.MARKDOWN)
+        i = sender.status(message, "<code>Please Wait...</code>")
+        with span("gemini"):
+            summary = await group_digest.tldr(scoped(message.chat.id))
+        await i.delete()
+        if summary is None:
+            await sender.reply(message, "Nothing to summarize yet, I only see messages sent while I'm in the group.")
+            return
+        with span("send"):
+            await sender.reply(message, f"**TL;DR**\n\n{summary}", parse_mode=enums.ParseMode.MARKDOWN)
     except Exception as e:
-        await message.reply_text(f"An error occurred: {str(e)}")
-
-@app.on_message(filters.command("getai") & filters.group)
-async def say(_, message: Message):
+        record_error(e)
+        await i.delete()
+        await sender.reply(message, f"An error occurred: {str(e)}")
+
+# Inline mode (@bot question): queries arrive on every keystroke, so each user's query
+# waits out a debounce and a newer one cancels it, before or during the Gemini call
+INLINE_DEBOUNCE = float(os.environ.get('INLINE_DEBOUNCE_MS', '700')) / 1000
+INLINE_MIN_CHARS = int(os.environ.get('INLINE_MIN_CHARS', '3'))
+INLINE_CACHE_TTL = int(os.environ.get('INLINE_CACHE_TTL', '300'))
+inline_tasks = LatestTaskTracker()
+inline_cache = TTLCache(ttl=INLINE_CACHE_TTL, max_entries=int(os.environ.get('INLINE_CACHE_SIZE', '1000')))
+
+async def debounced_answer(query: str) -> str:
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    with span("gemini"):
+        return await ask_model(query)
+
+@handlers.on_inline_query()
+@lifecycle.tracked
+async def inline_query_handler(_, inline_query: InlineQuery):
+    query = " ".join(inline_query.query.split())
+    if len(query) < INLINE_MIN_CHARS:
+        # Still typing, also drops any earlier prefix that's waiting
+        inline_tasks.cancel(scoped(inline_query.from_user.id), Superseded)
+        return
     try:
-        i = await message.reply_text("<code>Please Wait...</code>")
-
-        base_img = await message.reply_to_message.download()
-
-        img = PIL.Image.open(base_img)
+        key = query.lower()
+        answer = inline_cache.get(key) or semantic_cache.get(query, "askai")
+        annotate(cached=answer is not None)
+        if answer is None:
+            answer = await inline_tasks.run(scoped(inline_query.from_user.id), debounced_answer(query))
+            inline_cache.put(key, answer)
+        else:
+            # Answered from the cache, an earlier prefix still waiting or generating is abandoned
+            inline_tasks.cancel(scoped(inline_query.from_user.id), Superseded)
+
+        with span("send"):
+            await inline_query.answer([
+                InlineQueryResultArticle(
+                    title=query[:64],
+                    description=answer[:120],
+                    input_message_content=InputTextMessageContent(f"**{query}**\n\n{answer}"[:4096]),
+                )
+            ], cache_time=INLINE_CACHE_TTL)
+    except Superseded:
+        annotate(superseded=True)
+    except Exception as e:
+        record_error(e)
+        print(f"Error answering inline query: {e}")
+
+async def analyze_image(photo_message: Message, command: str, prompt: str = "") -> str:
+    """Run a vision command, reusing the answer for near-duplicates of an analyzed image"""
+    cache_key = f"{command}\n{prompt}"
+    media = photo_message.photo or photo_message.document
+    file_id = getattr(media, "file_unique_id", None)
+
+    # Exact repeats (e.g. forwards) are known by file id, no download needed
+    answer = image_cache.get(image_cache.hash_for_file(file_id), cache_key)
+    annotate(cached=answer is not None)
+    if answer is not None:
+        return answer
+
+    # Downloaded in memory, decoded and resized in the image pool, off the event loop
+    with span("download"):
+        photo = await photo_message.download(in_memory=True)
+    with span("preprocess"):
+        img, image_hash = await image_pool.preprocess(photo.getvalue())
+    image_cache.remember_file(file_id, image_hash)
+    answer = image_cache.get(image_hash, cache_key)
+    annotate(cached=answer is not None)
+    if answer is None:
+        contents = [img, prompt] if prompt else img
+        with span("gemini"):
+            response = await upstream_limiter.call(prompt_registry.model(command).generate_content_async, contents)
+        answer = response.text
+        image_cache.put(image_hash, cache_key, answer)
+    return answer
+
+@handlers.on_message(filters.command("getai") & filters.group)
+@lifecycle.tracked
+async def getai_command(_, message: Message):
+    try:
+        i = sender.status(message, "<code>Please Wait...</code>")
 
-        response = model.generate_content(img)
+        answer = await analyze_image(message.reply_to_message, "getai")
         await i.delete()
 
-        await message.reply_text(
-            f"**Detail Of Image:** {response.parts[0].text}", parse_mode=enums.ParseMode.MARKDOWN
-        )
-        os.remove(base_img)
+        with span("send"):
+            await sender.reply(message,
+                f"**Detail Of Image:** {answer}", parse_mode=enums.ParseMode.MARKDOWN
+            )
     except Exception as e:
+        record_error(e)
         await i.delete()
-        await message.reply_text(str(e))
+        await sender.reply(message, str(e))
 
-@app.on_message(filters.command("aicook") & filters.group)
-async def say(_, message: Message):
+@handlers.on_message(filters.command("aicook") & filters.group)
+@lifecycle.tracked
+async def aicook_command(_, message: Message):
     try:
-        i = await message.reply_text("<code>Cooking...</code>")
-
-        base_img = await message.reply_to_message.download()
+        i = sender.status(message, "<code>Cooking...</code>")
 
-        img = PIL.Image.open(base_img)
-        cook_img = [
-        "Accurately identify the baked good in the image and provide an appropriate and recipe consistent with your analysis. ",
-        img,
-        ]
-
-        response = model_cook.generate_content(cook_img)
+        answer = await analyze_image(message.reply_to_message, "aicook")
         await i.delete()
 
-        await message.reply_text(
-            f"{response.text}", parse_mode=enums.ParseMode.MARKDOWN
-        )
-        os.remove(base_img)
+        with span("send"):
+            await sender.reply(message,
+                f"{answer}", parse_mode=enums.ParseMode.MARKDOWN
+            )
     except Exception as e:
+        record_error(e)
         await i.delete()
-        await message.reply_text(str(e))
+        await sender.reply(message, str(e))
 
-@app.on_message(filters.command("aiseller") & filters.group)
-async def say(_, message: Message):
+@handlers.on_message(filters.command("aiseller") & filters.group)
+@lifecycle.tracked
+async def aiseller_command(_, message: Message):
     try:
-        i = await message.reply_text("<code>Generating...</code>")
+        i = sender.status(message, "<code>Generating...</code>")
         if len(message.command) > 1:
          taud = message.text.split(maxsplit=1)[1]
         else:
          await i.delete()
-         await message.reply_text(
+         await sender.reply(message,
             f"<b>Usage: </b><code>/aiseller [target audience] [reply to product image]</code>"
         )
          return
 
-        base_img = await message.reply_to_message.download()
-
-        img = PIL.Image.open(base_img)
-        sell_img = [
-        "Given an image of a product and its target audience, write an engaging marketing description",
-        "Product Image: ",
-        img,
-        "Target Audience: ",
-        taud
-        ]
-
-        response = model.generate_content(sell_img)
+        answer = await analyze_image(
+            message.reply_to_message, "aiseller", prompt_registry.render("aiseller", audience=taud)
+        )
         await i.delete()
 
-        await message.reply_text(
-            f"{response.text}", parse_mode=enums.ParseMode.MARKDOWN
-        )
-        os.remove(base_img)
+        with span("send"):
+            await sender.reply(message,
+                f"{answer}", parse_mode=enums.ParseMode.MARKDOWN
+            )
     except Exception as e:
+        record_error(e)
         await i.delete()
-        await message.reply_text(f"<b>Usage: </b><code>/aiseller [target audience] [reply to product image]</code>")
+        await sender.reply(message, f"<b>Usage: </b><code>/aiseller [target audience] [reply to product image]</code>")
 
-@app.on_message(filters.command("webapp") & (filters.private | filters.group))
+@handlers.on_message(filters.command("webapp") & (filters.private | filters.group))
+@lifecycle.tracked
 async def webapp_command(_, message: Message):
     """Handle /webapp command to show web app"""
     try:
-        # Get the web app URL from ad_config
+        # Get the web app URL from this bot's ad config
+        ad_config = get_ad_config()
         web_app_url = ad_config.web_app_url or ad_config.suggest_web_app_url()
         
         keyboard = InlineKeyboardMarkup([
@@ -201,59 +361,197 @@ Experience our AI assistant in a beautiful web interface!
 Click the button below to launch the web app:
 """
         
-        await message.reply_text(
+        await sender.reply(message,
             webapp_message, 
             reply_markup=keyboard,
             parse_mode=enums.ParseMode.MARKDOWN
         )
         
     except Exception as e:
-        await message.reply_text(f"Error opening web app: {str(e)}")
+        await sender.reply(message, f"Error opening web app: {str(e)}")
 
 # Add configuration commands from ad_config
-@app.on_message(filters.command("config") & filters.private)
+@handlers.on_message(filters.command("config") & filters.private)
+@lifecycle.tracked
 async def config_command(client, message: Message):
     from ad_config import handle_config_command
     await handle_config_command(client, message)
 
-@app.on_message(filters.command("network") & filters.private)  
+@handlers.on_message(filters.command("network") & filters.private)
+@lifecycle.tracked
 async def network_command(client, message: Message):
     from ad_config import handle_network_info
     await handle_network_info(client, message)
 
-@app.on_message(filters.command("autoconfig") & filters.private)
+@handlers.on_message(filters.command("autoconfig") & filters.private)
+@lifecycle.tracked
 async def autoconfig_command(client, message: Message):
     from ad_config import handle_auto_config
     await handle_auto_config(client, message)
 
+# Admin diagnostics, only for the Telegram user ids in ADMIN_IDS
+ADMIN_IDS = [int(user_id) for user_id in os.environ.get('ADMIN_IDS', '').split(',') if user_id.strip()]
+
+@handlers.on_message(filters.command("slow") & filters.private & filters.user(ADMIN_IDS))
+async def slow_command(_, message: Message):
+    """Show the latest slow or failed requests with their phase timings"""
+    lines = [f"Slow (> {tracer.slow_threshold * 1000:.0f} ms) or failed, of {tracer.requests} requests:"]
+    lines += [trace.format() for trace in tracer.recent(10)] or ["none"]
+    lines += ["", loop_monitor.stats(), f"sends: {sender.stats()}", f"inline queries: {inline_tasks.stats()}",
+              f"private chats: {chat_tasks.stats()}", f"documents: {document_qa.stats()}",
+              f"audio: {audio_transcriber.stats()}", f"tldr: {group_digest.stats()}",
+              f"gemini: {upstream_limiter.stats()}", f"askai hedging: {askai_hedger.stats()}",
+              f"request log: {request_log.stats()}"]
+    tenant = current_tenant.get()
+    if tenant is not None:
+        lines.append(tenant.stats())
+    await sender.reply(message, "\n".join(lines)[:4000], parse_mode=enums.ParseMode.DISABLED)
+
+@handlers.on_message(filters.command("profile") & filters.private & filters.user(ADMIN_IDS))
+async def profile_command(_, message: Message):
+    """Sample the running bot for a few seconds and show where the time goes"""
+    try:
+        seconds = float(message.command[1]) if len(message.command) > 1 else 10
+    except ValueError:
+        await sender.reply(message, "<b>Usage: </b><code>/profile [seconds]</code>")
+        return
+    i = sender.status(message, f"<code>Profiling for {seconds:.0f}s...</code>")
+    try:
+        profile = await asyncio.to_thread(profiler.run, seconds)
+    except ProfilerBusy as e:
+        await i.delete()
+        await sender.reply(message, str(e))
+        return
+    path = profiler.save(profile)
+    await i.delete()
+    await sender.reply(message, f"<pre>{html.escape(profile.top())[:3800]}</pre>\nCollapsed stacks: <code>{path}</code>",
+                       parse_mode=enums.ParseMode.HTML)
+
+# In-flight private chat generations, one per chat
+chat_tasks = LatestTaskTracker()
+# Private messages whose answer was cancelled by a newer message, per chat
+chat_unanswered: Dict[object, List[Message]] = {}
+
+def answered(chat_id, messages: List[Message]):
+    """Forget messages that have been answered, or failed"""
+    ids = {message.id for message in messages}
+    remaining = [message for message in chat_unanswered.get(chat_id, []) if message.id not in ids]
+    if remaining:
+        chat_unanswered[chat_id] = remaining
+    else:
+        chat_unanswered.pop(chat_id, None)
+
+async def chat_answer(chat_id: int, prompt: str) -> str:
+    """Answer a private chat message in the context of the conversation so far"""
+    # Follow-ups depend on earlier turns, only fresh questions can reuse cached answers
+    with span("history"):
+        await chat_history.refresh(chat_id)
+        fresh = not chat_history.has_history(chat_id)
+    with span("cache"):
+        answer = semantic_cache.get(prompt, "chat") if fresh else None
+    annotate(cached=answer is not None)
+    if answer is None:
+        with span("history"):
+            history = chat_history.build_history(chat_id, prompt)
+        chat = prompt_registry.model("chat").start_chat(history=history)
+        with span("gemini"):
+            response = await upstream_limiter.call(chat.send_message_async, prompt)
+        answer = response.text
+        if fresh:
+            semantic_cache.put(prompt, answer, "chat")
+    return answer
+
+async def message_prompt(message: Message) -> str:
+    """Text of a private message, voice notes and audio files are transcribed (once per file)"""
+    audio = audio_media(message)
+    if not audio:
+        return message.text
+    transcript = await audio_transcriber.transcript(audio, lambda: message.download(in_memory=True))
+    return audio_prompt(transcript, message.caption or "")
+
+async def private_answer(chat_id, messages: List[Message]) -> Tuple[str, str]:
+    """Answer the latest private message together with the earlier ones it cancelled"""
+    prompts = [await message_prompt(message) for message in messages]
+    prompt = "\n\n".join(prompts)
+    return prompt, await chat_answer(chat_id, prompt)
+
+@handlers.on_message(filters.command("stop") & filters.private)
+@lifecycle.tracked
+async def stop_command(_, message: Message):
+    """Cancel the answer being generated in this chat"""
+    chat_unanswered.pop(scoped(message.chat.id), None)
+    if chat_tasks.cancel(scoped(message.chat.id)):
+        await sender.reply(message, "⏹ Stopped.")
+    else:
+        await sender.reply(message, "Nothing to stop.")
+
 # Handle config input
-@app.on_message(filters.text & filters.private)
+@handlers.on_message((filters.text | filters.voice | filters.audio) & filters.private)
+@lifecycle.tracked
 async def handle_private_message(client, message: Message):
     from ad_config import handle_config_input
     
     # Check if user is in config session first
-    if await handle_config_input(client, message):
+    if message.text and await handle_config_input(client, message):
         return  # Message was handled as config input
     
     # Otherwise, process as normal AI chat
     try:
-        await message.reply_chat_action(enums.ChatAction.TYPING)
-        prompt = message.text
-        chat = model_text.start_chat()
-        response = chat.send_message(prompt)
-
-        response_text = f"{response.text}"
+        audio = audio_media(message)
+        if audio:
+            # Size and format limits, before anything is downloaded
+            audio_transcriber.check(audio)
+        sender.chat_action(message, enums.ChatAction.TYPING)
+        # Keyed by user, so the conversation is shared with the web app
+        chat_id = scoped(message.from_user.id)
+        # Only the latest message of a chat is answered, a newer one or /stop cancels this one,
+        # and the newer one is answered together with the messages it cancelled
+        messages = chat_unanswered.setdefault(chat_id, [])
+        messages.append(message)
+        messages = list(messages)
+        annotate(carried=len(messages) - 1)
+        try:
+            prompt, answer = await chat_tasks.run(chat_id, private_answer(chat_id, messages))
+        except Superseded:
+            # Answered together with the newer message
+            annotate(cancelled="Superseded")
+            return
+        except Stopped:
+            annotate(cancelled="Stopped")
+            return
+        except Exception:
+            answered(chat_id, messages)
+            raise
+        answered(chat_id, messages)
+        # The answer may have taken longer than the history stays fresh
+        await chat_history.refresh(chat_id)
+        chat_history.add_turn(chat_id, prompt, answer)
+
+        response_text = f"{answer}"
         
         # Add ad if needed
         if should_show_ad():
-            ad_message = ad_config.get_ad_message()
+            ad_message = get_ad_config().get_ad_message()
             if ad_message:
                 response_text += f"\n\n{ad_message}"
 
-        await message.reply_text(response_text, parse_mode=enums.ParseMode.MARKDOWN)
+        with span("send"):
+            await sender.reply(message, response_text, parse_mode=enums.ParseMode.MARKDOWN)
+    except AudioError as e:
+        await sender.reply(message, str(e))
     except Exception as e:
-        await message.reply_text(f"An error occurred: {str(e)}")
+        record_error(e)
+        await sender.reply(message, f"An error occurred: {str(e)}")
 
 # Run the bot
 if __name__ == "__main__":
-    app.run()
+    # Without a token pyrogram would fall back to a saved session or an interactive login prompt
+    if not BOT_TOKEN:
+        raise SystemExit("BOT_TOKEN is not set (or use multibot.py with bots.json)")
+    # Fork the image workers before any threads are started
+    image_pool.start()
+    # Finish the slow genai import while pyrogram connects to Telegram
+    gemini.prewarm()
+    handlers.register(app)
+    # Stops on SIGTERM/SIGINT after draining in-flight updates and saving warm state
+    app.run(lifecycle.serve(app))
@@ -0,0 +1,296 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from conversation_store import create_store
+from adaptive_limiter import upstream_limiter
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an AI assistant.
+Keep every fact, name, preference and open question the assistant may need later.
+Write at most {max_words} words, as plain prose.
+
+Current summary:
+{summary}
+
+New turns to fold in:
+{turns}
+
+Updated summary:"""
+
+SUMMARY_PREFIX = "Summary of our conversation so far: "
+SUMMARY_ACK = "Got it, I'll keep that in mind."
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for Gemini)"""
+    return len(text) // 4 + 1
+
+
+def format_turns(turns: List[Tuple[str, str]]) -> str:
+    return "\n".join(f"User: {user}\nAssistant: {model}" for user, model in turns)
+
+
+class Conversation:
+    """History of a single chat: rolling summary plus recent verbatim turns"""
+
+    def __init__(self):
+        self.summary = ""
+        self.turns: List[Tuple[str, str]] = []
+        # Turns moved out of the verbatim window but not yet folded into the summary
+        self.pending: List[Tuple[str, str]] = []
+        self.summarizing = False
+        # Bumped on every change, used to spot updates made by another process
+        self.version = 0
+        # When the store was last checked for a newer version (time.monotonic())
+        self.checked = 0.0
+
+    def to_state(self) -> Dict:
+        return {
+            "summary": self.summary,
+            "turns": [list(turn) for turn in self.pending + self.turns],
+            "version": self.version,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict, keep_turns: int) -> "Conversation":
+        conversation = cls()
+        conversation.summary = state.get("summary", "")
+        turns = [tuple(turn) for turn in state.get("turns", [])]
+        split = max(len(turns) - keep_turns, 0)
+        conversation.pending = turns[:split]
+        conversation.turns = turns[split:]
+        conversation.version = state.get("version", 0)
+        return conversation
+
+
+class HistoryCompactor:
+    """Keeps per-chat history small: the last K turns verbatim, older turns summarized
+
+    With a store, conversations are persisted and the in-memory dict only holds
+    the most recently used ones. A conversation checked against the store less
+    than `freshness` seconds ago is used as is, so one message doesn't cost a
+    store round-trip per call; on an event loop, call refresh() first. Writes
+    are compare-and-set: if another process changed the conversation in the
+    meantime, the change is applied again on top of its version.
+    """
+
+    def __init__(self, summarize_fn: Optional[Callable[[str], str]] = None, keep_turns: int = 6,
+                 max_prompt_tokens: int = 4000, summary_max_words: int = 250, max_chats: int = 1000,
+                 store=None, freshness: float = 5.0):
+        self.summarize_fn = summarize_fn
+        self.store = store
+        self.keep_turns = keep_turns
+        self.max_prompt_tokens = max_prompt_tokens
+        self.summary_max_words = summary_max_words
+        self.max_chats = max_chats
+        self.freshness = freshness
+
+        self._lock = threading.Lock()
+        self._chats: "OrderedDict[object, Conversation]" = OrderedDict()
+        # Summaries happen off the request path, one at a time
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+        # Store writes get their own thread, so they never wait behind a summary
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-store")
+        # Writes that found the conversation changed by another process
+        self.conflicts = 0
+
+    def _cached(self, chat_id) -> Optional[Conversation]:
+        with self._lock:
+            conversation = self._chats.get(chat_id)
+            if conversation is not None:
+                self._chats.move_to_end(chat_id)
+            return conversation
+
+    def _fresh(self, conversation: Optional[Conversation]) -> bool:
+        """True if the conversation can be used without asking the store"""
+        if self.store is None:
+            return True
+        return conversation is not None and time.monotonic() - conversation.checked < self.freshness
+
+    def _get(self, chat_id) -> Conversation:
+        """Get a conversation, (re)loading it from the store if it's missing or stale"""
+        conversation = self._cached(chat_id)
+        if not self._fresh(conversation):
+            key = str(chat_id)
+            checked = time.monotonic()
+            try:
+                if conversation is None or self.store.version(key) > conversation.version:
+                    state = self.store.load(key)
+                    if state is not None:
+                        conversation = self._install(chat_id, Conversation.from_state(state, self.keep_turns))
+            except Exception as e:
+                print(f"Error loading conversation {chat_id}: {e}")
+            if conversation is not None:
+                conversation.checked = checked
+        if conversation is None:
+            conversation = self._install(chat_id, Conversation())
+            conversation.checked = time.monotonic()
+        return conversation
+
+    async def refresh(self, chat_id):
+        """Check the store for a newer version in a thread, so the event loop never waits for it"""
+        if not self._fresh(self._cached(chat_id)):
+            await asyncio.to_thread(self._get, chat_id)
+
+    def _install(self, chat_id, conversation: Conversation) -> Conversation:
+        with self._lock:
+            current = self._chats.get(chat_id)
+            if current is not None and current.version >= conversation.version:
+                return current
+            self._chats[chat_id] = conversation
+            self._chats.move_to_end(chat_id)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        return conversation
+
+    def _persist(self, chat_id, state: Dict, change: Callable[[Conversation], bool]):
+        """Write a changed conversation, or apply `change` again to the stored one if it changed meanwhile"""
+        if self.store is None:
+            return
+        key = str(chat_id)
+        try:
+            if self.store.save(key, state):
+                return
+            self.conflicts += 1
+            while True:
+                stored = self.store.load(key)
+                conversation = Conversation.from_state(stored, self.keep_turns) if stored else Conversation()
+                # False if there's nothing left to do, e.g. the other process summarized the same turns
+                if not change(conversation):
+                    break
+                conversation.version += 1
+                if self.store.save(key, conversation.to_state()):
+                    break
+            # The copy in memory has the store's version number without its turns, load it again on next use
+            with self._lock:
+                self._chats.pop(chat_id, None)
+        except Exception as e:
+            print(f"Error saving conversation {chat_id}: {e}")
+
+    def has_history(self, chat_id) -> bool:
+        """Check if a chat has any earlier turns"""
+        conversation = self._get(chat_id)
+        with self._lock:
+            return bool(conversation.summary or conversation.turns or conversation.pending)
+
+    def build_history(self, chat_id, prompt: str = "") -> List[Dict]:
+        """Build a Gemini chat history that fits in the prompt token budget"""
+        conversation = self._get(chat_id)
+        with self._lock:
+            summary = conversation.summary
+            recent = conversation.pending + conversation.turns
+
+        # Room for the summary is reserved first, recent turns get the rest
+        budget = self.max_prompt_tokens - estimate_tokens(prompt)
+        summary_budget = 0
+        if summary:
+            overhead = estimate_tokens(SUMMARY_PREFIX) + estimate_tokens(SUMMARY_ACK)
+            summary_budget = min(estimate_tokens(summary), budget // 2 - overhead)
+            budget -= summary_budget + overhead
+
+        # Newest turns are the most relevant, keep as many as fit
+        kept: List[Tuple[str, str]] = []
+        for user, model in reversed(recent):
+            cost = estimate_tokens(user) + estimate_tokens(model)
+            if cost > budget:
+                break
+            kept.append((user, model))
+            budget -= cost
+        kept.reverse()
+
+        history = []
+        if summary_budget > 0:
+            summary = summary[:(summary_budget - 1) * 4]
+            history.append({"role": "user", "parts": [SUMMARY_PREFIX + summary]})
+            history.append({"role": "model", "parts": [SUMMARY_ACK]})
+        for user, model in kept:
+            history.append({"role": "user", "parts": [user]})
+            history.append({"role": "model", "parts": [model]})
+        return history
+
+    def add_turn(self, chat_id, user_text: str, model_text: str):
+        """Record a finished turn and compact older turns in the background"""
+        conversation = self._get(chat_id)
+        turn = (user_text, model_text)
+
+        def append(stored: Conversation) -> bool:
+            stored.turns.append(turn)
+            return True
+
+        with self._lock:
+            conversation.turns.append(turn)
+            conversation.version += 1
+            overflow = len(conversation.turns) - self.keep_turns
+            if overflow > 0:
+                conversation.pending.extend(conversation.turns[:overflow])
+                del conversation.turns[:overflow]
+            # Submitted under the lock, so writes reach the store in version order
+            self._writer.submit(self._persist, chat_id, conversation.to_state(), append)
+            summarize = bool(conversation.pending) and not conversation.summarizing and self.summarize_fn is not None
+            if summarize:
+                conversation.summarizing = True
+        if summarize:
+            self._executor.submit(self._summarize, chat_id, conversation)
+
+    def _summarize(self, chat_id, conversation: Conversation):
+        with self._lock:
+            summary = conversation.summary
+            folding = list(conversation.pending)
+        try:
+            prompt = SUMMARY_PROMPT.format(
+                max_words=self.summary_max_words,
+                summary=summary or "(empty)",
+                turns=format_turns(folding),
+            )
+            new_summary = self.summarize_fn(prompt).strip()
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
+            new_summary = None
+
+        def fold(stored: Conversation) -> bool:
+            recent = stored.pending + stored.turns
+            if recent[:len(folding)] != folding:
+                return False
+            stored.summary = new_summary
+            stored.pending, stored.turns = [], recent[len(folding):]
+            return True
+
+        with self._lock:
+            if new_summary is not None:
+                # Hard cap, in case the model ignores the word limit
+                new_summary = new_summary[:self.summary_max_words * 8]
+                conversation.summary = new_summary
+                del conversation.pending[:len(folding)]
+                conversation.version += 1
+                self._writer.submit(self._persist, chat_id, conversation.to_state(), fold)
+            conversation.summarizing = False
+            more = bool(conversation.pending) and new_summary is not None
+            if more:
+                conversation.summarizing = True
+        if more:
+            self._executor.submit(self._summarize, chat_id, conversation)
+
+    def reset(self, chat_id):
+        """Forget a chat's history"""
+        with self._lock:
+            self._chats.pop(chat_id, None)
+        if self.store is not None:
+            try:
+                self.store.delete(str(chat_id))
+            except Exception as e:
+                print(f"Error deleting conversation {chat_id}: {e}")
+
+
+def create_compactor(model) -> HistoryCompactor:
+    """Create a compactor that summarizes with the given Gemini model"""
+    return HistoryCompactor(
+        summarize_fn=lambda prompt: upstream_limiter.call_sync(model.generate_content, prompt).text,
+        keep_turns=int(os.environ.get('HISTORY_KEEP_TURNS', '6')),
+        max_prompt_tokens=int(os.environ.get('HISTORY_MAX_PROMPT_TOKENS', '4000')),
+        max_chats=int(os.environ.get('HISTORY_MAX_CHATS', '1000')),
+        store=create_store(),
+        freshness=float(os.environ.get('HISTORY_FRESH_SECONDS', '5')),
+    )
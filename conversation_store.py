@@ -0,0 +1,113 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Optional
+
+
+class SQLiteConversationStore:
+    """Stores conversations in a local SQLite file, shared by the bot and the web app"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations "
+                "(key TEXT PRIMARY KEY, version INTEGER NOT NULL, state TEXT NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def version(self, key: str) -> int:
+        row = self._connection().execute(
+            "SELECT version FROM conversations WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def load(self, key: str) -> Optional[dict]:
+        row = self._connection().execute(
+            "SELECT version, state FROM conversations WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[1])
+        state['version'] = row[0]
+        return state
+
+    def save(self, key: str, state: dict) -> bool:
+        """Write `state` over the version before it, False if another process changed the conversation first"""
+        payload = json.dumps({k: v for k, v in state.items() if k != 'version'})
+        version = state['version']
+        with self._connection() as conn:
+            if version == 1:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO conversations (key, version, state) VALUES (?, ?, ?)",
+                    (key, version, payload),
+                )
+            else:
+                cursor = conn.execute(
+                    "UPDATE conversations SET version = ?, state = ? WHERE key = ? AND version = ?",
+                    (version, payload, key, version - 1),
+                )
+            return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM conversations WHERE key = ?", (key,))
+
+
+class MongoConversationStore:
+    """Stores conversations in MongoDB, for deployments with several hosts"""
+
+    def __init__(self, uri: str, database: str = 'gemini_ai'):
+        from pymongo import MongoClient
+
+        self.collection = MongoClient(uri)[database]['conversations']
+
+    def version(self, key: str) -> int:
+        doc = self.collection.find_one({'_id': key}, {'version': 1})
+        return doc['version'] if doc else 0
+
+    def load(self, key: str) -> Optional[dict]:
+        doc = self.collection.find_one({'_id': key})
+        if doc is None:
+            return None
+        doc.pop('_id')
+        return doc
+
+    def save(self, key: str, state: dict) -> bool:
+        """Write `state` over the version before it, False if another process changed the conversation first"""
+        from pymongo.errors import DuplicateKeyError
+
+        if state['version'] == 1:
+            try:
+                self.collection.insert_one(dict(state, _id=key))
+                return True
+            except DuplicateKeyError:
+                return False
+        result = self.collection.replace_one({'_id': key, 'version': state['version'] - 1}, dict(state, _id=key))
+        return result.matched_count == 1
+
+    def delete(self, key: str):
+        self.collection.delete_one({'_id': key})
+
+
+def create_store():
+    """Create the conversation store configured in the environment"""
+    if os.environ.get('CONVERSATIONS_PERSIST', 'true').lower() != 'true':
+        return None
+    mongo_uri = os.environ.get('MONGO_URI', '')
+    try:
+        if mongo_uri:
+            return MongoConversationStore(mongo_uri)
+        return SQLiteConversationStore(os.environ.get('CONVERSATIONS_DB', 'conversations.db'))
+    except Exception as e:
+        print(f"Conversation persistence disabled: {e}")
+        return None
@@ -0,0 +1,240 @@
+import io
+import os
+import codecs
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from chat_history import estimate_tokens
+from ttl_cache import TTLCache
+from tracing import span, annotate
+
+MAP_PROMPT = """You are reading part {index} of the document "{name}".
+Write dense notes of everything in this part: facts, figures, names, definitions, arguments and conclusions.
+Keep the document's own terms and don't add anything that isn't in the text.
+
+Part {index}:
+{chunk}
+
+Notes:"""
+
+COMBINE_PROMPT = """Merge these notes from consecutive parts of the document "{name}" into one set of notes.
+Keep every fact, figure and name, drop only repetition.
+
+{notes}
+
+Merged notes:"""
+
+REDUCE_PROMPT = """Below are notes taken from consecutive parts of the document "{name}".
+{task}
+Use only the notes. If they don't contain the answer, say so.
+
+{notes}
+
+Answer:"""
+
+SUMMARY_TASK = "Summarize the document: what it is, its main points and its conclusions."
+
+TEXT_EXTENSIONS = {".txt", ".md", ".csv", ".tsv", ".json", ".log", ".xml", ".html", ".htm", ".py", ".js",
+                   ".yaml", ".yml", ".ini", ".rst", ".tex", ".srt"}
+
+
+class DocumentError(Exception):
+    """A document that can't be read, the message is shown to the user"""
+
+
+def document_kind(document) -> Optional[str]:
+    """'pdf' or 'text' for supported Telegram documents, None otherwise"""
+    name = (getattr(document, "file_name", None) or "").lower()
+    mime_type = getattr(document, "mime_type", None) or ""
+    if mime_type == "application/pdf" or name.endswith(".pdf"):
+        return "pdf"
+    if mime_type.startswith("text/") or os.path.splitext(name)[1] in TEXT_EXTENSIONS:
+        return "text"
+    return None
+
+
+async def extract_text(chunks: AsyncIterator[bytes], kind: str) -> AsyncIterator[str]:
+    """Yield a document's text as it is downloaded (text files) or page by page (PDFs)"""
+    if kind == "text":
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        async for data in chunks:
+            yield decoder.decode(data)
+        yield decoder.decode(b"", final=True)
+        return
+
+    try:
+        import pypdf
+    except ImportError:
+        raise DocumentError("PDF support needs the optional pypdf package (pip install pypdf)") from None
+    # The PDF index is at the end of the file, so the download is buffered (in memory) first
+    buffer = io.BytesIO()
+    async for data in chunks:
+        buffer.write(data)
+    try:
+        reader = pypdf.PdfReader(buffer)
+        pages = list(reader.pages)
+    except Exception as e:
+        raise DocumentError(f"Couldn't read this PDF: {e}") from None
+    for page in pages:
+        # Text extraction is CPU-bound, keep it off the event loop
+        yield await asyncio.to_thread(page.extract_text) + "\n\n"
+
+
+def _split_point(text: str, limit: int) -> int:
+    """Where to cut `text` to keep it under `limit` characters, preferring paragraph and sentence ends"""
+    for separator in ("\n\n", "\n", ". ", " "):
+        cut = text.rfind(separator, limit // 2, limit)
+        if cut != -1:
+            return cut + len(separator)
+    return limit
+
+
+async def split_chunks(pieces: AsyncIterator[str], max_tokens: int) -> AsyncIterator[str]:
+    """Regroup streamed text into chunks of at most `max_tokens`, yielded as soon as each is full"""
+    limit = max_tokens * 4
+    buffer = ""
+    async for piece in pieces:
+        buffer += piece
+        while len(buffer) >= limit:
+            cut = _split_point(buffer, limit)
+            chunk, buffer = buffer[:cut].strip(), buffer[cut:]
+            if chunk:
+                yield chunk
+    if buffer.strip():
+        yield buffer.strip()
+
+
+class DocumentQA:
+    """Answers questions about long documents with map-reduce
+
+    Chunks are summarized into notes concurrently (at most `concurrency` calls
+    at a time, shared by all documents) while the document is still being
+    downloaded and extracted. Notes are cached per document, so follow-up
+    questions only run the reduce step.
+    """
+
+    def __init__(self, generate: Callable[[str], Awaitable[str]], chunk_tokens: int = 6000,
+                 max_chunks: int = 40, reduce_tokens: int = 24000, concurrency: int = 4,
+                 cache_size: int = 100, cache_ttl: float = 86400, max_bytes: int = 20 * 2 ** 20):
+        self.generate = generate
+        self.max_bytes = max_bytes
+        self.chunk_tokens = chunk_tokens
+        self.max_chunks = max_chunks
+        self.reduce_tokens = reduce_tokens
+        self.concurrency = concurrency
+        self.notes: TTLCache[List[str]] = TTLCache(ttl=cache_ttl, max_entries=cache_size)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Documents being mapped, so simultaneous questions about one document share the work
+        self._mapping: Dict[str, asyncio.Future] = {}
+        self.map_calls = 0
+        self.reduce_calls = 0
+
+    async def _call(self, prompt: str) -> str:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            return (await self.generate(prompt)).strip()
+
+    def check(self, document) -> str:
+        """Kind of a supported document, checked before anything is downloaded"""
+        kind = document_kind(document)
+        if kind is None:
+            raise DocumentError("Only PDF and text documents are supported.")
+        if (getattr(document, "file_size", 0) or 0) > self.max_bytes:
+            raise DocumentError(f"This document is too large, the limit is {self.max_bytes // 2 ** 20} MB.")
+        return kind
+
+    async def ask(self, key: str, name: str, chunks: Callable[[], AsyncIterator[bytes]], kind: str,
+                  question: str = "", progress: Optional[Callable[[int, int], None]] = None) -> str:
+        """Answer `question` (or summarize) about a document, `chunks` starts its download
+
+        `progress(done, total)` is called as parts of the document are read.
+        """
+        notes = self.notes.get(key)
+        annotate(cached=notes is not None)
+        if notes is None:
+            future = self._mapping.get(key)
+            if future is None:
+                future = self._mapping[key] = asyncio.ensure_future(self._map(name, chunks(), kind, progress))
+                future.add_done_callback(lambda _: self._mapping.pop(key, None))
+            notes = await asyncio.shield(future)
+            self.notes.put(key, notes)
+        with span("reduce"):
+            return await self._reduce(name, notes, question)
+
+    async def _map(self, name: str, data: AsyncIterator[bytes], kind: str,
+                   progress: Optional[Callable[[int, int], None]] = None) -> List[str]:
+        tasks = []
+
+        def finished(task: asyncio.Future):
+            if progress is not None and not task.cancelled():
+                progress(sum(t.done() for t in tasks), len(tasks))
+
+        text = extract_text(data, kind)
+        stream = split_chunks(text, self.chunk_tokens)
+        try:
+            with span("extract"):
+                async for chunk in stream:
+                    if len(tasks) == self.max_chunks:
+                        # Stop reading (and downloading) the rest
+                        annotate(truncated=True)
+                        break
+                    prompt = MAP_PROMPT.format(index=len(tasks) + 1, name=name, chunk=chunk)
+                    task = asyncio.ensure_future(self._call(prompt))
+                    task.add_done_callback(finished)
+                    tasks.append(task)
+                await stream.aclose()
+                await text.aclose()
+                if hasattr(data, "aclose"):
+                    await data.aclose()
+            if not tasks:
+                raise DocumentError("This document has no text to read.")
+            annotate(chunks=len(tasks))
+            self.map_calls += len(tasks)
+            with span("map"):
+                return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def _reduce(self, name: str, notes: List[str], question: str) -> str:
+        # Too many notes for one prompt: merge neighbouring notes until they fit
+        for _ in range(4):
+            if len(notes) == 1 or sum(estimate_tokens(n) for n in notes) <= self.reduce_tokens:
+                break
+            groups, group, size = [], [], 0
+            for note in notes:
+                if group and size + estimate_tokens(note) > self.reduce_tokens:
+                    groups.append(group)
+                    group, size = [], 0
+                group.append(note)
+                size += estimate_tokens(note)
+            groups.append(group)
+            if len(groups) == len(notes):
+                # Every note is already at the limit on its own, pair them up to make progress
+                groups = [notes[i:i + 2] for i in range(0, len(notes), 2)]
+            self.reduce_calls += len(groups)
+            notes = await asyncio.gather(*(
+                self._call(COMBINE_PROMPT.format(name=name, notes="\n\n".join(group))) for group in groups
+            ))
+        self.reduce_calls += 1
+        task = f"Answer this question about the document: {question}" if question else SUMMARY_TASK
+        parts = "\n\n".join(f"Part {i + 1}:\n{note}" for i, note in enumerate(notes))
+        return await self._call(REDUCE_PROMPT.format(name=name, task=task, notes=parts))
+
+    def stats(self) -> str:
+        return (f"documents cached: {len(self.notes)}, map calls: {self.map_calls}, "
+                f"reduce calls: {self.reduce_calls}")
+
+
+def create_document_qa(generate: Callable[[str], Awaitable[str]]) -> DocumentQA:
+    return DocumentQA(
+        generate,
+        chunk_tokens=int(os.environ.get('DOCUMENT_CHUNK_TOKENS', '6000')),
+        max_chunks=int(os.environ.get('DOCUMENT_MAX_CHUNKS', '40')),
+        reduce_tokens=int(os.environ.get('DOCUMENT_REDUCE_TOKENS', '24000')),
+        concurrency=int(os.environ.get('DOCUMENT_CONCURRENCY', '4')),
+        cache_size=int(os.environ.get('DOCUMENT_CACHE_SIZE', '100')),
+        cache_ttl=float(os.environ.get('DOCUMENT_CACHE_TTL', '86400')),
+        max_bytes=int(os.environ.get('DOCUMENT_MAX_MB', '20')) * 2 ** 20,
+    )
@@ -0,0 +1,50 @@
+import threading
+
+# google.generativeai takes around a second to import, so it's only imported
+# (and configured) when the first model is actually used
+_genai = None
+_config = {}
+_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """Store genai.configure() arguments, applied on first use"""
+    _config.update(kwargs)
+    if _genai is not None:
+        _genai.configure(**kwargs)
+
+
+def get_genai():
+    """Import and configure google.generativeai on first use"""
+    global _genai
+    if _genai is None:
+        with _lock:
+            if _genai is None:
+                import google.generativeai as genai
+
+                genai.configure(**_config)
+                _genai = genai
+    return _genai
+
+
+def prewarm():
+    """Import google.generativeai in the background, e.g. while the bot connects to Telegram"""
+    threading.Thread(target=get_genai, name="genai-prewarm", daemon=True).start()
+
+
+class LazyModel:
+    """A GenerativeModel that is only constructed when first used"""
+
+    def __init__(self, *args, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = get_genai().GenerativeModel(*self._args, **self._kwargs)
+        return self._model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
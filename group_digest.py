@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple
+
+TLDR_PROMPT = """Update the running summary of a Telegram group chat.
+Cover the topics discussed, decisions made, questions left open and who said what when it matters.
+Drop anything from the current summary that the new messages make irrelevant, the summary should mostly reflect recent activity.
+Write at most {max_words} words, as short bullet points.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+
+class ChatLog:
+    """Recent messages of one group in a ring buffer, plus the summary of what came before"""
+
+    __slots__ = ("messages", "count", "summarized", "summary", "last_active", "lock")
+
+    def __init__(self, max_messages: int):
+        # (timestamp, sender name, text), the oldest drop out when it's full
+        self.messages: Deque[Tuple[float, str, str]] = deque(maxlen=max_messages)
+        # Messages ever recorded, and how many of them the summary covers
+        self.count = 0
+        self.summarized = 0
+        self.summary = ""
+        self.last_active = time.monotonic()
+        self.lock: Optional[asyncio.Lock] = None
+
+
+def format_messages(messages) -> str:
+    return "\n".join(f"[{time.strftime('%H:%M', time.localtime(ts))}] {name}: {text}" for ts, name, text in messages)
+
+
+class GroupDigest:
+    """Per-group message buffers for /tldr, summarized incrementally
+
+    Each group keeps at most `max_messages` messages of at most `max_chars`
+    characters, and groups without messages for `idle_ttl` seconds are
+    dropped. /tldr only folds the messages added since the previous one into
+    the running summary, so its prompt stays the same small size however busy
+    the group is.
+    """
+
+    def __init__(self, summarize: Callable[[str], Awaitable[str]], max_messages: int = 200,
+                 max_chars: int = 400, max_chats: int = 5000, idle_ttl: float = 86400,
+                 summary_max_words: int = 200):
+        self.summarize = summarize
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        self.summary_max_words = summary_max_words
+        self._lock = threading.Lock()
+        # Least recently active first
+        self._chats: "OrderedDict[int, ChatLog]" = OrderedDict()
+        self.recorded = 0
+        self.folds = 0
+        self.evicted = 0
+
+    def record(self, chat_id: int, name: str, text: str):
+        """Add a group message, called for every message so it must stay cheap"""
+        now = time.monotonic()
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars - 1] + "…"
+        with self._lock:
+            log = self._chats.get(chat_id)
+            if log is None:
+                log = self._chats[chat_id] = ChatLog(self.max_messages)
+            else:
+                self._chats.move_to_end(chat_id)
+            # Names repeat on every message, share one string per sender
+            log.messages.append((time.time(), sys.intern(name), text))
+            log.count += 1
+            log.last_active = now
+            self.recorded += 1
+            self._evict(now)
+
+    def _evict(self, now: float):
+        while self._chats:
+            chat_id, oldest = next(iter(self._chats.items()))
+            if len(self._chats) <= self.max_chats and now - oldest.last_active < self.idle_ttl:
+                break
+            del self._chats[chat_id]
+            self.evicted += 1
+
+    async def tldr(self, chat_id: int) -> Optional[str]:
+        """Summary of the group's recent messages, None if there's nothing to summarize"""
+        with self._lock:
+            log = self._chats.get(chat_id)
+            if log is None:
+                return None
+            if log.lock is None:
+                log.lock = asyncio.Lock()
+        # One fold at a time per group, a second /tldr then finds the summary up to date
+        async with log.lock:
+            with self._lock:
+                new = min(log.count - log.summarized, len(log.messages))
+                messages = list(log.messages)[len(log.messages) - new:]
+                count = log.count
+                summary = log.summary
+            if not messages:
+                return summary or None
+            prompt = TLDR_PROMPT.format(
+                max_words=self.summary_max_words,
+                summary=summary or "(empty)",
+                messages=format_messages(messages),
+            )
+            summary = (await self.summarize(prompt)).strip()
+            with self._lock:
+                # Hard cap, in case the model ignores the word limit
+                log.summary = summary[:self.summary_max_words * 8]
+                log.summarized = count
+                self.folds += 1
+            return log.summary
+
+    def stats(self) -> str:
+        with self._lock:
+            buffered = sum(len(log.messages) for log in self._chats.values())
+            return (f"groups: {len(self._chats)}, messages buffered: {buffered}, recorded: {self.recorded}, "
+                    f"summaries: {self.folds}, idle groups dropped: {self.evicted}")
+
+
+def create_digest(summarize: Callable[[str], Awaitable[str]]) -> GroupDigest:
+    return GroupDigest(
+        summarize,
+        max_messages=int(os.environ.get('TLDR_MAX_MESSAGES', '200')),
+        max_chars=int(os.environ.get('TLDR_MAX_CHARS', '400')),
+        max_chats=int(os.environ.get('TLDR_MAX_CHATS', '5000')),
+        idle_ttl=float(os.environ.get('TLDR_IDLE_HOURS', '24')) * 3600,
+        summary_max_words=int(os.environ.get('TLDR_SUMMARY_WORDS', '200')),
+    )
@@ -0,0 +1,137 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Optional, TypeVar
+from tracing import annotate
+
+T = TypeVar('T')
+
+# Set inside a hedged attempt, called once the attempt's upstream call has been admitted
+_admitted: ContextVar[Optional[Callable[[], None]]] = ContextVar("hedge_admitted", default=None)
+
+
+def admitted():
+    """Called by the upstream limiter when a call gets its slot, starts the clock of the hedged attempt it's in"""
+    callback = _admitted.get()
+    if callback is not None:
+        callback()
+
+
+class Hedger:
+    """Hedged requests: a second identical call when the first is slower than usual
+
+    If a call hasn't returned after the `percentile` latency of recent calls,
+    a backup call is started and whichever finishes first wins, the other is
+    cancelled. Extra calls are capped at `budget` (a fraction of all calls,
+    with a small burst), so a slow upstream can't double the load on itself.
+
+    With `from_admission`, the clock of an attempt starts when it calls
+    `admitted()` (the upstream limiter does once the call has a slot), so time
+    spent queued behind other calls neither counts as latency nor triggers a
+    backup that would only join the same queue.
+    """
+
+    def __init__(self, percentile: float = 0.95, budget: float = 0.05, burst: float = 10,
+                 min_samples: int = 20, window: int = 1000, enabled: bool = True, from_admission: bool = False):
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self.from_admission = from_admission
+        # Latencies of first attempts, a cancelled one counts with the time it had run for
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self._delay: Optional[float] = None
+        self._tokens = burst
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+
+    def delay(self) -> Optional[float]:
+        """How long to wait before hedging, None until there are enough samples"""
+        if self._delay is None or self.calls % 20 == 0:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+            self._delay = ordered[min(int(len(ordered) * self.percentile), len(ordered) - 1)]
+        return self._delay
+
+    async def _timed(self, attempt: Callable[[], Awaitable[T]], started: asyncio.Event) -> T:
+        start = None
+
+        def admit():
+            nonlocal start
+            if start is None:
+                start = time.monotonic()
+                started.set()
+
+        if self.from_admission:
+            _admitted.set(admit)
+        else:
+            admit()
+        try:
+            return await attempt()
+        finally:
+            # Not counted if it never got past the queue
+            if start is not None:
+                self.latencies.append(time.monotonic() - start)
+
+    async def call(self, primary: Callable[[], Awaitable[T]],
+                   backup: Optional[Callable[[], Awaitable[T]]] = None) -> T:
+        """Result of primary(), or of backup() (primary() again by default) if that's faster"""
+        if not self.enabled:
+            return await primary()
+        self.calls += 1
+        self._tokens = min(self._tokens + self.budget, self.burst)
+        started = asyncio.Event()
+        first = asyncio.ensure_future(self._timed(primary, started))
+        tasks = [first]
+        try:
+            delay = self.delay()
+            if delay is not None:
+                if not started.is_set():
+                    admission = asyncio.ensure_future(started.wait())
+                    await asyncio.wait([first, admission], return_when=asyncio.FIRST_COMPLETED)
+                    admission.cancel()
+                await asyncio.wait(tasks, timeout=delay)
+                if not first.done():
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self.hedged += 1
+                        annotate(hedged=True)
+                        tasks.append(asyncio.ensure_future((backup or primary)()))
+                    else:
+                        self.over_budget += 1
+            # The first successful result wins, an error only counts once both have failed
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> str:
+        delay = self.delay()
+        delay = f"{delay * 1000:.0f} ms" if delay is not None else "learning"
+        return (f"hedge after {delay}, calls: {self.calls}, hedged: {self.hedged} "
+                f"(won {self.hedge_wins}), over budget: {self.over_budget}")
+
+
+def create_hedger() -> Hedger:
+    return Hedger(
+        percentile=float(os.environ.get('HEDGE_PERCENTILE', '95')) / 100,
+        budget=float(os.environ.get('HEDGE_BUDGET', '0.05')),
+        enabled=os.environ.get('HEDGE_ENABLED', 'false').lower() == 'true',
+        from_admission=True,
+    )
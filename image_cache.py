@@ -0,0 +1,189 @@
+import os
+import time
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from warm_state import read_snapshot, write_snapshot
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(values)
+else:  # NumPy < 2.0
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return np.unpackbits(values.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+def key_id(key: str) -> int:
+    """Fixed-width id of a cache key (command and arguments), so no table of keys is kept"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class ImageHashCache:
+    """Cached Gemini answers for images, looked up by perceptual hash
+
+    Re-uploaded or re-compressed copies of a photo get new Telegram file ids but
+    nearly the same 64-bit dHash, so anything within `max_distance` differing
+    bits reuses the answer. Answers are scoped by a key (command and arguments).
+    """
+
+    def __init__(self, max_entries: int = 4096, max_distance: int = 6, path: str = "", enabled: bool = True):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.path = path
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._hashes = np.zeros(max_entries, dtype=np.uint64)
+        self._key_ids = np.zeros(max_entries, dtype=np.uint64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._answers: List[str] = [""] * max_entries
+        self._count = 0
+        # Telegram file_unique_id -> hash, so exact repeats skip the download
+        self._file_hashes: "OrderedDict[str, int]" = OrderedDict()
+        # Snapshot to restore on first use, so loading it never delays startup
+        self._restore_path: Optional[str] = None
+        self._dirty = False
+
+        self.hits = 0
+        self.misses = 0
+
+    def hash_for_file(self, file_unique_id: Optional[str]) -> Optional[int]:
+        """Perceptual hash of a file seen before, if any"""
+        if not self.enabled or not file_unique_id:
+            return None
+        self.restore()
+        with self._lock:
+            return self._file_hashes.get(file_unique_id)
+
+    def remember_file(self, file_unique_id: Optional[str], image_hash: int):
+        if not self.enabled or not file_unique_id:
+            return
+        self.restore()
+        with self._lock:
+            self._dirty = True
+            self._file_hashes[file_unique_id] = image_hash
+            self._file_hashes.move_to_end(file_unique_id)
+            while len(self._file_hashes) > self.max_entries:
+                self._file_hashes.popitem(last=False)
+
+    def get(self, image_hash: Optional[int], key: str) -> Optional[str]:
+        """Return the answer for the closest cached image within the distance threshold"""
+        if not self.enabled or image_hash is None:
+            return None
+        self.restore()
+        with self._lock:
+            if self._count == 0:
+                self.misses += 1
+                return None
+            distances = _popcount(self._hashes[:self._count] ^ np.uint64(image_hash)).astype(np.int32)
+            distances[self._key_ids[:self._count] != np.uint64(key_id(key))] = 65
+            best = int(np.argmin(distances))
+            if distances[best] > self.max_distance:
+                self.misses += 1
+                return None
+            self._last_used[best] = time.monotonic()
+            self.hits += 1
+            return self._answers[best]
+
+    def put(self, image_hash: Optional[int], key: str, answer: str):
+        """Store an answer, evicting the least recently used entry when full"""
+        if not self.enabled or image_hash is None or not answer:
+            return
+        self.restore()
+        with self._lock:
+            self._dirty = True
+            if self._count < self.max_entries:
+                slot = self._count
+                self._count += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._hashes[slot] = np.uint64(image_hash)
+            self._key_ids[slot] = np.uint64(key_id(key))
+            self._last_used[slot] = time.monotonic()
+            self._answers[slot] = answer
+
+    def __len__(self) -> int:
+        self.restore()
+        return self._count
+
+    def save(self, path: str = ""):
+        """Snapshot the cache, skipped if nothing changed since it was loaded or saved"""
+        path = path or self.path
+        if not path or not self.enabled:
+            return
+        self.restore()
+        with self._lock:
+            if not self._dirty:
+                return
+            count = self._count
+            order = np.argsort(self._last_used[:count])
+            write_snapshot(
+                path,
+                arrays={
+                    "hashes": self._hashes[:count][order],
+                    "key_ids": self._key_ids[:count][order],
+                    "file_hashes": np.array(list(self._file_hashes.values()), dtype=np.uint64),
+                },
+                strings={
+                    "answers": [self._answers[i] for i in order],
+                    "file_ids": list(self._file_hashes),
+                },
+                meta={"hits": self.hits, "misses": self.misses},
+            )
+            self._dirty = False
+
+    def load(self, path: str = ""):
+        """Restore a snapshot written by save() the first time the cache is used"""
+        path = path or self.path
+        if path and os.path.exists(path):
+            with self._lock:
+                self._restore_path = path
+
+    def restore(self):
+        """Restore a pending snapshot now, e.g. from a background thread after startup"""
+        if self._restore_path is None:
+            return
+        with self._lock:
+            path, self._restore_path = self._restore_path, None
+            if path is None:
+                return
+            snapshot = read_snapshot(path)
+            if snapshot is None:
+                return
+            hashes = snapshot.array("hashes")
+            key_ids = snapshot.array("key_ids")
+
+            keep = min(len(hashes), self.max_entries)
+            start = len(hashes) - keep
+            now = time.monotonic()
+            self._count = keep
+            self._hashes[:keep] = hashes[start:]
+            self._key_ids[:keep] = key_ids[start:]
+            self._last_used[:keep] = now - np.arange(keep, 0, -1)
+            self._answers[:keep] = snapshot.strings("answers")[start:]
+            file_ids = snapshot.strings("file_ids")
+            file_hashes = snapshot.array("file_hashes")
+            skip = max(len(file_ids) - self.max_entries, 0)
+            self._file_hashes = OrderedDict(zip(file_ids[skip:], file_hashes[skip:].tolist()))
+            self.hits = snapshot.meta.get("hits", 0)
+            self.misses = snapshot.meta.get("misses", 0)
+
+
+def _create_image_cache() -> ImageHashCache:
+    enabled = os.environ.get('IMAGE_CACHE_ENABLED', 'true').lower() == 'true'
+    cache = ImageHashCache(
+        max_entries=int(os.environ.get('IMAGE_CACHE_SIZE', '4096')) if enabled else 1,
+        max_distance=int(os.environ.get('IMAGE_CACHE_MAX_DISTANCE', '6')),
+        path=os.environ.get('IMAGE_CACHE_PATH', 'image_cache.warm'),
+        enabled=enabled,
+    )
+    if enabled:
+        cache.load()
+        atexit.register(cache.save)
+    return cache
+
+# Global image cache instance
+image_cache = _create_image_cache()
@@ -0,0 +1,125 @@
+import io
+import os
+import sys
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+
+class ImagePoolBusy(Exception):
+    """Raised when too many images are already waiting to be processed"""
+
+    def __init__(self):
+        super().__init__("The bot is busy processing other images, please try again in a moment.")
+
+
+class ImageWorkerCrashed(Exception):
+    """Raised when a worker process died on an image, e.g. killed for using too much memory"""
+
+    def __init__(self):
+        super().__init__("This image couldn't be processed, please try a smaller one.")
+
+
+def dhash(img, hash_size: int = 8) -> int:
+    """64-bit difference hash: whether each pixel is brighter than its right neighbour"""
+    import PIL.Image
+
+    small = img.convert('L').resize((hash_size + 1, hash_size), PIL.Image.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def preprocess_image(data: bytes, max_side: int, quality: int) -> Tuple[bytes, int]:
+    """Decode, fix EXIF orientation, downscale and re-encode an image as JPEG
+
+    Runs in a worker process, so big photos never block the event loop.
+    Also returns the image's perceptual hash, for near-duplicate lookups.
+    """
+    import PIL.Image
+    import PIL.ImageOps
+
+    with PIL.Image.open(io.BytesIO(data)) as img:
+        # Let the JPEG decoder downscale while decoding, much cheaper than a full decode
+        img.draft('RGB', (max_side, max_side))
+        img = PIL.ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail((max_side, max_side))
+        out = io.BytesIO()
+        img.save(out, format='JPEG', quality=quality, optimize=True)
+        image_hash = dhash(img)
+    return out.getvalue(), image_hash
+
+
+class ImagePool:
+    """Bounded process pool for CPU-bound image work, with backpressure"""
+
+    def __init__(self, workers: int, max_pending: int, max_side: int = 1024, quality: int = 85):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_side = max_side
+        self.quality = quality
+        self.pending = 0
+        self.rejected = 0
+        self.restarts = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        """Start the workers, best done early, before the bot starts any threads"""
+        if self._executor is None:
+            # fork is cheapest and doesn't re-import the bot script in every worker
+            context = multiprocessing.get_context('fork') if sys.platform.startswith('linux') else None
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            for _ in range(self.workers):
+                self._executor.submit(os.getpid)
+        return self
+
+    async def run(self, fn, *args):
+        """Run a function in the pool, rejecting work when the queue is full"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ImagePoolBusy()
+        executor = self.start()._executor
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # A dead worker breaks the whole pool, replace it so only the requests in flight fail
+            if self._executor is executor:
+                self.restarts += 1
+                print("Image worker died, restarting the image pool")
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.start()
+            raise ImageWorkerCrashed()
+        finally:
+            self.pending -= 1
+
+    async def preprocess(self, data: bytes) -> Tuple[dict, int]:
+        """Normalize an image, return it as an inline Gemini part and its perceptual hash"""
+        jpeg, image_hash = await self.run(preprocess_image, data, self.max_side, self.quality)
+        return {'mime_type': 'image/jpeg', 'data': jpeg}, image_hash
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_workers = int(os.environ.get('IMAGE_POOL_WORKERS', str(min(os.cpu_count() or 1, 4))))
+
+# Global image pool instance
+image_pool = ImagePool(
+    workers=_workers,
+    max_pending=int(os.environ.get('IMAGE_POOL_MAX_PENDING', str(_workers * 4))),
+    max_side=int(os.environ.get('IMAGE_MAX_SIDE', '1024')),
+    quality=int(os.environ.get('IMAGE_JPEG_QUALITY', '85')),
+)
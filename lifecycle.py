@@ -0,0 +1,112 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+from typing import Callable, List, Tuple
+from pyrogram import idle
+from send_scheduler import sender
+from tenancy import current_tenant
+from tracing import tracer, loop_monitor
+
+RESTARTING_TEXT = "♻️ Restarting, please send that again in a few seconds."
+
+
+class Lifecycle:
+    """Graceful restarts for the bot
+
+    On SIGTERM/SIGINT new updates are turned away, updates being handled get
+    until the drain deadline to finish (including their queued replies), and
+    warm state is then snapshotted. On the next start the snapshots are
+    restored in a background thread, after the client is already serving.
+    """
+
+    def __init__(self, drain_timeout: float = 8.0):
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self.in_flight = 0
+        self.rejected = 0
+        self._state: List[Tuple[str, Callable[[], None], Callable[[], None]]] = []
+
+    def warm_state(self, name: str, restore: Callable[[], None], save: Callable[[], None]):
+        """Register state that is restored after startup and saved on shutdown"""
+        self._state.append((name, restore, save))
+
+    def tracked(self, handler):
+        """Count and trace a handler's in-flight updates, and turn new ones away while draining"""
+        @functools.wraps(handler)
+        async def wrapper(client, update):
+            if self.draining:
+                self.rejected += 1
+                # Inline queries have no chat to reply in, they just go unanswered
+                if hasattr(update, "reply_text"):
+                    await sender.reply(update, RESTARTING_TEXT)
+                return
+            self.in_flight += 1
+            try:
+                chat = getattr(update, "chat", None) or update.from_user
+                attrs = {"chat_id": chat.id}
+                user = getattr(update, "from_user", None)
+                if user is not None:
+                    attrs["user_id"] = user.id
+                tenant = current_tenant.get()
+                if tenant is not None:
+                    attrs["bot"] = tenant.name
+                with tracer.request(handler.__name__, **attrs):
+                    return await handler(client, update)
+            finally:
+                self.in_flight -= 1
+        return wrapper
+
+    def restore_in_background(self):
+        threading.Thread(target=self._restore, name="warm-state-restore", daemon=True).start()
+
+    def _restore(self):
+        for name, restore, _ in self._state:
+            start = time.perf_counter()
+            try:
+                restore()
+            except Exception as e:
+                print(f"Error restoring {name}: {e}")
+                continue
+            print(f"Restored {name} in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    async def drain(self) -> bool:
+        """Wait for in-flight updates and queued replies, returns False if the deadline passed"""
+        deadline = time.monotonic() + self.drain_timeout
+        while self.in_flight or sender.pending():
+            if time.monotonic() >= deadline:
+                print(f"Drain deadline passed with {self.in_flight} updates and {sender.pending()} sends left")
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    def snapshot(self):
+        """Save every registered piece of warm state"""
+        for name, _, save in self._state:
+            start = time.perf_counter()
+            try:
+                save()
+            except Exception as e:
+                print(f"Error saving {name}: {e}")
+                continue
+            print(f"Saved {name} in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    async def serve(self, *clients):
+        """Run the clients until a stop signal, then drain and snapshot"""
+        await asyncio.gather(*(client.start() for client in clients))
+        self.restore_in_background()
+        loop_monitor.start()
+        await idle()
+
+        print("Stopping: draining in-flight updates")
+        self.draining = True
+        await self.drain()
+        await asyncio.gather(*(client.stop() for client in clients))
+        loop_monitor.stop()
+        self.snapshot()
+        print(f"Stopped, {self.rejected} updates turned away while draining")
+
+
+# Global lifecycle instance for the bot
+lifecycle = Lifecycle(drain_timeout=float(os.environ.get('SHUTDOWN_DRAIN_TIMEOUT', '8')))
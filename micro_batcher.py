@@ -0,0 +1,149 @@
+import os
+import json
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+BATCH_PROMPT = """Answer each of the following questions. They come from different users and are independent:
+answer every question on its own and never let one question change how another is answered.
+Return only a JSON array with one object per question, with the keys "id" (the question's id)
+and "answer" (the answer, formatted with Markdown).
+
+Questions:
+{questions}"""
+
+
+def parse_batch_answers(text: str, ids: List[int]) -> Dict[int, str]:
+    """Parse the model's JSON array of answers, ignoring malformed or unknown entries"""
+    try:
+        items = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    if isinstance(items, dict):
+        items = items.get("answers", [])
+    answers = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        answer = item.get("answer")
+        try:
+            question_id = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if question_id in ids and isinstance(answer, str) and answer.strip():
+            answers[question_id] = answer
+    return answers
+
+
+class MicroBatcher:
+    """Collects questions arriving close together in a chat and answers them in one request
+
+    Questions are held for at most `window` seconds (or until `max_batch` are
+    waiting), then sent as one structured prompt with JSON output. Anything the
+    batch answer doesn't cover falls back to an individual request.
+
+    A batch runs outside the context of any one asker, so `charge` (e.g. a
+    per-bot quota) is called once per batched question by `ask()`, in the
+    asker's own context, and raises there to refuse it.
+    """
+
+    def __init__(self, answer_one: Callable[[str], Awaitable[str]],
+                 answer_batch: Callable[[str], Awaitable[str]],
+                 window: float = 0.0, max_batch: int = 8, max_question_chars: int = 300,
+                 charge: Optional[Callable[[], None]] = None):
+        self.answer_one = answer_one
+        self.answer_batch = answer_batch
+        self.charge = charge
+        self.window = window
+        self.max_batch = max_batch
+        self.max_question_chars = max_question_chars
+
+        self._pending: Dict[object, List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[object, asyncio.TimerHandle] = {}
+
+        self.requests = 0
+        self.batches = 0
+        self.batched_questions = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch > 1
+
+    async def ask(self, key, question: str) -> str:
+        """Answer a question, batching it with others for the same key (e.g. chat id)"""
+        if not self.enabled or len(question) > self.max_question_chars:
+            self.requests += 1
+            return await self.answer_one(question)
+
+        if self.charge is not None:
+            self.charge()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((question, future))
+        if len(pending) >= self.max_batch:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if batch:
+            # Not in the context of the asker whose timer fired (or who filled the batch)
+            contextvars.Context().run(asyncio.ensure_future, self._run(batch))
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        answers: Dict[int, str] = {}
+        if len(batch) > 1:
+            questions = [{"id": index, "question": question} for index, (question, _) in enumerate(batch)]
+            self.requests += 1
+            self.batches += 1
+            self.batched_questions += len(batch)
+            try:
+                text = await self.answer_batch(BATCH_PROMPT.format(
+                    questions=json.dumps(questions, ensure_ascii=False, indent=1)
+                ))
+                answers = parse_batch_answers(text, list(range(len(batch))))
+            except Exception as e:
+                print(f"Batched request failed, answering individually: {e}")
+
+        batched = len(batch) > 1
+        await asyncio.gather(*(
+            self._resolve(future, question, answers.get(index), batched)
+            for index, (question, future) in enumerate(batch)
+        ))
+
+    async def _resolve(self, future: asyncio.Future, question: str, answer: Optional[str], batched: bool):
+        if future.done():
+            return
+        try:
+            if answer is None:
+                if batched:
+                    self.fallbacks += 1
+                self.requests += 1
+                answer = await self.answer_one(question)
+            future.set_result(answer)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+
+    def stats(self) -> str:
+        return (f"requests: {self.requests}, batches: {self.batches}, "
+                f"batched questions: {self.batched_questions}, fallbacks: {self.fallbacks}")
+
+
+def create_batcher(answer_one, answer_batch, charge=None) -> MicroBatcher:
+    """Create a batcher configured from the environment (disabled unless a window is set)"""
+    return MicroBatcher(
+        answer_one,
+        answer_batch,
+        charge=charge,
+        window=float(os.environ.get('ASKAI_BATCH_WINDOW_MS', '0')) / 1000,
+        max_batch=int(os.environ.get('ASKAI_BATCH_MAX', '8')),
+        max_question_chars=int(os.environ.get('ASKAI_BATCH_MAX_QUESTION_CHARS', '300')),
+    )
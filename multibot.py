@@ -0,0 +1,70 @@
+# Runs several bots (tokens) in one process. Models, caches, the Gemini limiter and the
+# send scheduler are shared, ad settings and Gemini quotas are per bot.
+# Usage: python multibot.py   (bots are read from BOTS_FILE, default bots.json)
+import os
+import json
+from typing import List
+from pyrogram import Client
+import gemini
+import botmrg_grp
+from ad_config import AdConfig
+from adaptive_limiter import upstream_limiter
+from image_pool import image_pool
+from lifecycle import lifecycle
+from tenancy import Tenant, HandlerTable, charge_current
+
+BOTS_FILE = os.environ.get('BOTS_FILE', 'bots.json')
+
+
+def load_tenants(path: str, handlers: HandlerTable) -> List[Tenant]:
+    """Create a client per configured bot and register the handlers on it"""
+    with open(path, encoding='utf-8') as f:
+        configs = json.load(f)
+    names = [config['name'] for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Bot names in {path} must be unique, they name the session files")
+    # The first bot is the primary one unless another is marked as such, there must be exactly one
+    primaries = [config['name'] for config in configs if config.get('primary')]
+    if not primaries:
+        primaries = [config['name'] for config in configs if 'primary' not in config][:1]
+    if len(primaries) != 1:
+        raise ValueError(f"Exactly one bot in {path} must be primary, it keeps the chats shared with the web app "
+                         f"(found: {', '.join(primaries) or 'none'})")
+
+    tenants = []
+    for config in configs:
+        # Tokens can be kept out of the file, in an environment variable
+        token = config.get('bot_token') or os.environ[config['bot_token_env']]
+        client = Client(
+            config['name'],
+            api_id=config.get('api_id', botmrg_grp.API_ID),
+            api_hash=config.get('api_hash', botmrg_grp.API_HASH),
+            bot_token=token,
+            workers=int(config.get('workers', 4)),
+        )
+        quota = config.get('quota', {})
+        tenant = Tenant(
+            config['name'],
+            client,
+            ad_config=AdConfig(config.get('ad')),
+            calls_per_minute=float(quota.get('calls_per_minute', 0)),
+            burst=float(quota.get('burst', 10)),
+            primary=config['name'] == primaries[0],
+        )
+        handlers.register(client, tenant)
+        tenants.append(tenant)
+    return tenants
+
+
+if __name__ == "__main__":
+    tenants = load_tenants(BOTS_FILE, botmrg_grp.handlers)
+    print(f"Serving {len(tenants)} bots: {', '.join(tenant.name for tenant in tenants)}")
+    # Gemini calls are charged to the bot whose update is being handled
+    upstream_limiter.admission = charge_current
+    # Fork the image workers before any threads are started
+    image_pool.start()
+    # Finish the slow genai import while pyrogram connects to Telegram
+    gemini.prewarm()
+    clients = [tenant.client for tenant in tenants]
+    # All clients share the event loop they were created on
+    clients[0].run(lifecycle.serve(*clients))
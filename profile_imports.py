@@ -0,0 +1,74 @@
+# Import-time profile of the entry points, to keep cold starts fast
+# Usage: python profile_imports.py [module ...] [--top N]
+import os
+import sys
+import time
+import subprocess
+
+DEFAULT_MODULES = ['botmrg_grp', 'botmerged', 'app']
+
+# Entry points read these at import time, dummy values are enough to import them
+DUMMY_ENV = {
+    'API_KEY': 'profile',
+    'API_ID': '1',
+    'API_HASH': 'profile',
+    'BOT_TOKEN': '1:profile',
+}
+
+
+def profile_module(module: str):
+    """Import a module in a fresh interpreter, return (wall seconds, importtime rows)"""
+    env = dict(DUMMY_ENV, **os.environ)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nesting in the import tree is shown by two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return wall, rows
+
+
+def report(module: str, top: int):
+    wall, rows = profile_module(module)
+    # Imports made directly by the module (or by the interpreter at startup), grouped by package
+    packages = {}
+    for name, depth, _, cumulative in rows:
+        if depth == 0 and name != module:
+            root = name.split('.')[0]
+            packages[root] = packages.get(root, 0) + cumulative
+        elif depth == 1:
+            root = name.split('.')[0]
+            packages[root] = packages.get(root, 0) + cumulative
+
+    print(f"\n{module}: {wall * 1000:.0f} ms to import (fresh interpreter, including startup)")
+    print(f"  {'package':<32}{'cumulative ms':>14}")
+    for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {name:<32}{cumulative / 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    top = 10
+    if '--top' in args:
+        index = args.index('--top')
+        top = int(args[index + 1])
+        del args[index:index + 2]
+    for module in args or DEFAULT_MODULES:
+        try:
+            report(module, top)
+        except RuntimeError as e:
+            print(f"\n{module}: import failed: {e}")
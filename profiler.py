@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+class SamplingProfile:
+    """Stacks sampled from every thread, in collapsed (flamegraph) format"""
+
+    def __init__(self, stacks: Counter, samples: int, duration: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = duration
+
+    def collapsed(self) -> str:
+        """One line per stack, `frame;frame;frame count`, as read by flamegraph.pl and speedscope"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def top(self, limit: int = 15) -> str:
+        """Functions most often on top of a stack (self time), as a share of samples"""
+        leaf = Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaf.values()) or 1
+        lines = [f"{self.samples} samples over {self.duration:.1f}s"]
+        lines += [f"{count * 100 / total:5.1f}%  {frame}" for frame, count in leaf.most_common(limit)]
+        return "\n".join(lines)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    """Time-boxed sampling profiler for the running process, stdlib only
+
+    A background thread reads every thread's stack with sys._current_frames()
+    at `interval`; the process keeps serving while it runs. Threads that are
+    idle (waiting on a lock, a queue or a socket) are skipped.
+    """
+
+    # A thread whose innermost Python frame is in one of these is blocked, not working
+    IDLE_MODULES = {"threading.py", "selectors.py", "queue.py", "socket.py", "socketserver.py", "connection.py"}
+
+    def __init__(self, interval: float = 0.005, max_seconds: float = 60):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self.last: Optional[SamplingProfile] = None
+
+    def run(self, seconds: float) -> SamplingProfile:
+        """Sample for `seconds` (blocking), raises ProfilerBusy if a profile is already running"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            seconds = min(max(seconds, 0.1), self.max_seconds)
+            me = threading.get_ident()
+            names: Dict[int, str] = {}
+            stacks = Counter()
+            samples = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == me or os.path.basename(frame.f_code.co_filename) in self.IDLE_MODULES:
+                        continue
+                    if thread_id not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_name(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(self.interval)
+            self.last = SamplingProfile(stacks, samples, time.perf_counter() - start)
+            return self.last
+        finally:
+            self._lock.release()
+
+    def save(self, profile: SamplingProfile, directory: str = "profiles") -> str:
+        """Write the collapsed stacks to a file and return its path"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        with open(path, "w") as f:
+            f.write(profile.collapsed() + "\n")
+        return path
+
+
+# Global profiler instance
+profiler = SamplingProfiler(max_seconds=float(os.environ.get('PROFILE_MAX_SECONDS', '60')))
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import datetime
+import threading
+from typing import Dict, Optional
+from gemini import get_genai
+
+# Gemini only accepts context caches above this size, smaller prompts are sent inline
+MIN_CACHED_TOKENS = 32768
+
+
+class PromptTemplate:
+    """A command's prompt: model, system instruction and optional user message template"""
+
+    def __init__(self, name: str, config: dict):
+        self.name = name
+        self.config = config
+        self.model_name = config.get('model', 'gemini-1.5-flash')
+        self.system_instruction = config.get('system_instruction') or None
+        self.generation_config = config.get('generation_config') or None
+        self.user_template = config.get('user_template', '')
+        # Seconds to keep a context cache of the system instruction, 0 disables it
+        self.cache_ttl = int(config.get('cache_ttl', 0))
+
+    def render(self, **kwargs) -> str:
+        """Fill in the user message template"""
+        return self.user_template.format(**kwargs) if self.user_template else ""
+
+    def should_cache(self) -> bool:
+        """Check if the shared prefix is big enough for Gemini context caching"""
+        if not self.cache_ttl or not self.system_instruction:
+            return False
+        return len(self.system_instruction) // 4 >= MIN_CACHED_TOKENS
+
+
+class CompiledPrompt:
+    """A template with its ready-to-use GenerativeModel
+
+    With a context cache, the prompt is sent inline until the cache has been
+    created: CachedContent.create is a network call, so it (and every refresh)
+    runs in a background thread, never on the request path.
+    """
+
+    # Seconds to wait before trying again when a context cache couldn't be created
+    RETRY_INTERVAL = 60
+
+    def __init__(self, template: PromptTemplate):
+        self.template = template
+        self.cached_content = None
+        self.cache_expires_at = 0.0
+        self._model = None
+        self._variants: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._caching = False
+        self._retry_at = 0.0
+
+    @property
+    def model(self):
+        """The compiled model, built on first use to keep startup fast"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._inline_model()
+                    if self.template.should_cache():
+                        self._start_caching()
+        return self._model
+
+    def _inline_model(self):
+        template = self.template
+        return get_genai().GenerativeModel(
+            model_name=template.model_name,
+            generation_config=template.generation_config,
+            system_instruction=template.system_instruction,
+        )
+
+    def _start_caching(self):
+        """Create the context cache in a thread, called with the lock held"""
+        if self._caching or time.monotonic() < self._retry_at:
+            return
+        self._caching = True
+        threading.Thread(target=self._create_cache, name=f"prompt-cache-{self.template.name}", daemon=True).start()
+
+    def _create_cache(self):
+        template = self.template
+        genai = get_genai()
+        started = time.monotonic()
+        try:
+            cached_content = genai.caching.CachedContent.create(
+                model=f"models/{template.model_name}",
+                display_name=f"prompt-{template.name}",
+                system_instruction=template.system_instruction,
+                ttl=datetime.timedelta(seconds=template.cache_ttl),
+            )
+            model = genai.GenerativeModel.from_cached_content(
+                cached_content, generation_config=template.generation_config
+            )
+        except Exception as e:
+            print(f"Context caching unavailable for '{template.name}', sending prompt inline: {e}")
+            with self._lock:
+                self._caching = False
+                self._retry_at = time.monotonic() + self.RETRY_INTERVAL
+            return
+        with self._lock:
+            self._caching = False
+            self.cached_content = cached_content
+            self.cache_expires_at = started + template.cache_ttl
+            self._model = model
+
+    def variant(self, model_name: str):
+        """The same prompt on another model (without context caching), e.g. for hedged requests"""
+        model = self._variants.get(model_name)
+        if model is None:
+            with self._lock:
+                model = self._variants.get(model_name)
+                if model is None:
+                    model = self._variants[model_name] = get_genai().GenerativeModel(
+                        model_name=model_name,
+                        generation_config=self.template.generation_config,
+                        system_instruction=self.template.system_instruction,
+                    )
+        return model
+
+    def refresh_if_expired(self):
+        """Recreate the context cache in the background shortly before Gemini drops it"""
+        if self.cached_content is None or time.monotonic() < self.cache_expires_at - 60:
+            return
+        with self._lock:
+            if self.cached_content is None:
+                return
+            if time.monotonic() > self.cache_expires_at:
+                # Not recreated in time, the prompt is sent inline until it is
+                self.cached_content = None
+                self._model = self._inline_model()
+            self._start_caching()
+
+    def release(self):
+        """Stop using the context cache, Gemini drops it once its TTL runs out
+
+        It isn't deleted: requests still in flight may be using it.
+        """
+        with self._lock:
+            self.cached_content = None
+
+
+class PromptRegistry:
+    """Loads prompt templates from a JSON file once and hot reloads them when it changes"""
+
+    def __init__(self, path: str, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._prompts: Dict[str, CompiledPrompt] = {}
+        self._mtime = 0.0
+        self._checked_at = 0.0
+        self.load()
+
+    def load(self):
+        """(Re)load the templates file, keeping compiled models for unchanged templates"""
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding='utf-8') as f:
+                configs = json.load(f)
+        except Exception as e:
+            print(f"Error loading prompts from {self.path}: {e}")
+            return
+
+        with self._lock:
+            old = self._prompts
+            prompts = {}
+            for name, config in configs.items():
+                previous = old.get(name)
+                if previous is not None and previous.template.config == config:
+                    prompts[name] = previous
+                else:
+                    prompts[name] = CompiledPrompt(PromptTemplate(name, config))
+            for name, compiled in old.items():
+                if prompts.get(name) is not compiled:
+                    compiled.release()
+            self._prompts = prompts
+            self._mtime = mtime
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            changed = os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            return
+        if changed:
+            print(f"Reloading prompts from {self.path}")
+            self.load()
+
+    def get(self, name: str) -> CompiledPrompt:
+        self._maybe_reload()
+        compiled = self._prompts[name]
+        compiled.refresh_if_expired()
+        return compiled
+
+    def model(self, name: str):
+        """Get the compiled GenerativeModel for a command"""
+        return self.get(name).model
+
+    def variant(self, name: str, model_name: str):
+        """Get a command's prompt compiled for another model"""
+        return self.get(name).variant(model_name)
+
+    def render(self, name: str, **kwargs) -> str:
+        """Render a command's user message template"""
+        return self.get(name).template.render(**kwargs)
+
+
+# Global prompt registry, loaded once at startup
+prompt_registry = PromptRegistry(
+    os.environ.get('PROMPTS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts.json')),
+    reload_interval=float(os.environ.get('PROMPTS_RELOAD_INTERVAL', '5')),
+)
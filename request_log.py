@@ -0,0 +1,324 @@
+# Append-only log of handled requests, written as gzipped JSON lines segments.
+# Query it offline: python request_log.py [--dir request_log] [--since HOURS] [--top N]
+import os
+import sys
+import gzip
+import json
+import time
+import queue
+import atexit
+import argparse
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Optional
+from tracing import tracer, Trace
+
+SEGMENT_PREFIX = "requests-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+
+class RequestLog:
+    """One record per request, batched and written by a background thread
+
+    record() only puts the record on a bounded queue, so a handler never waits
+    for the disk: when the writer falls behind, records are dropped and counted.
+    The writer appends batches to the current segment and starts a new one when
+    it gets too big or too old, deleting the oldest segments past `max_segments`.
+    Each batch is flushed, so the active segment is readable up to its last batch.
+    """
+
+    def __init__(self, directory: str = "request_log", max_segment_bytes: int = 16 * 1024 * 1024,
+                 max_segment_age: float = 3600, batch_size: int = 256, flush_interval: float = 1.0,
+                 queue_size: int = 10000, max_segments: int = 500, enabled: bool = True):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_segments = max_segments
+        self.enabled = enabled
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._file: Optional[gzip.GzipFile] = None
+        self._raw = None
+        self._opened = 0.0
+        self.segment: Optional[str] = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.segments = 0
+        self.write_errors = 0
+
+    def record(self, entry: Dict):
+        """Queue a record for the writer, never blocks"""
+        if not self.enabled:
+            return
+        # Started on first use, so image workers are forked before the thread exists
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_trace(self, trace: Trace):
+        """Tracer listener: a record from a finished request's trace"""
+        attrs = trace.attrs
+        self.record({
+            "ts": round(trace.started, 3),
+            "bot": attrs.get("bot"),
+            "chat": attrs.get("chat_id"),
+            "user": attrs.get("user_id"),
+            "command": trace.name,
+            "model": attrs.get("model"),
+            "calls": attrs.get("gemini_calls", 0),
+            "prompt_tokens": attrs.get("prompt_tokens", 0),
+            "output_tokens": attrs.get("output_tokens", 0),
+            "latency_ms": round(trace.duration * 1000, 1),
+            "cached": attrs.get("cached"),
+            "error": trace.error.split(":", 1)[0] if trace.error else None,
+        })
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="request-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # None is put by close(), after the last records
+            if batch and batch[-1] is None:
+                batch.pop()
+                stopping = True
+            if batch:
+                self._write(batch)
+            if self._file is not None and (stopping or self._segment_full()):
+                self._close_segment()
+
+    def _write(self, batch: List[Dict]):
+        data = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in batch).encode()
+        try:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+        except OSError as e:
+            self.write_errors += 1
+            print(f"Error writing the request log: {e}")
+            # Start a fresh segment with the next batch
+            self._close_segment()
+            return
+        self.written += len(batch)
+        self.batches += 1
+
+    def _segment_full(self) -> bool:
+        return (self._raw.tell() >= self.max_segment_bytes
+                or time.monotonic() - self._opened >= self.max_segment_age)
+
+    def _open_segment(self):
+        # The sequence number keeps segments opened within a second apart, and in order
+        self.segments += 1
+        name = f"{SEGMENT_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}-{self.segments:06d}-{os.getpid()}{SEGMENT_SUFFIX}"
+        self.segment = os.path.join(self.directory, name)
+        self._raw = open(self.segment, "ab")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._opened = time.monotonic()
+        self._prune()
+
+    def _close_segment(self):
+        try:
+            if self._file is not None:
+                self._file.close()
+            if self._raw is not None:
+                self._raw.close()
+        except OSError as e:
+            print(f"Error closing request log segment {self.segment}: {e}")
+        self._file = self._raw = None
+
+    def _prune(self):
+        """Delete the oldest segments, of any process, past max_segments"""
+        paths = segment_paths(self.directory)
+        for path in paths[:max(len(paths) - self.max_segments, 0)]:
+            if path != self.segment:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def close(self, timeout: float = 5.0):
+        """Write out queued records and close the segment"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self) -> str:
+        if not self.enabled:
+            return "disabled"
+        return (f"{self.written} records in {self.batches} batches, {self.segments} segments, "
+                f"queued: {self._queue.qsize()}, dropped: {self.dropped}, write errors: {self.write_errors}")
+
+
+def segment_paths(directory: str) -> List[str]:
+    """Segments oldest first, their names start with the time they were opened"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    names = sorted(name for name in names if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, name) for name in names]
+
+
+def read_records(directory: str, since: Optional[float] = None) -> Iterator[Dict]:
+    """Records from every segment, including the one being written"""
+    for path in segment_paths(directory):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line of a segment cut short by a crash
+                        continue
+                    if since is None or entry.get("ts", 0) >= since:
+                        yield entry
+        except (EOFError, gzip.BadGzipFile, OSError):
+            # An active or truncated segment ends without the gzip trailer
+            continue
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+def summarize(records, top: int = 10) -> Dict:
+    """Request counts, latency percentiles, tokens and top users from log records"""
+    commands = defaultdict(list)
+    users = defaultdict(lambda: [0, 0])
+    errors = Counter()
+    models = Counter()
+    total = failed = cached = 0
+    for entry in records:
+        total += 1
+        commands[entry["command"]].append(entry)
+        tokens = entry.get("prompt_tokens", 0) + entry.get("output_tokens", 0)
+        if entry.get("user") is not None:
+            user = (entry.get("bot") or "", entry["user"])
+            users[user][0] += 1
+            users[user][1] += tokens
+        if entry.get("error"):
+            failed += 1
+            errors[entry["error"]] += 1
+        if entry.get("cached"):
+            cached += 1
+        if entry.get("model"):
+            models[entry["model"]] += entry.get("calls", 0)
+
+    per_command = {}
+    for command, entries in commands.items():
+        latencies = sorted(entry["latency_ms"] for entry in entries)
+        per_command[command] = {
+            "requests": len(entries),
+            "p50_ms": _percentile(latencies, 0.5),
+            "p95_ms": _percentile(latencies, 0.95),
+            "p99_ms": _percentile(latencies, 0.99),
+            "errors": sum(1 for entry in entries if entry.get("error")),
+            "cached": sum(1 for entry in entries if entry.get("cached")),
+            "prompt_tokens": sum(entry.get("prompt_tokens", 0) for entry in entries),
+            "output_tokens": sum(entry.get("output_tokens", 0) for entry in entries),
+        }
+    by_requests = sorted(users.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    by_tokens = sorted(users.items(), key=lambda item: item[1][1], reverse=True)[:top]
+    return {
+        "requests": total,
+        "errors": failed,
+        "cached": cached,
+        "commands": dict(sorted(per_command.items(), key=lambda item: item[1]["requests"], reverse=True)),
+        "top_users_by_requests": [(bot, user, count, tokens) for (bot, user), (count, tokens) in by_requests],
+        "top_users_by_tokens": [(bot, user, count, tokens) for (bot, user), (count, tokens) in by_tokens],
+        "errors_by_class": errors.most_common(top),
+        "gemini_calls_by_model": models.most_common(),
+    }
+
+
+def print_summary(summary: Dict):
+    total = summary["requests"]
+    if not total:
+        print("No requests logged")
+        return
+    print(f"{total} requests, {summary['errors'] / total:.1%} failed, {summary['cached'] / total:.1%} cached")
+    print()
+    print(f"{'command':<26}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'cached':>8}"
+          f"{'tokens in':>11}{'tokens out':>11}")
+    for command, c in summary["commands"].items():
+        print(f"{command:<26}{c['requests']:>9}{c['p50_ms']:>9.0f}{c['p95_ms']:>9.0f}{c['p99_ms']:>9.0f}"
+              f"{c['errors']:>8}{c['cached']:>8}{c['prompt_tokens']:>11}{c['output_tokens']:>11}")
+    for title, key in (("Top users by requests", "top_users_by_requests"), ("Top users by tokens", "top_users_by_tokens")):
+        print()
+        print(title)
+        for bot, user, count, tokens in summary[key]:
+            print(f"  {bot + ':' if bot else ''}{user:<14} {count:>7} requests {tokens:>10} tokens")
+    if summary["errors_by_class"]:
+        print()
+        print("Errors")
+        for name, count in summary["errors_by_class"]:
+            print(f"  {name:<30} {count:>7}")
+    if summary["gemini_calls_by_model"]:
+        print()
+        print("Gemini calls")
+        for name, count in summary["gemini_calls_by_model"]:
+            print(f"  {name:<30} {count:>7}")
+
+
+def create_request_log() -> RequestLog:
+    log = RequestLog(
+        directory=os.environ.get('REQUEST_LOG_DIR', 'request_log'),
+        max_segment_bytes=int(float(os.environ.get('REQUEST_LOG_SEGMENT_MB', '16')) * 1024 * 1024),
+        max_segment_age=float(os.environ.get('REQUEST_LOG_SEGMENT_MINUTES', '60')) * 60,
+        max_segments=int(os.environ.get('REQUEST_LOG_MAX_SEGMENTS', '500')),
+        queue_size=int(os.environ.get('REQUEST_LOG_QUEUE_SIZE', '10000')),
+        enabled=os.environ.get('REQUEST_LOG_ENABLED', 'true').lower() == 'true',
+    )
+    if log.enabled:
+        tracer.listeners.append(log.record_trace)
+        atexit.register(log.close)
+    return log
+
+# Global request log, fed by the tracer
+request_log = create_request_log()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the request log")
+    parser.add_argument("--dir", default=os.environ.get('REQUEST_LOG_DIR', 'request_log'))
+    parser.add_argument("--since", type=float, help="only the last SINCE hours")
+    parser.add_argument("--top", type=int, default=10, help="how many users and error classes to list")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+    since = time.time() - args.since * 3600 if args.since else None
+    summary = summarize(read_records(args.dir, since), args.top)
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
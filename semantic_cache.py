@@ -0,0 +1,311 @@
+import os
+import re
+import zlib
+import time
+import atexit
+import difflib
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+from warm_state import read_snapshot, write_snapshot
+
+# Common English contractions, expanded so "What's Python" and "what is python?"
+# normalize to the same text before they are embedded
+CONTRACTIONS = {
+    "what's": "what is",
+    "who's": "who is",
+    "where's": "where is",
+    "how's": "how is",
+    "it's": "it is",
+    "that's": "that is",
+    "there's": "there is",
+    "i'm": "i am",
+    "can't": "cannot",
+    "won't": "will not",
+    "n't": " not",
+    "'re": " are",
+    "'ve": " have",
+    "'ll": " will",
+    "'d": " would",
+}
+
+_CONTRACTION_PATTERN = re.compile(
+    "|".join(re.escape(key) for key in sorted(CONTRACTIONS, key=len, reverse=True))
+)
+_NON_WORD_PATTERN = re.compile(r"[^a-z0-9]+")
+_NUMBER_PATTERN = re.compile(r"\d+")
+
+# Words that don't change what is asked, ignored when comparing the words of two prompts
+# (not "to", "from" or "into": "json to yaml" and "yaml from json" ask different things)
+STOPWORDS = frozenset(
+    "a an the is are was were be been am do does did i me my you your we our it its this that these those "
+    "of in on at for by with about as and or but if so can could would should will shall may "
+    "might must please tell explain what which who whom whose how why when where there here some any".split()
+)
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase, expand contractions and strip punctuation"""
+    text = text.lower().replace("’", "'")
+    text = _CONTRACTION_PATTERN.sub(lambda m: CONTRACTIONS[m.group(0)], text)
+    return _NON_WORD_PATTERN.sub(" ", text).strip()
+
+
+def prompt_terms(text: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Content words and numbers of a prompt in order, which must agree for a cache hit"""
+    normalized = normalize_prompt(text)
+    words = tuple(word for word in normalized.split()
+                  if word not in STOPWORDS and not _NUMBER_PATTERN.search(word))
+    return words, tuple(_NUMBER_PATTERN.findall(normalized))
+
+
+def same_terms(a: Tuple[Tuple[str, ...], Tuple[str, ...]], b: Tuple[Tuple[str, ...], Tuple[str, ...]]) -> bool:
+    """Same numbers, and the same content words in the same order, allowing for typos
+
+    Similar vectors aren't enough: "the sum of a list" and "the max of a list"
+    differ in one word, "postgres and mysql" and "mysql and postgres" in the
+    order, and both score well above the threshold.
+    """
+    words_a, numbers_a = a
+    words_b, numbers_b = b
+    if numbers_a != numbers_b or len(words_a) != len(words_b):
+        return False
+    return all(x == y or difflib.SequenceMatcher(None, x, y).ratio() >= 0.8 for x, y in zip(words_a, words_b))
+
+
+class HashedNgramVectorizer:
+    """Embed text as an L2-normalized vector of hashed character n-grams and words"""
+
+    def __init__(self, dim: int = 1024, ngram_range: Tuple[int, int] = (3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def embed(self, text: str) -> np.ndarray:
+        normalized = f" {normalize_prompt(text)} "
+        indices = []
+        signs = []
+        features = normalized.split()
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            features.extend(normalized[i:i + n] for i in range(len(normalized) - n + 1))
+
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            indices.append(h % self.dim)
+            signs.append(1.0 if h & 0x80000000 else -1.0)
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if indices:
+            np.add.at(vector, np.array(indices), np.array(signs, dtype=np.float32))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class LocalModelVectorizer:
+    """Embed text with a small local sentence-transformers model on CPU"""
+
+    def __init__(self, model_name: str):
+        # Optional dependency, only needed when SEMANTIC_CACHE_MODEL is set
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = self.model.encode(normalize_prompt(text), normalize_embeddings=True)
+        return np.asarray(vector, dtype=np.float32)
+
+
+class SemanticCache:
+    """In-memory vector index returning cached answers for near-duplicate prompts
+
+    Entries are scoped by the prompt (system instruction) that produced them,
+    and a hit also needs the same numbers and content words, see same_terms().
+    """
+
+    def __init__(self, vectorizer, max_entries: int = 2048, threshold: float = 0.9,
+                 path: str = "", enabled: bool = True, max_prompt_chars: int = 1000):
+        self.vectorizer = vectorizer
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.path = path
+        self.enabled = enabled
+        self.max_prompt_chars = max_prompt_chars
+
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((max_entries, vectorizer.dim), dtype=np.float32)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._prompts: List[str] = [""] * max_entries
+        self._answers: List[str] = [""] * max_entries
+        self._scopes: List[str] = [""] * max_entries
+        self._terms: List[tuple] = [((), ())] * max_entries
+        self._count = 0
+        # Snapshot to restore on first use, so loading it never delays startup
+        self._restore_path: Optional[str] = None
+        self._dirty = False
+
+        self.hits = 0
+        self.misses = 0
+
+    def _cacheable(self, prompt: Optional[str]) -> bool:
+        return self.enabled and bool(prompt) and len(prompt) <= self.max_prompt_chars
+
+    def get(self, prompt: Optional[str], scope: str = "") -> Optional[str]:
+        """Return the cached answer for a similar prompt asked with the same `scope` (prompt name), if any"""
+        if not self._cacheable(prompt):
+            return None
+
+        query = self.vectorizer.embed(prompt)
+        terms = prompt_terms(prompt)
+        self.restore()
+        with self._lock:
+            similarities = self._vectors[:self._count] @ query
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            # Most similar first, usually there are none or one
+            for slot in candidates[np.argsort(similarities[candidates])[::-1]]:
+                if self._scopes[slot] == scope and same_terms(self._terms[slot], terms):
+                    self._last_used[slot] = time.monotonic()
+                    self.hits += 1
+                    return self._answers[slot]
+            self.misses += 1
+            return None
+
+    def put(self, prompt: Optional[str], answer: str, scope: str = ""):
+        """Store an answer, evicting the least recently used entry when full"""
+        if not self._cacheable(prompt) or not answer:
+            return
+
+        vector = self.vectorizer.embed(prompt)
+        terms = prompt_terms(prompt)
+        self.restore()
+        with self._lock:
+            self._dirty = True
+            if self._count < self.max_entries:
+                slot = self._count
+                self._count += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._last_used[slot] = time.monotonic()
+            self._prompts[slot] = prompt
+            self._answers[slot] = answer
+            self._scopes[slot] = scope
+            self._terms[slot] = terms
+
+    def __len__(self) -> int:
+        self.restore()
+        return self._count
+
+    def save(self, path: str = ""):
+        """Snapshot the index, skipped if nothing changed since it was loaded or saved"""
+        path = path or self.path
+        if not path or not self.enabled:
+            return
+        self.restore()
+        with self._lock:
+            if not self._dirty:
+                return
+            count = self._count
+            # Store recency as rank so it stays meaningful across restarts
+            order = np.argsort(self._last_used[:count])
+            write_snapshot(
+                path,
+                arrays=_pack_vectors(self._vectors[:count][order]),
+                strings={
+                    "prompts": [self._prompts[i] for i in order],
+                    "answers": [self._answers[i] for i in order],
+                    "scopes": [self._scopes[i] for i in order],
+                },
+                meta={"dim": self.vectorizer.dim, "hits": self.hits, "misses": self.misses},
+            )
+            self._dirty = False
+
+    def load(self, path: str = ""):
+        """Restore a snapshot written by save() the first time the cache is used"""
+        path = path or self.path
+        if path and os.path.exists(path):
+            with self._lock:
+                self._restore_path = path
+
+    def restore(self):
+        """Restore a pending snapshot now, e.g. from a background thread after startup"""
+        if self._restore_path is None:
+            return
+        with self._lock:
+            path, self._restore_path = self._restore_path, None
+            if path is None:
+                return
+            snapshot = read_snapshot(path)
+            if snapshot is None:
+                return
+            if snapshot.meta.get("dim") != self.vectorizer.dim:
+                print(f"Ignoring semantic cache at {path}: embedding size changed")
+                return
+            prompts = snapshot.strings("prompts")
+            answers = snapshot.strings("answers")
+            scopes = snapshot.strings("scopes")
+
+            # Keep the most recently used entries if the cache was shrunk
+            keep = min(len(prompts), self.max_entries)
+            start = len(prompts) - keep
+            now = time.monotonic()
+            self._count = keep
+            _unpack_vectors(snapshot, start, self._vectors[:keep])
+            self._last_used[:keep] = now - np.arange(keep, 0, -1)
+            self._prompts[:keep] = prompts[start:]
+            self._answers[:keep] = answers[start:]
+            self._scopes[:keep] = scopes[start:]
+            self._terms[:keep] = [prompt_terms(prompt) for prompt in self._prompts[:keep]]
+            self.hits = snapshot.meta.get("hits", 0)
+            self.misses = snapshot.meta.get("misses", 0)
+
+
+def _pack_vectors(vectors: np.ndarray) -> dict:
+    """Vectors as float16, sparse rows (hashed n-grams) as CSR with 16-bit column indices: a fraction of the float32 size"""
+    rows, cols = np.nonzero(vectors)
+    if len(cols) * 2 >= vectors.size:
+        return {"vectors": vectors.astype(np.float16)}
+    return {
+        "indptr": np.searchsorted(rows, np.arange(len(vectors) + 1)).astype(np.int64),
+        "indices": cols.astype(np.uint16 if vectors.shape[1] <= 1 << 16 else np.int32),
+        "values": vectors[rows, cols].astype(np.float16),
+    }
+
+
+def _unpack_vectors(snapshot, start: int, out: np.ndarray):
+    """Fill `out` with the vectors of a snapshot, from row `start` on"""
+    if "vectors" in snapshot:
+        out[:] = snapshot.array("vectors")[start:]
+        return
+    indptr = snapshot.array("indptr")[start:]
+    rows = np.repeat(np.arange(len(out)), np.diff(indptr))
+    out[:] = 0
+    out[rows, snapshot.array("indices")[indptr[0]:]] = snapshot.array("values")[indptr[0]:]
+
+
+def _create_semantic_cache() -> SemanticCache:
+    enabled = os.environ.get('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+    model_name = os.environ.get('SEMANTIC_CACHE_MODEL', '')
+    vectorizer = None
+    if enabled and model_name:
+        try:
+            vectorizer = LocalModelVectorizer(model_name)
+        except Exception as e:
+            print(f"Falling back to hashed n-gram embeddings: {e}")
+    if vectorizer is None:
+        vectorizer = HashedNgramVectorizer(dim=int(os.environ.get('SEMANTIC_CACHE_DIM', '1024')))
+
+    cache = SemanticCache(
+        vectorizer,
+        max_entries=int(os.environ.get('SEMANTIC_CACHE_SIZE', '2048')) if enabled else 1,
+        threshold=float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.9')),
+        path=os.environ.get('SEMANTIC_CACHE_PATH', 'semantic_cache.warm'),
+        enabled=enabled,
+    )
+    if enabled:
+        cache.load()
+        atexit.register(cache.save)
+    return cache
+
+# Global semantic cache instance, shared by the bot and the web app
+semantic_cache = _create_semantic_cache()
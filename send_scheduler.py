@@ -0,0 +1,309 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Awaitable, Callable, Dict, List, Optional
+from pyrogram.errors import FloodWait
+
+# Lower value = sent first
+FINAL = 0
+STATUS = 1
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average, with bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        """True if the bucket is back to a full burst, i.e. a new one would behave the same"""
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class Job:
+    __slots__ = ('priority', 'seq', 'chat_id', 'call', 'limited', 'future', 'edit_key', 'attempts', 'cancelled')
+
+    def __init__(self, priority: int, seq: int, chat_id: int, call: Callable[[], Awaitable],
+                 limited: bool, edit_key=None):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        # Counts against the per-chat message limit (sends and edits do, deletes don't)
+        self.limited = limited
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.edit_key = edit_key
+        self.attempts = 0
+        self.cancelled = False
+
+    def __lt__(self, other: "Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _log_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Error sending message: {future.exception()}")
+
+
+class StatusMessage:
+    """A low priority status message ("Please Wait...") that is sent in the background
+
+    Deleting it before it went out cancels the send, so under load no API
+    calls are wasted on status messages nobody would have seen.
+    """
+
+    def __init__(self, scheduler: "OutboundScheduler", message, text: str, **kwargs):
+        self.scheduler = scheduler
+        self.chat_id = message.chat.id
+        self.job = scheduler.submit(self.chat_id, lambda: message.reply_text(text, **kwargs), STATUS)
+        self.job.future.add_done_callback(_log_failure)
+        self.edit: Optional[Job] = None
+        self.deleted = False
+
+    def update(self, text: str, **kwargs):
+        """Edit the status text, only the latest pending edit is sent"""
+        if self.deleted:
+            return
+
+        async def edit():
+            # The status message was cancelled or failed to send, there's nothing to edit
+            if self.job.future.cancelled():
+                return None
+            try:
+                sent = await asyncio.shield(self.job.future)
+            except (asyncio.CancelledError, Exception):
+                return None
+            return await sent.edit_text(text, **kwargs)
+        self.edit = self.scheduler.submit(self.chat_id, edit, STATUS, edit_key=id(self))
+        self.edit.future.add_done_callback(_log_failure)
+
+    async def delete(self):
+        """Remove the status message, or cancel it if it wasn't sent yet"""
+        self.deleted = True
+        if self.edit is not None:
+            self.scheduler.cancel(self.edit)
+        if self.scheduler.cancel(self.job):
+            return
+        try:
+            sent = await self.job.future
+        except Exception:
+            return
+        job = self.scheduler.submit(self.chat_id, sent.delete, STATUS, limited=False)
+        job.future.add_done_callback(_log_failure)
+
+
+class OutboundScheduler:
+    """Single gateway for outgoing Telegram calls
+
+    Enforces per-chat and global send rates, absorbs FloodWait by rescheduling,
+    coalesces pending edits of the same message and sends final answers before
+    status messages.
+    """
+
+    def __init__(self, global_rate: float = 25.0, private_rate: float = 1.0,
+                 group_rate: float = 20 / 60, burst: float = 3, max_attempts: int = 5):
+        self.global_bucket = TokenBucket(global_rate, burst)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+
+        self._seq = itertools.count()
+        self._queues: Dict[int, List[Job]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._blocked_until: Dict[int, float] = {}
+        self._edits: Dict[object, Job] = {}
+        # Per-chat state of idle chats is dropped now and then, see _prune()
+        self._next_prune = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._running = 0
+
+        self.sent = 0
+        self.flood_waits = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Telegram allows about 1 message/s in private chats and 20/min in groups
+            rate = self.private_rate if chat_id > 0 else self.group_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.burst)
+        return bucket
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable], priority: int = FINAL,
+               limited: bool = True, edit_key=None) -> Job:
+        """Queue an API call, returns a job whose future resolves with its result"""
+        if edit_key is not None:
+            pending = self._edits.get(edit_key)
+            if pending is not None:
+                # Same message edited again before the last edit went out: send only the latest
+                pending.call = call
+                self.coalesced += 1
+                return pending
+
+        job = Job(priority, next(self._seq), chat_id, call, limited, edit_key)
+        if edit_key is not None:
+            self._edits[edit_key] = job
+        heapq.heappush(self._queues.setdefault(chat_id, []), job)
+        self._ensure_worker()
+        self._wakeup.set()
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        """Cancel a job that is queued, including one waiting to be retried after a FloodWait"""
+        if job.cancelled or job.future.done():
+            return False
+        queue = self._queues.get(job.chat_id)
+        if not queue or job not in queue:
+            return False
+        job.cancelled = True
+        job.future.cancel()
+        if job.edit_key is not None and self._edits.get(job.edit_key) is job:
+            del self._edits[job.edit_key]
+        self.cancelled += 1
+        return True
+
+    async def reply(self, message, text: str, priority: int = FINAL, **kwargs):
+        """Reply to a message, waits until it's sent and returns the sent message"""
+        job = self.submit(message.chat.id, lambda: message.reply_text(text, **kwargs), priority)
+        return await job.future
+
+    def status(self, message, text: str, **kwargs) -> StatusMessage:
+        """Send a status message in the background"""
+        return StatusMessage(self, message, text, **kwargs)
+
+    def chat_action(self, message, action):
+        """Show a chat action ("typing..."), skipped by the per-chat limit"""
+        job = self.submit(message.chat.id, lambda: message.reply_chat_action(action), STATUS, limited=False)
+        job.future.add_done_callback(_log_failure)
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    def _next_job(self, now: float):
+        """Pick the best job that may be sent now, or how long until one may be"""
+        best = None
+        wait = float('inf')
+        for chat_id in list(self._queues):
+            queue = self._queues[chat_id]
+            while queue and queue[0].cancelled:
+                heapq.heappop(queue)
+            if not queue:
+                del self._queues[chat_id]
+                continue
+            head = queue[0]
+            chat_wait = self._blocked_until.get(chat_id, 0) - now
+            if head.limited:
+                chat_wait = max(chat_wait, self._bucket(chat_id).wait_time(now))
+            if chat_wait > 0:
+                wait = min(wait, chat_wait)
+            elif best is None or head < best:
+                best = head
+        return best, wait
+
+    def _prune(self, now: float):
+        """Forget the rate limit state of chats with nothing queued, once it's back to its initial state"""
+        for chat_id in [c for c, until in self._blocked_until.items() if until <= now and c not in self._queues]:
+            del self._blocked_until[chat_id]
+        for chat_id in [c for c, bucket in self._buckets.items() if c not in self._queues and bucket.full(now)]:
+            del self._buckets[chat_id]
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            if now >= self._next_prune:
+                self._prune(now)
+                self._next_prune = now + 60
+            job, wait = self._next_job(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), None if wait == float('inf') else wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            heapq.heappop(self._queues[job.chat_id])
+            if job.edit_key is not None and self._edits.get(job.edit_key) is job:
+                del self._edits[job.edit_key]
+            self.global_bucket.take(now)
+            if job.limited:
+                self._bucket(job.chat_id).take(now)
+            asyncio.create_task(self._execute(job))
+
+    def pending(self) -> int:
+        """Calls queued or in progress"""
+        return self._running + sum(not job.cancelled for queue in self._queues.values() for job in queue)
+
+    async def _execute(self, job: Job):
+        job.attempts += 1
+        self._running += 1
+        try:
+            result = await job.call()
+        except FloodWait as e:
+            self.flood_waits += 1
+            if job.attempts >= self.max_attempts:
+                job.future.set_exception(e)
+                return
+            # Telegram told us when this chat may be written to again, retry then
+            wait = float(e.value or 1)
+            self._blocked_until[job.chat_id] = max(self._blocked_until.get(job.chat_id, 0), time.monotonic() + wait)
+            heapq.heappush(self._queues.setdefault(job.chat_id, []), job)
+            self._wakeup.set()
+            return
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        except asyncio.CancelledError:
+            # Never leave a waiter hanging on a job whose call was cancelled
+            job.future.cancel()
+            raise
+        finally:
+            self._running -= 1
+        self.sent += 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def stats(self) -> str:
+        queued = sum(len(queue) for queue in self._queues.values())
+        return (f"sent: {self.sent}, queued: {queued}, chats tracked: {len(self._buckets)}, "
+                f"flood waits: {self.flood_waits}, "
+                f"coalesced edits: {self.coalesced}, cancelled status messages: {self.cancelled}")
+
+
+# Global outbound scheduler, every reply goes through it
+sender = OutboundScheduler(
+    global_rate=float(os.environ.get('SEND_GLOBAL_RATE', '25')),
+    private_rate=float(os.environ.get('SEND_PRIVATE_RATE', '1')),
+    group_rate=float(os.environ.get('SEND_GROUP_RATE_PER_MIN', '20')) / 60,
+    burst=float(os.environ.get('SEND_BURST', '3')),
+)
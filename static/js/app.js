@@ -53,7 +53,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 },
                 body: JSON.stringify({
                     message: message,
-                    user_id: tg.initDataUnsafe?.user?.id || 'web_user'
+                    // Signed by Telegram, verified by the server
+                    init_data: tg.initData
                 })
             });
             
@@ -63,7 +64,7 @@ document.addEventListener('DOMContentLoaded', function() {
             loadingDiv.remove();
             
             // Add AI response
-            addMessage(data.response, 'ai');
+            addMessage(data.response || data.error, 'ai');
             
             // Show ads based on frequency
             if (messageCount % adFrequency === 0) {
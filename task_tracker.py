@@ -0,0 +1,68 @@
+import asyncio
+from typing import Awaitable, Dict, Hashable, Type
+
+
+class Superseded(Exception):
+    """Raised when a task was cancelled because a newer one replaced it"""
+
+
+class Stopped(Exception):
+    """Raised when a task was cancelled on request (e.g. the user asked to stop)"""
+
+
+class LatestTaskTracker:
+    """Runs at most one task per key: starting a new one cancels the previous one
+
+    Used where only the latest request of a user matters (inline queries typed
+    keystroke by keystroke, a private chat question replaced by a newer one),
+    so abandoned requests stop costing upstream calls as soon as they're replaced.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        # Why each task was cancelled, re-raised to whoever is waiting for it
+        self._reasons: Dict[asyncio.Task, Type[Exception]] = {}
+        self.started = 0
+        self.superseded = 0
+        self.stopped = 0
+
+    async def run(self, key: Hashable, coro: Awaitable):
+        """Run `coro` as the latest task for `key`, raises Superseded if a newer one replaces it"""
+        self.cancel(key, Superseded)
+        task = asyncio.ensure_future(coro)
+        self._tasks[key] = task
+        self.started += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            reason = self._reasons.get(task)
+            if reason is not None:
+                raise reason() from None
+            # The caller itself was cancelled, don't leave the task running
+            task.cancel()
+            raise
+        finally:
+            self._reasons.pop(task, None)
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def cancel(self, key: Hashable, reason: Type[Exception] = Stopped) -> bool:
+        """Cancel the running task for `key`, if any, its caller gets `reason` raised"""
+        task = self._tasks.pop(key, None)
+        if task is None or task.done():
+            return False
+        self._reasons[task] = reason
+        if reason is Superseded:
+            self.superseded += 1
+        else:
+            self.stopped += 1
+        task.cancel()
+        return True
+
+    def running(self, key: Hashable) -> bool:
+        task = self._tasks.get(key)
+        return task is not None and not task.done()
+
+    def stats(self) -> str:
+        return (f"started: {self.started}, superseded: {self.superseded}, stopped: {self.stopped}, "
+                f"running: {len(self._tasks)}")
@@ -0,0 +1,83 @@
+import os
+import hmac
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import parse_qsl
+
+
+def verify_init_data(init_data: str, bot_token: str, max_age: int = 86400) -> Optional[dict]:
+    """Verify Telegram WebApp initData and return the user it was issued for"""
+    if not init_data or not bot_token:
+        return None
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        return None
+
+    received_hash = fields.pop('hash', '')
+    data_check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        return None
+
+    try:
+        auth_date = int(fields.get('auth_date', '0'))
+        user = json.loads(fields.get('user', 'null'))
+    except ValueError:
+        return None
+    if max_age and time.time() - auth_date > max_age:
+        return None
+    if not isinstance(user, dict) or 'id' not in user:
+        return None
+    return user
+
+
+class InitDataVerifier:
+    """Verifies initData once per WebApp session and caches the result"""
+
+    def __init__(self, bot_token: str, max_age: int = 86400, max_sessions: int = 10000):
+        self.bot_token = bot_token
+        self.max_age = max_age
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # initData digest -> (user, expiry)
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def verify(self, init_data: str) -> Optional[dict]:
+        if not init_data:
+            return None
+        key = hashlib.sha256(init_data.encode()).hexdigest()
+        now = time.time()
+        with self._lock:
+            cached = self._sessions.get(key)
+            if cached is not None:
+                user, expires_at = cached
+                if now < expires_at:
+                    self._sessions.move_to_end(key)
+                    return user
+                del self._sessions[key]
+
+        user = verify_init_data(init_data, self.bot_token, self.max_age)
+        if user is None:
+            return None
+
+        # initData stops being valid max_age seconds after it was issued
+        auth_date = int(dict(parse_qsl(init_data)).get('auth_date', now))
+        expires_at = auth_date + self.max_age if self.max_age else float('inf')
+        with self._lock:
+            self._sessions[key] = (user, expires_at)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return user
+
+
+# Global verifier for the web app
+init_data_verifier = InitDataVerifier(
+    os.environ.get('BOT_TOKEN', ''),
+    max_age=int(os.environ.get('WEBAPP_INIT_DATA_MAX_AGE', '86400')),
+)
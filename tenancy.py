@@ -0,0 +1,105 @@
+import time
+import functools
+import threading
+import contextvars
+from typing import Callable, List, Optional
+from pyrogram.handlers import MessageHandler, InlineQueryHandler
+from send_scheduler import TokenBucket
+
+
+class QuotaExceeded(Exception):
+    """A bot used up its Gemini quota, the message is shown to the user"""
+
+    def __init__(self):
+        super().__init__("This bot has reached its usage limit, please try again in a minute.")
+
+
+class Tenant:
+    """One of several bots served by one process (multibot.py): its client, ad settings and quota"""
+
+    def __init__(self, name: str, client, ad_config=None, calls_per_minute: float = 0, burst: float = 10,
+                 primary: bool = False):
+        self.name = name
+        self.client = client
+        self.ad_config = ad_config
+        # The primary bot keeps unprefixed chat state, shared with the web app and single-bot deployments
+        self.primary = primary
+        self.quota = TokenBucket(calls_per_minute / 60, burst) if calls_per_minute else None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.over_quota = 0
+
+    def charge(self):
+        """Count one Gemini call, raises QuotaExceeded when the quota is used up"""
+        with self._lock:
+            if self.quota is not None:
+                now = time.monotonic()
+                if self.quota.wait_time(now) > 0:
+                    self.over_quota += 1
+                    raise QuotaExceeded()
+                self.quota.take(now)
+            self.calls += 1
+
+    def stats(self) -> str:
+        return f"bot {self.name}: {self.calls} Gemini calls, {self.over_quota} over quota"
+
+
+# Bot handling the current update, None with a single bot
+current_tenant: contextvars.ContextVar[Optional[Tenant]] = contextvars.ContextVar("tenant", default=None)
+
+
+def scoped(key):
+    """Key for per-chat state, prefixed with the bot's name except for the primary (or only) bot
+
+    Private chat ids are user ids, the same for every bot, so without it a
+    user's conversations with two bots would be mixed up.
+    """
+    tenant = current_tenant.get()
+    if tenant is None or tenant.primary:
+        return key
+    return f"{tenant.name}:{key}"
+
+
+def charge_current():
+    """Charge a Gemini call to the bot handling the current update, if any"""
+    tenant = current_tenant.get()
+    if tenant is not None:
+        tenant.charge()
+
+
+class HandlerTable:
+    """Update handlers declared once with decorators, registered on any number of clients"""
+
+    def __init__(self):
+        self.entries: List[tuple] = []
+
+    def on_message(self, filters=None, group: int = 0) -> Callable:
+        def decorator(func):
+            self.entries.append((MessageHandler, func, filters, group))
+            return func
+        return decorator
+
+    def on_inline_query(self, filters=None, group: int = 0) -> Callable:
+        def decorator(func):
+            self.entries.append((InlineQueryHandler, func, filters, group))
+            return func
+        return decorator
+
+    @staticmethod
+    def bind(func, tenant: Optional[Tenant]):
+        """`func` running as `tenant`'s handler"""
+        if tenant is None:
+            return func
+
+        @functools.wraps(func)
+        async def handler(client, update):
+            token = current_tenant.set(tenant)
+            try:
+                return await func(client, update)
+            finally:
+                current_tenant.reset(token)
+        return handler
+
+    def register(self, client, tenant: Optional[Tenant] = None):
+        for handler_class, func, filters, group in self.entries:
+            client.add_handler(handler_class(self.bind(func, tenant), filters), group)
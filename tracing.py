@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, List, Optional
+
+
+class Trace:
+    """Timings of one request: total latency plus a span per phase"""
+
+    __slots__ = ('name', 'attrs', 'started', 'start', 'duration', 'spans', 'error')
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans: List[tuple] = []
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "started": round(self.started, 3),
+            "duration_ms": round(self.duration * 1000, 1),
+            "error": self.error,
+            "attrs": self.attrs,
+            "spans": [{"name": name, "start_ms": round(offset * 1000, 1), "duration_ms": round(duration * 1000, 1)}
+                      for name, offset, duration in self.spans],
+        }
+
+    def format(self) -> str:
+        spans = ", ".join(f"{name} {duration * 1000:.0f}ms" for name, _, duration in self.spans)
+        error = f" error: {self.error}" if self.error else ""
+        return f"{self.name} {self.duration * 1000:.0f}ms [{spans}]{error}"
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+class Tracer:
+    """Per-request spans, with slow or failed requests kept in a ring buffer
+
+    Sampling happens at the tail: every request is timed (a few list appends),
+    and only those slower than `slow_threshold` or failed are kept.
+    """
+
+    def __init__(self, slow_threshold: float = 3.0, buffer_size: int = 100, enabled: bool = True):
+        self.slow_threshold = slow_threshold
+        self.enabled = enabled
+        self.slow: Deque[Trace] = deque(maxlen=buffer_size)
+        # Called with every finished trace, e.g. by the request log
+        self.listeners: List[Callable[[Trace], None]] = []
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def request(self, name: str, **attrs):
+        """Trace a request, nested calls to span() record its phases"""
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace(name, attrs)
+        token = _current.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            trace.duration = time.perf_counter() - trace.start
+            with self._lock:
+                self.requests += 1
+                if trace.duration >= self.slow_threshold or trace.error:
+                    self.slow.append(trace)
+            for listener in self.listeners:
+                listener(trace)
+
+    def recent(self, limit: int = 20) -> List[Trace]:
+        """Latest slow or failed requests, newest first"""
+        with self._lock:
+            return list(self.slow)[::-1][:limit]
+
+
+@contextmanager
+def span(name: str):
+    """Time a phase of the current request, a no-op outside of one"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((name, start - trace.start, time.perf_counter() - start))
+
+
+def annotate(**attrs):
+    """Attach attributes (e.g. cache hits) to the current request"""
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def record_usage(model: Optional[str], usage):
+    """Add a Gemini call's model and token counts (response.usage_metadata) to the current request"""
+    trace = _current.get()
+    if trace is None:
+        return
+    attrs = trace.attrs
+    attrs["gemini_calls"] = attrs.get("gemini_calls", 0) + 1
+    if model:
+        attrs["model"] = model
+    if usage is not None:
+        attrs["prompt_tokens"] = attrs.get("prompt_tokens", 0) + (getattr(usage, "prompt_token_count", 0) or 0)
+        attrs["output_tokens"] = attrs.get("output_tokens", 0) + (getattr(usage, "candidates_token_count", 0) or 0)
+
+
+def record_error(error: BaseException):
+    """Mark the current request as failed, for handlers that turn errors into replies"""
+    trace = _current.get()
+    if trace is not None:
+        trace.error = f"{type(error).__name__}: {error}"
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up, a sign of blocking code on the loop"""
+
+    def __init__(self, interval: float = 0.1, warn_threshold: float = 0.2, window: int = 600):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.lags: Deque[float] = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.warn_threshold:
+                print(f"Event loop lag: {lag * 1000:.0f} ms")
+
+    def stats(self) -> str:
+        if not self.lags:
+            return "event loop lag: no samples"
+        ordered = sorted(self.lags)
+        p99 = ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)]
+        return (f"event loop lag (last {len(ordered) * self.interval:.0f}s): p50 {ordered[len(ordered) // 2] * 1000:.1f} ms, "
+                f"p99 {p99 * 1000:.1f} ms, max since start {self.max_lag * 1000:.0f} ms")
+
+
+# Global tracer and loop monitor, shared by the bot and the web app
+tracer = Tracer(
+    slow_threshold=float(os.environ.get('SLOW_REQUEST_MS', '3000')) / 1000,
+    buffer_size=int(os.environ.get('SLOW_TRACE_BUFFER', '100')),
+    enabled=os.environ.get('TRACING_ENABLED', 'true').lower() == 'true',
+)
+loop_monitor = LoopLagMonitor(warn_threshold=float(os.environ.get('LOOP_LAG_WARN_MS', '200')) / 1000)
@@ -0,0 +1,125 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+from typing import Dict, Optional, Sequence
+import numpy as np
+
+# Snapshot file layout: magic, header length, JSON header, then raw arrays
+# aligned to 64 bytes so they can be mapped straight into numpy
+MAGIC = b"WARMSTATE2\n"
+ALIGN = 64
+# Strings are compressed in blocks of this many, so reading one doesn't decompress them all
+STRING_BLOCK = 64
+
+
+def _pack_strings(values: Sequence[str]):
+    """zlib-compressed blocks of UTF-8, with the offsets of the blocks and of each string once decompressed"""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    compressed = [zlib.compress(b"".join(encoded[i:i + STRING_BLOCK]))
+                  for i in range(0, len(encoded), STRING_BLOCK)]
+    blocks = np.zeros(len(compressed) + 1, dtype=np.int64)
+    np.cumsum([len(block) for block in compressed], out=blocks[1:])
+    return np.frombuffer(b"".join(compressed), dtype=np.uint8), blocks, offsets
+
+
+def write_snapshot(path: str, arrays: Optional[Dict[str, np.ndarray]] = None,
+                   strings: Optional[Dict[str, Sequence[str]]] = None, meta: Optional[Dict] = None):
+    """Atomically write arrays, string lists and JSON metadata to one file"""
+    blocks = dict(arrays or {})
+    for name, values in (strings or {}).items():
+        blocks[f"{name}.data"], blocks[f"{name}.blocks"], blocks[f"{name}.offsets"] = _pack_strings(values)
+
+    layout = {}
+    offset = 0
+    for name, array in blocks.items():
+        array = blocks[name] = np.ascontiguousarray(array)
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({"meta": meta or {}, "arrays": layout,
+                         "strings": {name: STRING_BLOCK for name in strings or {}}}).encode()
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, array in blocks.items():
+            f.seek(start + layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class PackedStrings(Sequence):
+    """Strings of a snapshot, decompressed a block at a time when accessed"""
+
+    def __init__(self, data: np.ndarray, blocks: np.ndarray, offsets: np.ndarray, block_size: int):
+        self.data = data
+        self.blocks = blocks
+        self.offsets = offsets
+        self.block_size = block_size
+        # (block number, decompressed block) of the last block read, strings are usually read in order
+        self._cached = (-1, b"")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        block = index // self.block_size
+        cached_block, text = self._cached
+        if cached_block != block:
+            text = zlib.decompress(self.data[self.blocks[block]:self.blocks[block + 1]])
+            self._cached = (block, text)
+        base = self.offsets[block * self.block_size]
+        return text[self.offsets[index] - base:self.offsets[index + 1] - base].decode("utf-8")
+
+
+class Snapshot:
+    """Read-only view of a snapshot file, arrays are memory-mapped rather than read"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a warm state snapshot")
+        (length,) = struct.unpack_from("<Q", self._map, len(MAGIC))
+        header = json.loads(self._map[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+        self.meta: Dict = header["meta"]
+        self._layout: Dict = header["arrays"]
+        self._strings: Dict[str, int] = header["strings"]
+        self._start = -(-(len(MAGIC) + 8 + length) // ALIGN) * ALIGN
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._layout or name in self._strings
+
+    def array(self, name: str) -> np.ndarray:
+        """A read-only array backed by the mapped file"""
+        info = self._layout[name]
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"], dtype=np.int64))
+        array = np.frombuffer(self._map, dtype=dtype, count=count, offset=self._start + info["offset"])
+        return array.reshape(info["shape"])
+
+    def strings(self, name: str) -> PackedStrings:
+        return PackedStrings(self.array(f"{name}.data"), self.array(f"{name}.blocks"),
+                             self.array(f"{name}.offsets"), self._strings[name])
+
+
+def read_snapshot(path: str) -> Optional[Snapshot]:
+    """Open a snapshot if there is one, a missing or unreadable file just means a cold start"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except Exception as e:
+        print(f"Ignoring warm state at {path}: {e}")
+        return None